@@ -0,0 +1,670 @@
+"""Prompt assembly, session reuse, reply caching and streaming for the AI Coach."""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import re
+import time
+import zlib
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+MAX_CONTEXT_HABITS = 15
+HISTORY_TURNS = 10
+HISTORY_TOKEN_BUDGET = 1500
+SUMMARY_QUESTIONS = 20
+
+FALLBACK_REPLY = (
+    "I'm having trouble reaching my coaching brain right now. While I recover, try this: "
+    "pick your smallest habit and do just two minutes of it. Please ask me again in a moment!"
+)
+
+T = TypeVar("T")
+
+SYSTEM_PROMPT = """You are a warm, encouraging habit coach for the 'Awesome Life Habits' app. 
+Your role is to help users build positive habits and mindfulness practices.
+
+Keep responses concise (2-4 sentences) and actionable.
+Use a calm, supportive tone. Celebrate wins, no matter how small.
+Suggest specific, practical tips when asked.
+Reference the user's existing habits when relevant to personalize advice.
+{habits_context}
+
+Focus areas: habit formation, mindfulness, focus exercises (flower observation, expanding circle, breath counting), 
+motivation, and the principles from Atomic Habits (start small, habit stacking, environment design)."""
+
+
+def build_habits_context(habits: List[dict], total_habits: int) -> str:
+    """Context lines for the strongest habits plus a one-line summary of the rest.
+
+    `habits` should already be sorted and capped (see MAX_CONTEXT_HABITS), so
+    prompt size stays flat however many habits the user has.
+    """
+    if not habits:
+        return ""
+    lines = ["", "", "User's current habits:"]
+    lines += [
+        f"- {h['name']} (streak: {h.get('streak', 0)} days, total: {h.get('total_completions', 0)} completions)"
+        for h in habits
+    ]
+    if total_habits > len(habits):
+        lines.append(f"- ...and {total_habits - len(habits)} more habits")
+    return "\n".join(lines) + "\n"
+
+
+def build_system_prompt(habits: List[dict], total_habits: int) -> str:
+    return SYSTEM_PROMPT.format(habits_context=build_habits_context(habits, total_habits))
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; close enough for budgeting
+    return len(text) // 4 + 1
+
+
+def build_history_context(messages: List[dict], max_turns: int = HISTORY_TURNS,
+                          token_budget: int = HISTORY_TOKEN_BUDGET) -> str:
+    """Prompt section carrying a conversation over into a fresh chat client.
+
+    `messages` are chronological `chat_messages` documents. The newest ones (at
+    most `max_turns` user/coach pairs) are replayed verbatim while they fit the
+    budget; older user questions are folded into a one-line summary with
+    whatever budget is left.
+    """
+    recent, used, cut = [], 0, len(messages)
+    for i in range(len(messages) - 1, max(len(messages) - 2 * max_turns, 0) - 1, -1):
+        speaker = "User" if messages[i]["role"] == "user" else "Coach"
+        line = f"{speaker}: {messages[i]['content']}"
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        recent.append(line)
+        used += cost
+        cut = i
+    recent.reverse()
+
+    lines = []
+    summary = "Earlier in this conversation the user asked about: "
+    used += estimate_tokens(summary)
+    topics = []
+    for question in reversed([m["content"] for m in messages[:cut] if m["role"] == "user"]):
+        topic = question if len(question) <= 80 else question[:77] + "..."
+        cost = estimate_tokens(topic) + 1
+        if used + cost > token_budget:
+            break
+        topics.append(topic)
+        used += cost
+    if topics:
+        lines += ["", summary + "; ".join(reversed(topics)) + "."]
+    if recent:
+        lines += ["", "Recent conversation:"] + recent
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class PromptCache:
+    """Memoized system prompts, keyed on a data version (e.g. the habits counter).
+
+    The version only sees this process's writes; `ttl` bounds staleness for
+    writes made elsewhere (other workers, direct database edits).
+    """
+
+    def __init__(self, max_entries: int = 128, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._prompts: "OrderedDict[Hashable, Tuple[float, Hashable, str]]" = OrderedDict()
+
+    def get(self, key: Hashable, version: Hashable) -> Optional[str]:
+        entry = self._prompts.get(key)
+        if entry is None or entry[1] != version:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._prompts[key]
+            return None
+        self._prompts.move_to_end(key)
+        return entry[2]
+
+    def put(self, key: Hashable, version: Hashable, prompt: str) -> None:
+        self._prompts[key] = (time.monotonic() + self.ttl, version, prompt)
+        self._prompts.move_to_end(key)
+        while len(self._prompts) > self.max_entries:
+            self._prompts.popitem(last=False)
+
+
+class ChatSessionPool:
+    """LRU pool of chat clients keyed by session id.
+
+    A pooled client is reused while its system prompt is unchanged and it has
+    served fewer than `max_turns` turns. A new prompt (the user's habits
+    changed) or a full client is replaced by `create`, whose `context` (the
+    windowed conversation so far) is appended to the prompt; that bounds both
+    prompt size and the history the client keeps in memory.
+    """
+
+    def __init__(self, factory: Callable[[str, str], object], max_sessions: int = 256,
+                 max_turns: Optional[int] = None):
+        self.factory = factory  # (session_id, system_message) -> chat client
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()  # [system_message, client, turns]
+
+    def lookup(self, session_id: str, system_message: str):
+        entry = self._sessions.get(session_id)
+        if entry is None or entry[0] != system_message:
+            return None
+        if self.max_turns is not None and entry[2] >= self.max_turns:
+            return None
+        entry[2] += 1
+        self._sessions.move_to_end(session_id)
+        return entry[1]
+
+    def create(self, session_id: str, system_message: str, context: str = ""):
+        chat = self.factory(session_id, system_message + context)
+        self._sessions[session_id] = [system_message, chat, 1]
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return chat
+
+    def get(self, session_id: str, system_message: str):
+        chat = self.lookup(session_id, system_message)
+        return chat if chat is not None else self.create(session_id, system_message)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, punctuation-free, single-spaced: "How do I keep my streak?!" -> "how do i keep my streak"."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def context_hash(system_message: str) -> str:
+    return hashlib.blake2b(system_message.encode(), digest_size=12).hexdigest()
+
+
+def hash_vector(normalized: str, dims: int = 1 << 18) -> Dict[int, float]:
+    """L2-normalized sparse hashing-vectorizer embedding of word unigrams and bigrams."""
+    words = normalized.split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector: Dict[int, float] = {}
+    for feature in features:
+        index = zlib.crc32(feature.encode()) % dims
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {i: v / norm for i, v in vector.items()} if norm else {}
+
+
+def cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+class SharedStream:
+    """One upstream token stream relayed to any number of subscribers.
+
+    The upstream is consumed by its own task, so one subscriber going away
+    doesn't cut off the others; each subscriber gets every token from the
+    first. Once the last subscriber leaves, the upstream call is cancelled.
+    """
+
+    def __init__(self, tokens: AsyncIterator[str]):
+        self.parts: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self.task = asyncio.ensure_future(self._pump(tokens))
+
+    async def _pump(self, tokens: AsyncIterator[str]) -> None:
+        try:
+            async for token in tokens:
+                self.parts.append(token)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            await tokens.aclose()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        self._subscribers += 1
+        sent = 0
+        try:
+            while True:
+                while sent < len(self.parts):
+                    sent += 1
+                    yield self.parts[sent - 1]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self._subscribers -= 1
+            if not self._subscribers and not self.done:
+                self.task.cancel()
+
+
+class ReplyCache:
+    """Coach replies keyed on (habits-context hash, normalized message).
+
+    With `similarity` set, a miss falls back to the closest cached message for
+    the same context whose hashing-vectorizer cosine is at least that value.
+    Concurrent requests for the same key share one upstream call, whether
+    they want the reply whole (`get_or_create`) or as tokens (`stream`).
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600.0, similarity: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[int, float], str]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._streams: Dict[Tuple[str, str], SharedStream] = {}
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def lookup(self, message: str, system_message: str) -> Optional[str]:
+        key = (context_hash(system_message), normalize_message(message))
+        reply = self._get(key)
+        if reply is None and self.similarity is not None:
+            reply = self._nearest(key)
+            if reply is not None:
+                self.semantic_hits += 1
+        if reply is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return reply
+
+    def store(self, message: str, system_message: str, reply: str) -> None:
+        key = (context_hash(system_message), normalize_message(message))
+        self._put(key, reply)
+
+    async def get_or_create(self, message: str, system_message: str, produce: Callable[[], Awaitable[str]]) -> str:
+        reply = self.lookup(message, system_message)
+        if reply is not None:
+            return reply
+        key = (context_hash(system_message), normalize_message(message))
+        shared = self._streams.get(key)
+        if shared is not None:
+            self.coalesced += 1
+            return "".join([token async for token in shared.subscribe()])
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(produce())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # Shielded so one caller disconnecting doesn't cancel the others' reply
+        return await asyncio.shield(task)
+
+    def stream(self, message: str, system_message: str,
+               produce: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Reply tokens: the cached reply, a share of the same reply in flight, or `produce()`.
+
+        A streamed reply that completes is stored in the cache.
+        """
+        reply = self.lookup(message, system_message)
+        if reply is not None:
+            return replay(reply)
+        key = (context_hash(system_message), normalize_message(message))
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return _replay_when_done(task)
+        shared = self._streams.get(key)
+        if shared is not None:
+            self.coalesced += 1
+        else:
+            shared = SharedStream(produce())
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda done: self._finish_stream(key, shared))
+        return shared.subscribe()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight) + len(self._streams),
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _finish(self, key: Tuple[str, str], task: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._put(key, task.result())
+
+    def _finish_stream(self, key: Tuple[str, str], shared: SharedStream) -> None:
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+        if not shared.task.cancelled() and shared.error is None:
+            self._put(key, "".join(shared.parts))
+
+    def _get(self, key: Tuple[str, str]) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def _put(self, key: Tuple[str, str], reply: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, hash_vector(key[1]), reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _nearest(self, key: Tuple[str, str]) -> Optional[str]:
+        vector = hash_vector(key[1])
+        now = time.monotonic()
+        best, best_score = None, self.similarity
+        for other, (expires, other_vector, _) in self._entries.items():
+            if other[0] != key[0] or expires < now:
+                continue
+            score = cosine(vector, other_vector)
+            if score >= best_score:
+                best, best_score = other, score
+        return self._get(best) if best is not None else None
+
+
+class CoachUnavailable(Exception):
+    """The provider call was refused (breaker open, no free slot) or failed."""
+
+
+class LlmGuard:
+    """Concurrency limit, timeouts and a circuit breaker around provider calls.
+
+    At most `max_concurrency` calls run at once and callers wait up to
+    `queue_timeout` seconds for a slot. A call gets `timeout` seconds (a stream
+    gets that long for its first token and for each gap after it).
+    `failure_threshold` consecutive failures open the breaker: calls are then
+    refused immediately for `reset_after` seconds, after which a single trial
+    call decides whether it closes again.
+
+    `observer`, if given, is called with ("send" or "stream", seconds) after
+    every call that got a slot.
+    """
+
+    def __init__(self, max_concurrency: int = 8, timeout: float = 30.0, queue_timeout: float = 2.0,
+                 failure_threshold: int = 5, reset_after: float = 30.0,
+                 observer: Optional[Callable[[str, float], None]] = None):
+        self.timeout = timeout
+        self.observer = observer
+        self.queue_timeout = queue_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._latencies: "deque[float]" = deque(maxlen=512)
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.short_circuited = 0
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        trial = await self._enter()
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(), self.timeout)
+        except asyncio.TimeoutError:
+            self._failed(timed_out=True)
+            raise CoachUnavailable(f"no reply within {self.timeout}s")
+        except Exception as e:
+            self._failed()
+            raise CoachUnavailable(str(e)) from e
+        finally:
+            self._leave(trial, start, "send")
+        self._succeeded()
+        return result
+
+    async def stream(self, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+        trial = await self._enter()
+        start = time.monotonic()
+        try:
+            while True:
+                try:
+                    token = await asyncio.wait_for(tokens.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self._failed(timed_out=True)
+                    raise CoachUnavailable(f"no token within {self.timeout}s")
+                except Exception as e:
+                    self._failed()
+                    raise CoachUnavailable(str(e)) from e
+                yield token
+        finally:
+            await tokens.aclose()
+            self._leave(trial, start, "stream")
+        self._succeeded()
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "short_circuited": self.short_circuited,
+            "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+        }
+
+    async def _enter(self) -> bool:
+        # Returns whether this call is the half-open trial
+        trial = False
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_after:
+                self.short_circuited += 1
+                raise CoachUnavailable("circuit open")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._trial:
+                self.short_circuited += 1
+                raise CoachUnavailable("circuit half-open, trial call in progress")
+            self._trial = trial = True
+
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            if trial:
+                self._trial = False
+            raise CoachUnavailable("too many concurrent requests")
+        except BaseException:
+            if trial:
+                self._trial = False
+            raise
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        self.calls += 1
+        return trial
+
+    def _leave(self, trial: bool, start: float, mode: str) -> None:
+        self._slots.release()
+        self.in_flight -= 1
+        elapsed = time.monotonic() - start
+        self._latencies.append(elapsed)
+        if trial:
+            self._trial = False
+        if self.observer is not None:
+            self.observer(mode, elapsed)
+
+    def _succeeded(self) -> None:
+        self._failures = 0
+        self.state = "closed"
+
+    def _failed(self, timed_out: bool = False) -> None:
+        self.failures += 1
+        self.timeouts += timed_out
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+
+class FakeLlmChat:
+    """Offline stand-in for LlmChat (COACH_LLM_PROVIDER=fake).
+
+    Replies with canned text after `first_token_delay` seconds, then one word
+    every `token_delay` seconds, which is enough to compare time-to-first-byte
+    of the blocking and streaming endpoints without network access.
+    """
+
+    REPLY = (
+        "Start with a version of the habit so small it feels easy, then stack it onto "
+        "something you already do every day. Small wins compound, so celebrate each one."
+    )
+
+    def __init__(self, session_id: str, system_message: str,
+                 first_token_delay: float = 0.5, token_delay: float = 0.02):
+        self.session_id = session_id
+        self.system_message = system_message
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    async def stream_message(self, message) -> AsyncIterator[str]:
+        await asyncio.sleep(self.first_token_delay)
+        for i, word in enumerate(self.REPLY.split(" ")):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+    async def send_message(self, message) -> str:
+        return "".join([token async for token in self.stream_message(message)])
+
+
+class SendOnlyChat:
+    """A chat client reduced to `send_message`, as LlmChat is (COACH_LLM_PROVIDER=fake-blocking).
+
+    Lets benchmarks measure what /chat/stream does for a provider that can't stream.
+    """
+
+    def __init__(self, chat):
+        self.chat = chat
+
+    async def send_message(self, message) -> str:
+        return await self.chat.send_message(message)
+
+
+class GeminiChat:
+    """Chat client on the google-genai SDK, which streams (LlmChat only has `send_message`).
+
+    `client` is a `google.genai.Client`; the conversation lives in the SDK's
+    chat session, as it does in LlmChat's. Messages may be UserMessage objects
+    or plain strings.
+    """
+
+    def __init__(self, client, session_id: str, system_message: str, model: str = "gemini-2.0-flash"):
+        self.session_id = session_id
+        self.system_message = system_message
+        self._chat = client.aio.chats.create(model=model, config={"system_instruction": system_message})
+
+    async def stream_message(self, message) -> AsyncIterator[str]:
+        chunks = await self._chat.send_message_stream(getattr(message, "text", message))
+        try:
+            async for chunk in chunks:
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            # Closing the SDK stream drops the HTTP response, stopping generation
+            close = getattr(chunks, "aclose", None)
+            if close is not None:
+                await close()
+
+    async def send_message(self, message) -> str:
+        response = await self._chat.send_message(getattr(message, "text", message))
+        return response.text or ""
+
+
+async def stream_reply(chat, message) -> AsyncIterator[str]:
+    """Reply tokens as the provider produces them.
+
+    Clients without `stream_message` (LlmChat) are relayed as a single chunk
+    once `send_message` returns, i.e. after the full completion time.
+    """
+    stream = getattr(chat, "stream_message", None)
+    if stream is None:
+        yield await chat.send_message(message)
+        return
+    async for token in stream(message):
+        yield token
+
+
+async def _replay_when_done(task: asyncio.Future) -> AsyncIterator[str]:
+    yield await asyncio.shield(task)
+
+
+def sse_event(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+async def replay(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def sse_reply(tokens: AsyncIterator[str], session_id: str,
+                    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+                    fallback: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Server-Sent Events for one reply: `session`, then `token`s, then `done`.
+
+    If the client goes away the response task is cancelled, and the
+    cancellation reaches the provider call we are awaiting, so no more tokens
+    are generated for nobody. `on_complete` gets the full text of a reply that
+    finished. A reply that fails before its first token is replaced by
+    `fallback` (flagged in the `done` event); a later failure ends the stream
+    with an `error` event.
+    """
+    yield sse_event("session", {"session_id": session_id})
+    parts = []
+    try:
+        async for token in tokens:
+            parts.append(token)
+            yield sse_event("token", {"text": token})
+    except Exception as e:
+        # Headers are already sent, so the failure goes out as an event
+        logging.error(f"AI Coach error: {str(e)}")
+        if parts or fallback is None:
+            yield sse_event("error", {"detail": "AI Coach error"})
+        else:
+            yield sse_event("token", {"text": fallback})
+            yield sse_event("done", {"fallback": True})
+        return
+    finally:
+        await tokens.aclose()
+    if on_complete is not None:
+        await on_complete("".join(parts))
+    yield sse_event("done", {})
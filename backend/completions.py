@@ -0,0 +1,349 @@
+"""Compact storage for habit completions.
+
+Completions are stored per habit-year as a day-of-year bitmap in
+`completion_bits`, e.g. `{"y2024": [w0, ..., w11]}`, where bit `n % 32` of
+word `n // 32` marks day-of-year `n + 1`. Plain integer words (rather than
+BSON binary) keep the bitmap editable from an aggregation-pipeline update, so
+logging stays a single atomic round trip. The API still exposes `completions`
+as a sorted list of `YYYY-MM-DD` strings.
+"""
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from streaks import STREAK_GAP_DAYS, StreakState
+
+WORD_BITS = 32
+WORDS_PER_YEAR = 12  # ceil(366 / WORD_BITS)
+
+DayLike = Union[date, str]
+
+
+def _as_day(value: DayLike) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(value[:10])
+
+
+def _slot(day: date) -> Tuple[str, int, int]:
+    ordinal = day.timetuple().tm_yday - 1
+    return f"y{day.year}", ordinal // WORD_BITS, ordinal % WORD_BITS
+
+
+@lru_cache(maxsize=64)
+def _year_isoformats(year: int) -> Tuple[str, ...]:
+    # One string per bit of a year's words (the last few spill into January)
+    jan_first = date(year, 1, 1)
+    return tuple((jan_first + timedelta(days=i)).isoformat() for i in range(WORDS_PER_YEAR * WORD_BITS))
+
+
+class CompletionBitmap:
+    """Set of completion dates backed by per-year bitmaps."""
+
+    __slots__ = ("_years",)
+
+    def __init__(self, years: Optional[Dict[int, List[int]]] = None):
+        self._years: Dict[int, List[int]] = years or {}
+
+    @classmethod
+    def from_doc(cls, doc: Optional[dict]) -> "CompletionBitmap":
+        years = {}
+        for key, words in (doc or {}).items():
+            padded = list(words) + [0] * (WORDS_PER_YEAR - len(words))
+            years[int(key[1:])] = [int(w) for w in padded]
+        return cls(years)
+
+    @classmethod
+    def from_days(cls, days: Iterable[DayLike]) -> "CompletionBitmap":
+        bitmap = cls()
+        for day in days:
+            bitmap.add(day)
+        return bitmap
+
+    def to_doc(self) -> dict:
+        return {f"y{year}": list(words) for year, words in sorted(self._years.items()) if any(words)}
+
+    def __contains__(self, day: DayLike) -> bool:
+        day = _as_day(day)
+        words = self._years.get(day.year)
+        if words is None:
+            return False
+        _, word, bit = _slot(day)
+        return bool(words[word] >> bit & 1)
+
+    def add(self, day: DayLike) -> None:
+        day = _as_day(day)
+        _, word, bit = _slot(day)
+        self._years.setdefault(day.year, [0] * WORDS_PER_YEAR)[word] |= 1 << bit
+
+    def discard(self, day: DayLike) -> None:
+        day = _as_day(day)
+        words = self._years.get(day.year)
+        if words is not None:
+            _, word, bit = _slot(day)
+            words[word] &= ~(1 << bit)
+
+    def __len__(self) -> int:
+        return sum(w.bit_count() for words in self._years.values() for w in words)
+
+    def __iter__(self) -> Iterator[date]:
+        return self.days()
+
+    def days(self, start: Optional[DayLike] = None, end: Optional[DayLike] = None) -> Iterator[date]:
+        """Completion dates in ascending order, optionally limited to [start, end]."""
+        start = _as_day(start) if start is not None else None
+        end = _as_day(end) if end is not None else None
+        for year in sorted(self._years):
+            if (start and year < start.year) or (end and year > end.year):
+                continue
+            jan_first = date(year, 1, 1)
+            for index, word in enumerate(self._years[year]):
+                while word:
+                    low = word & -word
+                    day = jan_first + timedelta(days=index * WORD_BITS + low.bit_length() - 1)
+                    word ^= low
+                    if start and day < start:
+                        continue
+                    if end and day > end:
+                        return
+                    yield day
+
+    def count(self, start: Optional[DayLike] = None, end: Optional[DayLike] = None) -> int:
+        if start is None and end is None:
+            return len(self)
+        return sum(1 for _ in self.days(start, end))
+
+    def isoformat(self, start: Optional[DayLike] = None, end: Optional[DayLike] = None) -> List[str]:
+        """days() as YYYY-MM-DD strings, looked up per bit rather than built from dates."""
+        start = _as_day(start).isoformat() if start is not None else None
+        end = _as_day(end).isoformat() if end is not None else None
+        result = []
+        for year in sorted(self._years):
+            if (start and year < int(start[:4])) or (end and year > int(end[:4])):
+                continue
+            names = _year_isoformats(year)
+            days = []
+            for index, word in enumerate(self._years[year]):
+                base = index * WORD_BITS - 1
+                while word:
+                    low = word & -word
+                    days.append(names[base + low.bit_length()])
+                    word ^= low
+            if start or end:
+                days = [d for d in days if (not start or d >= start) and (not end or d <= end)]
+            result.extend(days)
+        return result
+
+
+def completion_fields(days: Iterable[DayLike], today: date) -> dict:
+    """Every stored field derived from a full set of completion dates."""
+    bitmap = CompletionBitmap.from_days(days)
+    return _stored_fields(bitmap, StreakState.from_days(bitmap), today)
+
+
+def log_fields(habit: dict, day: date, completed: bool, today: date) -> Optional[dict]:
+    """Python counterpart of completion_update_pipeline for an already-fetched habit.
+
+    Returns the fields to `$set`, or None if `day` is already in the requested state.
+    """
+    bitmap = CompletionBitmap.from_doc(habit.get("completion_bits"))
+    if (day in bitmap) == completed:
+        return None
+    if completed:
+        bitmap.add(day)
+    else:
+        bitmap.discard(day)
+    state = StreakState.from_doc(habit.get("streak_state"))
+    state = state.log(day, completed, bitmap) if state else StreakState.from_days(bitmap)
+    return _stored_fields(bitmap, state, today)
+
+
+def _stored_fields(bitmap: CompletionBitmap, state: StreakState, today: date) -> dict:
+    return {
+        "completion_bits": bitmap.to_doc(),
+        "streak_state": state.to_doc(),
+        "last_completed": state.end.isoformat() if state.end else None,
+        "total_completions": len(bitmap),
+        "streak": state.current(today),
+        "longest_streak": state.longest,
+    }
+
+
+# ----- Aggregation-pipeline update -----
+
+def _word_expr(day: date) -> dict:
+    key, word, _ = _slot(day)
+    return {"$ifNull": [{"$arrayElemAt": [f"$completion_bits.{key}", word]}, 0]}
+
+
+def _has_day_expr(day: date) -> dict:
+    # Words stay below 2**32, so the division is exact in a double.
+    _, _, bit = _slot(day)
+    return {"$eq": [{"$mod": [{"$floor": {"$divide": [_word_expr(day), 1 << bit]}}, 2]}, 1]}
+
+
+def current_streak_expr(today: date) -> dict:
+    """StreakState.current(today) over the stored `streak_state`, as an expression.
+
+    Stored `streak` is as of the day the habit was last logged (or the last
+    nightly decay); this gives the run length as of `today`, a user's local day.
+    """
+    yesterday = (today - timedelta(days=1)).isoformat()
+    return {"$cond": [
+        {"$and": [
+            {"$gte": ["$streak_state.end", yesterday]},
+            {"$lte": ["$streak_state.end", today.isoformat()]},
+        ]},
+        "$streak_state.length",
+        0,
+    ]}
+
+
+def day_groups_pipeline(match: dict, since: Optional[date] = None) -> list:
+    """Aggregation grouping the completions of habits matching `match` by owner and day.
+
+    MongoDB expands the bitmaps and groups them (spilling to disk if need be),
+    so callers stream one small document per (user, year, bit) holding the
+    habit ids completed that day, sorted by user then date. `slot_isoformat`
+    turns `year` and `slot` back into the date. With `since`, earlier days
+    are left out (and earlier years never expanded).
+    """
+    word = {"$ifNull": [{"$arrayElemAt": ["$years.v", {"$floor": {"$divide": ["$$n", WORD_BITS]}}]}, 0]}
+    is_set = {"$eq": [{"$mod": [{"$floor": {"$divide": [word, {"$pow": [2, {"$mod": ["$$n", WORD_BITS]}]}]}}, 2]}, 1]}
+    recent = []
+    if since is not None:
+        year_key = f"y{since.year}"
+        first = since.timetuple().tm_yday - 1
+        recent = [{"$match": {"years.k": {"$gte": year_key}}}]
+        is_set = {"$and": [{"$or": [{"$gt": ["$years.k", year_key]}, {"$gte": ["$$n", first]}]}, is_set]}
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id": 0, "user_id": 1, "id": 1, "years": {"$objectToArray": {"$ifNull": ["$completion_bits", {}]}},
+        }},
+        {"$unwind": "$years"},
+        *recent,
+        {"$project": {"user_id": 1, "id": 1, "year": "$years.k", "slots": {"$filter": {
+            "input": list(range(WORDS_PER_YEAR * WORD_BITS)), "as": "n", "cond": is_set,
+        }}}},
+        {"$unwind": "$slots"},
+        {"$group": {"_id": {"user_id": "$user_id", "year": "$year", "slot": "$slots"}, "habit_ids": {"$push": "$id"}}},
+        {"$sort": {"_id.user_id": 1, "_id.year": 1, "_id.slot": 1}},
+    ]
+
+
+def slot_isoformat(year_key: str, slot: int) -> Optional[str]:
+    """The date of bit `slot` in a `completion_bits` year ("y2024"); None past December 31st."""
+    day = _year_isoformats(int(year_key[1:]))[slot]
+    return day if day[:4] == year_key[1:] else None
+
+
+def stats_pipeline(window: List[date], user_id: Optional[str] = None) -> list:
+    """Habit totals plus one completion count per day in `window`, as a single group.
+
+    Streaks are counted as of the window's last day, so a window ending on a
+    user's local today sums their current streaks. Stale states (awaiting a
+    rescan) count their stored `streak`. With `user_id`, only that user's
+    habits are counted.
+    """
+    streak = {"$cond": [
+        {"$eq": [{"$ifNull": ["$streak_state.stale", False]}, True]}, "$streak", current_streak_expr(window[-1]),
+    ]}
+    group = {
+        "_id": None,
+        "total_habits": {"$sum": 1},
+        "total_completions": {"$sum": "$total_completions"},
+        "total_streak": {"$sum": streak},
+        "max_streak": {"$max": streak},
+    }
+    for i, day in enumerate(window):
+        group[f"day_{i}"] = {"$sum": {"$cond": [_has_day_expr(day), 1, 0]}}
+    match = [] if user_id is None else [{"$match": {"user_id": user_id}}]
+    return match + [{"$group": group}]
+
+
+def _state(start, end, length, best_before) -> dict:
+    return {"start": start, "end": end, "length": length, "best_before": best_before}
+
+
+def _next_state_expr(target: date, completed: bool) -> dict:
+    """StreakState.log over `$_prev`; anything else marks the state stale for a rescan."""
+    prev = "$_prev"
+    day = target.isoformat()
+    length = f"{prev}.length"
+    best_before = f"{prev}.best_before"
+    if completed:
+        branches = [
+            {"case": "$_had", "then": prev},
+            {"case": {"$gt": [day, f"{prev}.end"]}, "then": {"$cond": [
+                {"$gte": [f"{prev}.end", (target - timedelta(days=STREAK_GAP_DAYS)).isoformat()]},
+                _state(f"{prev}.start", day, {"$add": [length, 1]}, best_before),
+                _state(day, day, 1, {"$max": [best_before, length]}),
+            ]}},
+            {"case": {"$and": [{"$gt": [day, f"{prev}.start"]}, {"$lt": [day, f"{prev}.end"]}]},
+             "then": _state(f"{prev}.start", f"{prev}.end", {"$add": [length, 1]}, best_before)},
+        ]
+    else:
+        branches = [
+            {"case": {"$eq": ["$_had", False]}, "then": prev},
+            {"case": {"$and": [{"$eq": [day, f"{prev}.end"]}, {"$gt": [length, 1]}]}, "then": _state(
+                f"{prev}.start",
+                {"$cond": [
+                    "$_had_1",
+                    (target - timedelta(days=1)).isoformat(),
+                    (target - timedelta(days=2)).isoformat(),
+                ]},
+                {"$subtract": [length, 1]},
+                best_before,
+            )},
+        ]
+    stale = {**_state(f"{prev}.start", f"{prev}.end", length, best_before), "stale": True}
+    return {"$switch": {
+        "branches": [
+            {"case": {"$eq": ["$total_completions", 0]}, "then": _state(None, None, 0, 0)},
+            {"case": {"$eq": [{"$ifNull": [f"{prev}.stale", False]}, True]}, "then": stale},
+            {"case": {"$eq": [{"$ifNull": [f"{prev}.end", None]}, None]}, "then": {"$cond": [
+                {"$and": [completed, {"$eq": ["$total_completions", 1]}]}, _state(day, day, 1, 0), stale,
+            ]}},
+        ] + branches,
+        "default": stale,
+    }}
+
+
+def completion_update_pipeline(target_date: str, completed: bool, today: date) -> list:
+    """Pipeline update that flips one completion bit and refreshes the derived fields.
+
+    The whole read-modify-write happens inside a single server-side update, so
+    concurrent logs against the same habit can't overwrite each other. If the
+    streak state can't be updated incrementally it is flagged `stale` and the
+    caller rescans the bitmap (see completion_fields).
+    """
+    target = _as_day(target_date)
+    key, word, bit = _slot(target)
+    mask = 1 << bit
+    delta = {"$cond": ["$_had", 0, 1]} if completed else {"$cond": ["$_had", -1, 0]}
+
+    flags = {"_prev": "$streak_state", "_had": _has_day_expr(target)}
+    if not completed:
+        flags["_had_1"] = _has_day_expr(target - timedelta(days=1))
+
+    return [
+        {"$set": flags},
+        {"$set": {
+            f"completion_bits.{key}": {"$map": {
+                "input": list(range(WORDS_PER_YEAR)),
+                "as": "i",
+                "in": {"$cond": [
+                    {"$eq": ["$$i", word]},
+                    {"$add": [_word_expr(target), {"$multiply": [delta, mask]}]},
+                    {"$ifNull": [{"$arrayElemAt": [f"$completion_bits.{key}", "$$i"]}, 0]},
+                ]},
+            }},
+            "total_completions": {"$add": [{"$ifNull": ["$total_completions", 0]}, delta]},
+        }},
+        {"$set": {"streak_state": _next_state_expr(target, completed)}},
+        {"$set": {
+            "last_completed": "$streak_state.end",
+            "streak": current_streak_expr(today),
+            "longest_streak": {"$max": ["$streak_state.best_before", "$streak_state.length"]},
+        }},
+        {"$project": {"_prev": 0, "_had": 0, "_had_1": 0}},
+    ]
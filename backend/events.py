@@ -0,0 +1,102 @@
+"""Change events pushed to browsers over the /api/ws WebSocket.
+
+Mutation routes publish small deltas, which clients apply instead of
+re-downloading whole collections:
+
+    {"type": "habit.logged", "log": {"id": "...", "date": "2024-05-01", "completed": true, "streak": 3, ...}}
+    {"type": "post.liked", "id": "...", "likes": 12}
+    {"type": "resync"}    # too much changed (or this client fell behind): refetch
+
+Habit events go to the owning user's sockets only; community events go to
+everyone. The hub is per process. With several workers, `relay_change_stream`
+can source events from a MongoDB change stream instead, so every worker sees
+every write.
+"""
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RESYNC = {"type": "resync"}
+
+
+class EventHub:
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._subscribers: Dict[asyncio.Queue, Optional[str]] = {}  # queue -> user id
+        self.published = 0
+        self.overflows = 0
+
+    @contextmanager
+    def subscribe(self, user_id: Optional[str] = None) -> Iterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(self.max_queue)
+        self._subscribers[queue] = user_id
+        try:
+            yield queue
+        finally:
+            self._subscribers.pop(queue, None)
+
+    def publish(self, event: dict, user_id: Optional[str] = None) -> None:
+        """Deliver `event` to `user_id`'s subscribers, or to all of them if None."""
+        self.published += 1
+        for queue, subscriber in self._subscribers.items():
+            if user_id is not None and subscriber != user_id:
+                continue
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A slow client must not hold up writers: drop its backlog and
+                # have it refetch instead
+                self.overflows += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+
+async def serve_events(websocket, hub: EventHub, user_id: Optional[str] = None) -> None:
+    """Forward hub events to one WebSocket until the client disconnects."""
+    await websocket.accept()
+    with hub.subscribe(user_id) as queue:
+        async def forward():
+            while True:
+                await websocket.send_json(await queue.get())
+
+        sender = asyncio.create_task(forward())
+        try:
+            # Clients don't send anything; this only waits for the disconnect
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            sender.cancel()
+
+
+async def relay_change_stream(db, hub: EventHub,
+                              mappers: Dict[str, Callable[[dict], Optional[Tuple[dict, Optional[str]]]]],
+                              retry_after: float = 5.0) -> None:
+    """Publish events for changes to the collections in `mappers` (needs a replica set).
+
+    Each mapper turns a change document into an (event, user id or None)
+    pair, or None to skip it. The stream resumes from the last seen token
+    after errors.
+    """
+    pipeline = [{"$match": {"ns.coll": {"$in": list(mappers)}}}]
+    resume_after = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_after) as stream:
+                async for change in stream:
+                    resume_after = stream.resume_token
+                    mapped = mappers[change["ns"]["coll"]](change)
+                    if mapped is not None:
+                        hub.publish(*mapped)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Change stream failed, retrying in {retry_after}s: {str(e)}")
+            hub.publish(RESYNC)
+            await asyncio.sleep(retry_after)
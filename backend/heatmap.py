@@ -0,0 +1,117 @@
+"""Per-year completion calendars for heatmaps.
+
+A calendar is one habit-year of `completion_bits` (see completions.py), sent in
+one of two compact forms instead of a list of date strings:
+
+- "bitmap": base64 of ceil(days/8) bytes; bit `j` (least significant first)
+  of byte `i` marks day-of-year `8 * i + j + 1`. A year is 64 characters.
+- "ranges": runs of consecutive completed days as `[first, last]` ISO dates.
+
+`CalendarCache` keeps the year words read from MongoDB per (user, habit, year)
+so repeat heatmap loads skip the round trip; habit writes invalidate the
+affected year.
+"""
+import base64
+import calendar
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from completions import WORD_BITS, WORDS_PER_YEAR, CompletionBitmap
+
+FORMATS = ("bitmap", "ranges")
+
+
+def year_length(year: int) -> int:
+    return 366 if calendar.isleap(year) else 365
+
+
+def year_words(bits: Optional[dict], year: int) -> List[int]:
+    """A year's words from a `completion_bits` document, padded to a full year."""
+    words = [int(w) for w in (bits or {}).get(f"y{year}", [])]
+    return words + [0] * (WORDS_PER_YEAR - len(words))
+
+
+def encode_bitmap(words: List[int], year: int) -> str:
+    days = year_length(year)
+    data = bytearray(b"".join((w & 0xFFFFFFFF).to_bytes(WORD_BITS // 8, "little") for w in words))
+    del data[(days + 7) // 8:]
+    if days % 8:
+        data[-1] &= (1 << days % 8) - 1  # no bits past December 31st
+    return base64.b64encode(bytes(data)).decode("ascii")
+
+
+def encode_ranges(words: List[int], year: int) -> List[List[str]]:
+    ranges = []
+    first = last = None
+    for day in CompletionBitmap({year: words}).days(date(year, 1, 1), date(year, 12, 31)):
+        if last is not None and day.toordinal() == last.toordinal() + 1:
+            last = day
+            continue
+        if first is not None:
+            ranges.append([first.isoformat(), last.isoformat()])
+        first = last = day
+    if first is not None:
+        ranges.append([first.isoformat(), last.isoformat()])
+    return ranges
+
+
+def habit_calendar(habit_id: str, year: int, words: List[int], fmt: str = "bitmap") -> dict:
+    bitmap = CompletionBitmap({year: words})
+    entry = {"habit_id": habit_id, "count": bitmap.count(date(year, 1, 1), date(year, 12, 31))}
+    if fmt == "ranges":
+        entry["ranges"] = encode_ranges(words, year)
+    else:
+        entry["bitmap"] = encode_bitmap(words, year)
+    return entry
+
+
+class CalendarCache:
+    """LRU of year words per (user, habit), each year expiring after `ttl` seconds.
+
+    The TTL bounds staleness for writes made by other worker processes.
+    """
+
+    def __init__(self, max_habits: int = 4096, ttl: float = 60.0):
+        self.max_habits = max_habits
+        self.ttl = ttl
+        self._habits: "OrderedDict[Tuple[str, str], Dict[int, Tuple[float, List[int]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str, habit_id: str, year: int) -> Optional[List[int]]:
+        years = self._habits.get((user_id, habit_id))
+        entry = years.get(year) if years else None
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._habits.move_to_end((user_id, habit_id))
+        return entry[1]
+
+    def put(self, user_id: str, habit_id: str, year: int, words: List[int]) -> None:
+        key = (user_id, habit_id)
+        self._habits.setdefault(key, {})[year] = (time.monotonic() + self.ttl, words)
+        self._habits.move_to_end(key)
+        while len(self._habits) > self.max_habits:
+            self._habits.popitem(last=False)
+
+    def invalidate(self, user_id: str, habit_id: str, year: Optional[int] = None) -> None:
+        """Forget one year of a habit, or all of them."""
+        if year is None:
+            self._habits.pop((user_id, habit_id), None)
+        else:
+            self._habits.get((user_id, habit_id), {}).pop(year, None)
+
+    def clear(self) -> None:
+        self._habits.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "habits": len(self._habits),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
@@ -0,0 +1,84 @@
+"""Index definitions and query-plan checks, run from the server startup hook."""
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "habits": [
+        IndexModel([("user_id", ASCENDING), ("id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "community_posts": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "community_rankings": [
+        IndexModel([("rank", ASCENDING)], unique=True),
+    ],
+    "daily_rollups": [
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("habit_ids", ASCENDING)]),
+    ],
+    "chat_messages": [
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+    ],
+}
+
+# Representative query shapes used by the routes: name -> (collection, filter, sort)
+ROUTE_QUERIES = {
+    "habit by id": ("habits", {"user_id": "plan-check", "id": "plan-check"}, None),
+    "habits page": ("habits", {"user_id": "plan-check"}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    "post by id": ("community_posts", {"id": "plan-check"}, None),
+    "community feed": ("community_posts", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    "top posts": ("community_rankings", {}, [("rank", ASCENDING)]),
+    "rollups range": (
+        "daily_rollups", {"user_id": "plan-check", "date": {"$gte": "2024-01-01", "$lte": "2024-12-31"}}, None
+    ),
+    "rollups by habit": ("daily_rollups", {"user_id": "plan-check", "habit_ids": "plan-check"}, None),
+    "chat history": (
+        "chat_messages", {"user_id": "plan-check", "session_id": "plan-check"},
+        [("created_at", DESCENDING), ("id", DESCENDING)]
+    ),
+}
+
+
+async def ensure_indexes(db) -> None:
+    for name, models in INDEXES.items():
+        try:
+            await db[name].create_indexes(models)
+        except OperationFailure as e:
+            # Most likely duplicate ids in existing data; keep serving and say so loudly
+            logger.error(f"Could not create indexes on {name}: {e}")
+
+
+def plan_stages(plan) -> List[str]:
+    """Every `stage` name in an explain() plan tree, whatever its nesting."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages += plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages += plan_stages(item)
+    return stages
+
+
+async def check_query_plans(db) -> Dict[str, List[str]]:
+    """Explain each route query; returns the winning plan's stages per query."""
+    results = {}
+    for label, (collection, query, sort) in ROUTE_QUERIES.items():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained = await cursor.explain()
+        stages = plan_stages(explained.get("queryPlanner", {}).get("winningPlan", {}))
+        if not any("IXSCAN" in stage for stage in stages):
+            logger.warning(f"Query '{label}' on {collection} is not using an index: {stages}")
+        results[label] = stages
+    return results
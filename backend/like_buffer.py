@@ -0,0 +1,100 @@
+"""Write-coalescing buffer for community post likes.
+
+Likes are counted in process and flushed as one unordered bulk_write of
+`$inc`s, so a burst of clicks on one post becomes a single update per flush
+instead of a write per click.
+
+Delivery is at-least-once: a failed flush puts its counts back to be retried,
+and the server flushes once more on shutdown. Counts are per process, so
+read-your-writes (`pending`) holds for requests served by the same worker.
+
+The buffer also remembers the stored count of recently liked posts
+(`remember`), so repeat clicks on a hot post don't read it each time; a
+post's count is forgotten once its likes are flushed, so the next click reads
+the new total (other workers' likes included) at most once per flush.
+`on_flush` runs after each write, which is when cached feeds go stale.
+"""
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from typing import Callable, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    def __init__(self, flush_interval: float = 1.0, on_flush: Optional[Callable[[], None]] = None,
+                 max_known: int = 10000):
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.max_known = max_known
+        self._pending: Counter = Counter()
+        self._flushing: Counter = Counter()  # taken by a flush that hasn't been acknowledged yet
+        self._known: "OrderedDict[str, int]" = OrderedDict()  # post id -> stored likes
+        self.likes = 0
+        self.flushes = 0
+        self.writes = 0
+
+    def add(self, post_id: str, count: int = 1) -> None:
+        self._pending[post_id] += count
+        self.likes += count
+
+    def pending(self, post_id: str) -> int:
+        """Likes accepted but not yet written for `post_id`."""
+        return self._pending[post_id] + self._flushing[post_id]
+
+    def remember(self, post_id: str, stored_likes: int) -> None:
+        self._known[post_id] = stored_likes
+        self._known.move_to_end(post_id)
+        while len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+
+    def count(self, post_id: str) -> Optional[int]:
+        """Stored plus pending likes, or None if the stored count isn't known (read it, then `remember`)."""
+        stored = self._known.get(post_id)
+        if stored is None:
+            return None
+        self._known.move_to_end(post_id)
+        return stored + self.pending(post_id)
+
+    async def flush(self, db) -> int:
+        """Write out everything pending; returns the number of posts updated."""
+        if not self._pending or self._flushing:
+            return 0
+        self._flushing, self._pending = self._pending, Counter()
+        ops = [UpdateOne({"id": post_id}, {"$inc": {"likes": count}}) for post_id, count in self._flushing.items()]
+        try:
+            await db.community_posts.bulk_write(ops, ordered=False)
+        except BaseException:
+            # Including cancellation: retry the whole batch next time; an $inc
+            # that did land is then counted twice
+            self._pending.update(self._flushing)
+            raise
+        finally:
+            flushed, self._flushing = self._flushing, Counter()
+        for post_id in flushed:
+            self._known.pop(post_id, None)
+        self.flushes += 1
+        self.writes += len(ops)
+        if self.on_flush is not None:
+            self.on_flush()
+        return len(ops)
+
+    async def run(self, db) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush(db)
+            except Exception as e:
+                logger.error(f"Flushing likes failed, will retry: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "likes": self.likes,
+            "flushes": self.flushes,
+            "writes": self.writes,
+            "pending_posts": len(self._pending),
+            "pending_likes": sum(self._pending.values()),
+        }
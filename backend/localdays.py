@@ -0,0 +1,62 @@
+"""Local days for users outside UTC.
+
+Completions, streaks and stats windows are all keyed by `YYYY-MM-DD` day
+strings. Which day "today" is depends on the user's timezone: a log at 21:00
+in Los Angeles belongs to that evening, not to tomorrow's UTC date. Requests
+name their zone in the `X-Timezone` header (an IANA name such as
+"America/Los_Angeles"); without one the day is UTC's.
+
+`resolve_timezone` caches name lookups, including misses, so a bad header
+doesn't cost a tzdata search on every request. `DayClock` keeps each zone's
+current date until the zone's next local midnight, found through zoneinfo
+so DST days (23 or 25 hours long) end at the right instant; in between,
+`today()` is a dict lookup and a comparison.
+"""
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TIMEZONE = "UTC"
+
+
+@lru_cache(maxsize=1024)
+def resolve_timezone(name: Optional[str]) -> Optional[tzinfo]:
+    """The zone for an IANA name; empty means UTC and unknown names give None."""
+    if not name or name == DEFAULT_TIMEZONE:
+        return timezone.utc
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def local_midnight(day: date, tz: tzinfo) -> datetime:
+    """The UTC instant `day` starts in `tz`."""
+    return datetime.combine(day, time(0), tzinfo=tz).astimezone(timezone.utc)
+
+
+class DayClock:
+    """Current local date per zone, recomputed only once a local midnight passes."""
+
+    def __init__(self):
+        self._days: Dict[tzinfo, Tuple[datetime, datetime, date]] = {}
+
+    def today(self, tz: tzinfo, now: Optional[datetime] = None) -> date:
+        now = now or datetime.now(timezone.utc)
+        entry = self._days.get(tz)
+        if entry is not None and entry[0] <= now < entry[1]:
+            return entry[2]
+        day = now.astimezone(tz).date()
+        start, end = local_midnight(day, tz), local_midnight(day + timedelta(days=1), tz)
+        if start <= now < end:
+            self._days[tz] = (start, end, day)
+        return day
+
+
+day_clock = DayClock()
+
+
+def local_today(name: Optional[str] = None, now: Optional[datetime] = None) -> date:
+    """Today's date in the zone called `name` (UTC if unknown; routes reject those first)."""
+    return day_clock.today(resolve_timezone(name) or timezone.utc, now)
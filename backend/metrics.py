@@ -0,0 +1,303 @@
+"""Request, MongoDB and LLM timings, exposed at /api/metrics in Prometheus text format.
+
+- `MetricsMiddleware` times every HTTP request per route template.
+- `MongoCommandTimer` (a pymongo CommandListener) times each database round
+  trip and counts them per request.
+- `TimedRoute` separates the endpoint body from FastAPI's response-model
+  validation and serialization.
+- LLM call durations come from `LlmGuard(observer=observe_llm)`.
+
+With SERVER_TIMING=on, a request that sends `X-Server-Timing: 1` gets a
+Server-Timing header with its own breakdown (db, app, render, llm), which
+browser dev tools display next to the request.
+"""
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 32)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels[n] for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; safe to observe from pymongo's executor threads."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels[n] for n in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(series[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """A value read from `fn` at scrape time."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def collect(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_number(self.fn())}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric  # re-registering a name replaces it
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        return self._add(Gauge(name, help, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_seconds = registry.histogram(
+    "http_request_duration_seconds", "Time to response headers, per route template.", ("method", "route", "status")
+)
+render_seconds = registry.histogram(
+    "http_response_render_seconds",
+    "Handler time outside the endpoint: body parsing, dependencies, response validation and serialization.",
+    ("route",)
+)
+request_db_commands = registry.histogram(
+    "http_request_mongodb_commands", "MongoDB round trips made while serving one request.", ("route",), COUNT_BUCKETS
+)
+mongo_seconds = registry.histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round-trip time.", ("command",)
+)
+mongo_failures = registry.counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error.", ("command",)
+)
+llm_seconds = registry.histogram(
+    "coach_llm_duration_seconds", "AI Coach provider call duration (whole stream for streaming replies).",
+    ("mode",), LLM_BUCKETS
+)
+
+
+# ----- Per-request timings -----
+
+class RequestTimings:
+    __slots__ = ("db", "db_commands", "endpoint", "render", "llm")
+
+    def __init__(self):
+        self.db = 0.0
+        self.db_commands = 0
+        self.endpoint = 0.0
+        self.render = 0.0
+        self.llm = 0.0
+
+    def server_timing(self, total: float) -> str:
+        parts = [
+            f'db;dur={self.db * 1000:.1f};desc="{self.db_commands} round trips"',
+            f"app;dur={self.endpoint * 1000:.1f}",
+            f"render;dur={self.render * 1000:.1f}",
+        ]
+        if self.llm:
+            parts.append(f"llm;dur={self.llm * 1000:.1f}")
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+# Motor copies the context into its executor threads, so command events see it
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _timings.get()
+
+
+def observe_llm(mode: str, seconds: float) -> None:
+    llm_seconds.observe(seconds, mode=mode)
+    timings = _timings.get()
+    if timings is not None:
+        timings.llm += seconds
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Pass as `event_listeners=[...]` to the Motor client."""
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self._record(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event) -> None:
+        mongo_failures.inc(command=event.command_name)
+        self._record(event.command_name, event.duration_micros / 1e6)
+
+    def _record(self, command: str, seconds: float) -> None:
+        mongo_seconds.observe(seconds, command=command)
+        timings = _timings.get()
+        if timings is not None:
+            timings.db += seconds
+            timings.db_commands += 1
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that times the endpoint body apart from FastAPI's response handling.
+
+    Whatever the request handler spends outside the endpoint is body parsing,
+    dependency resolution and response-model validation and serialization,
+    which for list routes like GET /habits is most of it.
+    """
+
+    def get_route_handler(self):
+        endpoint = self.dependant.call
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await endpoint(*args, **kwargs)
+                finally:
+                    timings = _timings.get()
+                    if timings is not None:
+                        timings.endpoint += time.perf_counter() - start
+
+            self.dependant.call = timed_endpoint
+        handler = super().get_route_handler()
+        path = self.path
+
+        async def timed_handler(request: Request):
+            timings = _timings.get()
+            start = time.perf_counter()
+            endpoint_before = timings.endpoint if timings else 0.0
+            response = await handler(request)
+            if timings is not None:
+                timings.render = (time.perf_counter() - start) - (timings.endpoint - endpoint_before)
+                render_seconds.observe(timings.render, route=path)
+            return response
+
+        return timed_handler
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Records request latency and round trips; `paths` labels requests that never reach a route
+    (e.g. response cache hits), everything else unrouted is "unmatched"."""
+
+    def __init__(self, app, paths: Iterable[str] = (), server_timing: bool = False):
+        super().__init__(app)
+        self.paths = frozenset(paths)
+        self.server_timing = server_timing
+
+    async def dispatch(self, request: Request, call_next):
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            _timings.reset(token)
+        elapsed = time.perf_counter() - start
+
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or (request.url.path if request.url.path in self.paths else "unmatched")
+        http_seconds.observe(elapsed, method=request.method, route=path, status=str(response.status_code))
+        request_db_commands.observe(timings.db_commands, route=path)
+        if self.server_timing and request.headers.get("x-server-timing") == "1":
+            response.headers["Server-Timing"] = timings.server_timing(elapsed)
+        return response
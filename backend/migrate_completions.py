@@ -0,0 +1,49 @@
+"""Convert legacy `completions` string arrays into completion bitmaps.
+
+Runs automatically on server startup; can also be run by hand:
+
+    python migrate_completions.py
+"""
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+from completions import completion_fields
+
+
+async def migrate_completions(db, batch_size: int = 500) -> int:
+    today = datetime.now(timezone.utc).date()
+    migrated = 0
+    ops = []
+    cursor = db.habits.find({"completions": {"$exists": True}}, {"_id": 1, "completions": 1})
+    async for doc in cursor:
+        fields = completion_fields(doc.get("completions") or [], today)
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields, "$unset": {"completions": ""}}))
+        if len(ops) >= batch_size:
+            result = await db.habits.bulk_write(ops, ordered=False)
+            migrated += result.modified_count
+            ops = []
+    if ops:
+        result = await db.habits.bulk_write(ops, ordered=False)
+        migrated += result.modified_count
+    return migrated
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        migrated = await migrate_completions(client[os.environ['DB_NAME']])
+        print(f"Migrated {migrated} habits")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
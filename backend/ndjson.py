@@ -0,0 +1,52 @@
+"""Async helpers for streaming newline-delimited JSON, optionally gzipped.
+
+Everything here is an async generator, so data flows one chunk at a time and
+the consumer (the HTTP client for exports, the request body for imports)
+sets the pace.
+"""
+import json
+import zlib
+from typing import AsyncIterable, AsyncIterator
+
+
+async def encode_ndjson(records: AsyncIterable[dict], chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    buffer = bytearray()
+    async for record in records:
+        buffer += json.dumps(record, default=str, separators=(",", ":")).encode()
+        buffer += b"\n"
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def gzip_stream(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def gunzip_stream(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
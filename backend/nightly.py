@@ -0,0 +1,227 @@
+"""Nightly maintenance, run in-process by every worker but executed by one.
+
+`streak` is only recomputed when a habit is logged, so a habit nobody logs
+keeps yesterday's streak (and /stats keeps summing it). Once a day, at
+NIGHTLY_AT on the NIGHTLY_TZ wall clock (so it can run off-peak locally),
+`nightly_maintenance`:
+
+- zeroes expired streaks, and restores ones whose run reaches today again
+  (a back-dated or future log), in one pipeline `update_many` across zones;
+- rescans the few habits whose streak state was flagged stale;
+- rebuilds the last `rollup_days` of the daily rollups that /stats/range
+  reads, correcting any drift in the incrementally maintained counts (older
+  days only change through imports, which update their rollups themselves;
+  `python rollups.py` still rebuilds everything).
+
+Streak days are local: a habit records the timezone it was last logged in
+(see localdays.py) and each zone's habits decay against that zone's date at
+the time of the run. Reads compute current streaks for the requester's day
+anyway, so the stored value only needs to be right by the next run.
+
+Workers coordinate through a lease document in `job_locks`: the first to
+claim a day's run (a NIGHTLY_TZ date) executes it, and the run is recorded
+so others (and restarts) skip that day. A worker that starts after a missed
+run catches up immediately, and until the day's run is recorded (the holder
+may fail or die) workers check back every few minutes rather than the next
+night.
+
+    python nightly.py    # run today's maintenance now
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from completions import CompletionBitmap, completion_fields, current_streak_expr
+from localdays import DEFAULT_TIMEZONE, local_today
+from rollups import rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+
+# ----- Streak decay -----
+
+def timezone_filter(names: Iterable[str]) -> dict:
+    # Habits logged before timezones were recorded count as UTC
+    names = sorted(names)
+    return {"timezone": {"$in": names + [None] if DEFAULT_TIMEZONE in names else names}}
+
+
+def streak_decay_update(days: Dict[date, Iterable[str]]) -> tuple:
+    """(filter, pipeline) setting `streak` to what StreakState.current(today) gives.
+
+    `days` maps each local today to the zones on it; every habit uses its
+    own zone's day, in one pass. Only habits whose stored value is wrong
+    match; states flagged stale are left to `rescan_stale_streaks`.
+    """
+    wrong, branches = [], []
+    for today, names in sorted(days.items()):
+        yesterday = (today - timedelta(days=1)).isoformat()
+        current = {"streak_state.end": {"$gte": yesterday, "$lte": today.isoformat()}}
+        zone = timezone_filter(names)
+        wrong += [
+            {**zone, "streak": {"$gt": 0}, "$nor": [current]},
+            {**zone, **current, "$expr": {"$ne": ["$streak", "$streak_state.length"]}},
+        ]
+        branches.append({
+            # A missing field isn't `$in` [null]; $ifNull makes it null
+            "case": {"$in": [{"$ifNull": ["$timezone", None]}, zone["timezone"]["$in"]]},
+            "then": current_streak_expr(today),
+        })
+    query = {"streak_state.stale": {"$ne": True}, "$or": wrong}
+    return query, [{"$set": {"streak": {"$switch": {"branches": branches, "default": "$streak"}}}}]
+
+
+async def decay_streaks(db, now: datetime) -> int:
+    # Zones fall on at most three dates at once, so the update has few branches
+    days = defaultdict(list)
+    for name in set(await db.habits.distinct("timezone")) - {None} | {DEFAULT_TIMEZONE}:
+        days[local_today(name, now)].append(name)
+    query, pipeline = streak_decay_update(days)
+    return (await db.habits.update_many(query, pipeline)).modified_count
+
+
+async def rescan_stale_streaks(db, now: datetime, batch_size: int = 500) -> int:
+    # Same guarded rebuild as the log route's rescan: skipped if the bitmap moved
+    rescanned = 0
+    ops = []
+    projection = {"_id": 0, "user_id": 1, "id": 1, "completion_bits": 1, "timezone": 1}
+    async for habit in db.habits.find({"streak_state.stale": True}, projection):
+        bits = habit.get("completion_bits", {})
+        fields = completion_fields(CompletionBitmap.from_doc(bits), local_today(habit.get("timezone"), now))
+        ops.append(UpdateOne({"user_id": habit.get("user_id"), "id": habit["id"], "completion_bits": bits}, {"$set": fields}))
+        if len(ops) >= batch_size:
+            rescanned += (await db.habits.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        rescanned += (await db.habits.bulk_write(ops, ordered=False)).modified_count
+    return rescanned
+
+
+async def nightly_maintenance(db, now: datetime, rollup_days: int = 7) -> Dict[str, int]:
+    decayed = await decay_streaks(db, now)
+    rescanned = await rescan_stale_streaks(db, now)
+    # Counted back from UTC's date, so zones behind it are covered too
+    rollups = await rebuild_rollups(db, since=now.date() - timedelta(days=rollup_days))
+    return {"streaks_updated": decayed, "stale_rescanned": rescanned, "rollups": rollups}
+
+
+# ----- Scheduling -----
+
+def next_run(at: time, tz: tzinfo, now: datetime) -> datetime:
+    """The next `at` wall-clock time in `tz` strictly after `now` (an aware datetime)."""
+    local = now.astimezone(tz)
+    candidate = datetime.combine(local.date(), at, tzinfo=tz)
+    if candidate <= local:
+        candidate = datetime.combine(local.date() + timedelta(days=1), at, tzinfo=tz)
+    return candidate
+
+
+class JobLock:
+    """Lease in `job_locks` that lets one worker run a job once per day.
+
+    A lease expires after `lease` seconds, so a worker that dies mid-run
+    doesn't block the job until the next day.
+    """
+
+    def __init__(self, db, name: str, lease: float = 3600.0, owner: Optional[str] = None):
+        self.db = db
+        self.name = name
+        self.lease = lease
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def acquire(self, run_day: str) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            lock = await self.db.job_locks.find_one_and_update(
+                {
+                    "_id": self.name,
+                    "last_run": {"$ne": run_day},
+                    "$or": [{"expires_at": None}, {"expires_at": {"$lt": now}}],
+                },
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.lease), "started_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return False  # held by another worker, or already run for run_day
+        return lock["owner"] == self.owner
+
+    async def done(self, run_day: str) -> bool:
+        lock = await self.db.job_locks.find_one({"_id": self.name}, {"last_run": 1})
+        return lock is not None and lock.get("last_run") == run_day
+
+    async def release(self, run_day: str, completed: bool) -> None:
+        update = {"expires_at": None}
+        if completed:
+            update["last_run"] = run_day
+        await self.db.job_locks.update_one({"_id": self.name, "owner": self.owner}, {"$set": update})
+
+
+async def run_once(job: Callable[[], Awaitable[dict]], lock: JobLock, tz: tzinfo) -> Optional[dict]:
+    """Run `job` unless another worker has it or it already ran today (in `tz`)."""
+    run_day = datetime.now(tz).date().isoformat()
+    if not await lock.acquire(run_day):
+        return None
+    completed = False
+    try:
+        result = await job()
+        completed = True
+        logger.info(f"Nightly job '{lock.name}' for {run_day}: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"Nightly job '{lock.name}' failed: {str(e)}")
+        return None
+    finally:
+        await lock.release(run_day, completed)
+
+
+async def run_daily(job: Callable[[], Awaitable[dict]], lock: JobLock, at: time, tz: tzinfo,
+                    retry: Optional[float] = None) -> None:
+    """Run `job` once a day at `at` in `tz`.
+
+    Until the day's run is recorded (it failed, or another worker holds the
+    lease and may die), check back every `retry` seconds instead of waiting
+    for the next day; by default min(lease, 15 minutes).
+    """
+    retry = min(lock.lease, 900.0) if retry is None else retry
+    while True:
+        run_day = datetime.now(tz).date().isoformat()
+        await run_once(job, lock, tz)
+        now = datetime.now(timezone.utc)
+        delay = (next_run(at, tz, now) - now).total_seconds()
+        if not await lock.done(run_day):
+            delay = min(delay, retry)
+        await asyncio.sleep(delay)
+
+
+async def main():
+    from zoneinfo import ZoneInfo
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        result = await run_once(
+            lambda: nightly_maintenance(db, datetime.now(timezone.utc)),
+            JobLock(db, "nightly"),
+            ZoneInfo(os.environ.get("NIGHTLY_TZ", "UTC"))
+        )
+        print(result if result is not None else "Already run today (or running elsewhere)")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""Precomputed "top posts" ranking for the community feed.
+
+`community_rankings` holds the best-scoring recent posts, one document each:
+
+    {"rank": 1, "id": "...", "content": "...", "created_at": "...", "likes": 12, "score": 0.87}
+
+Scores are likes decayed by age (Hacker News style gravity), so the top view
+favours posts that are both liked and fresh. `refresh_rankings` regenerates the
+collection; the server runs it periodically and on demand:
+
+    python rankings.py
+"""
+import asyncio
+import heapq
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+from indexes import INDEXES
+
+RANKING_SIZE = 100
+RANKING_WINDOW_DAYS = 30
+GRAVITY = 1.5
+
+
+def hot_score(likes: int, created_at: str, now: datetime) -> float:
+    created = datetime.fromisoformat(created_at)
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    age_hours = max((now - created).total_seconds() / 3600, 0.0)
+    return (likes + 1) / (age_hours + 2) ** GRAVITY
+
+
+async def refresh_rankings(db, size: int = RANKING_SIZE, window_days: int = RANKING_WINDOW_DAYS,
+                           now: Optional[datetime] = None) -> int:
+    """Regenerate community_rankings from recent posts; returns the number ranked."""
+    now = now or datetime.now(timezone.utc)
+    # ISO timestamps compare correctly as strings, so this is an index range scan
+    cutoff = (now - timedelta(days=window_days)).isoformat()
+    posts = db.community_posts.find(
+        {"created_at": {"$gte": cutoff}}, {"_id": 0, "id": 1, "content": 1, "created_at": 1, "likes": 1}
+    )
+    # A min-heap of the best `size` so far: memory stays bounded however many posts match
+    top = []
+    seen = 0
+    async for post in posts:
+        item = (hot_score(post.get("likes", 0), post["created_at"], now), -seen, post)
+        seen += 1
+        if len(top) < size:
+            heapq.heappush(top, item)
+        elif item[:2] > top[0][:2]:
+            heapq.heapreplace(top, item)
+    top.sort(key=lambda item: item[:2], reverse=True)
+    docs = [{"rank": rank, **post, "score": round(score, 6)} for rank, (score, _, post) in enumerate(top, 1)]
+    if not docs:
+        await db.community_rankings.delete_many({})
+        return 0
+
+    # Build into a scratch collection and swap it in, so readers never see a
+    # partial refresh; named per run so concurrent refreshes don't collide
+    scratch = db[f"community_rankings_refresh_{uuid.uuid4().hex[:12]}"]
+    try:
+        await scratch.create_indexes(INDEXES["community_rankings"])
+        await scratch.insert_many(docs)
+        await scratch.rename("community_rankings", dropTarget=True)
+    except BaseException:
+        await scratch.drop()
+        raise
+    return len(docs)
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        ranked = await refresh_rankings(client[os.environ['DB_NAME']])
+        print(f"Ranked {ranked} posts")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
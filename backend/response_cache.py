@@ -0,0 +1,143 @@
+"""In-process response cache for the read-heavy GET endpoints.
+
+Entries are keyed on the request plus a version counter for every collection
+the endpoint reads; write routes call `invalidate(...)`, which bumps the
+counter and makes older entries unreachable (LRU eviction drops them later).
+The TTL bounds staleness for writes made by other worker processes.
+
+With a `scope` function (the caller's user id), entries are also keyed on the
+scope and each collection has a version per scope, so `invalidate(...,
+scope=user)` only retires that user's entries.
+
+Entries are keyed on the day too, since stats windows and streaks move at
+midnight: UTC's, or whatever a `day` function returns for the request (the
+requester's zone and local date). A `day` of None bypasses the cache, so the
+route itself answers (e.g. rejects an unknown zone).
+
+ETags are a hash of the response body, so they are safe to compare across
+workers; a matching If-None-Match gets a 304.
+"""
+import hashlib
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+class ResponseCache:
+    def __init__(self, routes: Dict[str, Tuple[str, ...]], max_entries: int = 512, ttl: float = 30.0,
+                 scope: Optional[Callable[[Request], Optional[str]]] = None,
+                 day: Optional[Callable[[Request], Optional[Hashable]]] = None):
+        self.routes = routes  # path -> collections the response depends on
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.scope = scope
+        self.day = day
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._versions: Dict[Tuple[str, Optional[str]], int] = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def invalidate(self, *collections: str, scope: Optional[str] = None) -> None:
+        """Retire cached responses reading `collections`: for everyone, or one scope's."""
+        for name in collections:
+            self._versions[(name, scope)] += 1
+
+    def version(self, collection: str, scope: Optional[str] = None) -> tuple:
+        return (self._versions[(collection, None)], self._versions[(collection, scope)] if scope else 0)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def key(self, request: Request) -> Optional[tuple]:
+        collections = self.routes.get(request.url.path)
+        if collections is None or request.method != "GET":
+            return None
+        scope = self.scope(request) if self.scope else None
+        # Date-relative endpoints (stats windows, streaks) change at midnight
+        today = self.day(request) if self.day else datetime.now(timezone.utc).date().isoformat()
+        if today is None:
+            return None
+        return (
+            request.url.path,
+            tuple(sorted(request.query_params.multi_items())),
+            scope,
+            tuple(self.version(name, scope) for name in collections),
+            today,
+        )
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, etag: str, body: bytes, headers: dict) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, etag, body, headers)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "versions": {name: v for (name, scope), v in self._versions.items() if scope is None},
+            "scopes": len({scope for _, scope in self._versions if scope is not None}),
+        }
+
+
+def _etag(body: bytes) -> str:
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def _matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return etag in (tag.strip() for tag in header.split(",")) or header.strip() == "*"
+
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, cache: ResponseCache):
+        super().__init__(app)
+        self.cache = cache
+
+    async def dispatch(self, request: Request, call_next):
+        key = self.cache.key(request)
+        if key is None:
+            return await call_next(request)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.hits += 1
+            _, etag, body, headers = entry
+        else:
+            self.cache.misses += 1
+            response = await call_next(request)
+            if response.status_code != 200:
+                return response
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            etag = _etag(body)
+            headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-length", "etag")}
+            self.cache.put(key, etag, body, headers)
+
+        if _matches(request, etag):
+            self.cache.not_modified += 1
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        return Response(
+            content=body,
+            status_code=200,
+            headers={**headers, "ETag": etag, "Cache-Control": "no-cache"},
+        )
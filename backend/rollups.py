@@ -0,0 +1,144 @@
+"""Materialized per-day completion rollups.
+
+`daily_rollups` holds one document per user and calendar day:
+
+    {"user_id": "...", "date": "2024-05-01", "habit_ids": ["...", ...], "total": 2}
+
+The routes keep it in step with the habit bitmaps; `rebuild_rollups` regenerates
+it from scratch:
+
+    python rollups.py
+"""
+import asyncio
+import os
+from collections import defaultdict
+from datetime import date
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from completions import CompletionBitmap, day_groups_pipeline, slot_isoformat
+
+
+def _recount() -> dict:
+    return {"$set": {"total": {"$size": "$habit_ids"}}}
+
+
+def rollup_update(user_id: str, habit_ids: List[str], day: str, completed: bool) -> Tuple[dict, list]:
+    """Filter and (idempotent) pipeline update marking habits done or not done on `day`."""
+    existing = {"$ifNull": ["$habit_ids", []]}
+    if completed:
+        updated = {"$setUnion": [existing, habit_ids]}
+    else:
+        updated = {"$filter": {"input": existing, "cond": {"$eq": [{"$in": ["$$this", habit_ids]}, False]}}}
+    return {"user_id": user_id, "date": day}, [{"$set": {"habit_ids": updated}}, _recount()]
+
+
+def rollup_removal(user_id: str, habit_id: str) -> Tuple[dict, list]:
+    """Filter and pipeline update dropping a deleted habit from every day."""
+    return {"user_id": user_id, "habit_ids": habit_id}, [
+        {"$set": {"habit_ids": {"$filter": {"input": "$habit_ids", "cond": {"$ne": ["$$this", habit_id]}}}}},
+        _recount(),
+    ]
+
+
+async def replace_rollups(db, user_id: str, habits: List[dict], batch_size: int = 1000) -> None:
+    """Point the rollups of `habits` (stored documents that were just replaced) at their completions.
+
+    Memory is proportional to the batch of habits, not the user's history,
+    so bulk writers like the import route can call it per batch.
+    """
+    ids = [habit["id"] for habit in habits]
+    await db.daily_rollups.update_many({"user_id": user_id, "habit_ids": {"$in": ids}}, [
+        {"$set": {"habit_ids": {"$filter": {"input": "$habit_ids", "cond": {"$eq": [{"$in": ["$$this", ids]}, False]}}}}},
+        _recount(),
+    ])
+    by_day = defaultdict(list)
+    for habit in habits:
+        for day in CompletionBitmap.from_doc(habit.get("completion_bits")).isoformat():
+            by_day[day].append(habit["id"])
+    ops = [UpdateOne(*rollup_update(user_id, done, day, True), upsert=True) for day, done in sorted(by_day.items())]
+    for i in range(0, len(ops), batch_size):
+        await db.daily_rollups.bulk_write(ops[i:i + batch_size], ordered=False)
+
+
+async def _rebuilt_rollups(db, query: dict, since: Optional[date]):
+    # Grouped by MongoDB and sorted by (user_id, date), so nothing accumulates here
+    async for group in db.habits.aggregate(day_groups_pipeline(query, since), allowDiskUse=True):
+        day = slot_isoformat(group["_id"]["year"], int(group["_id"]["slot"]))
+        if day is not None:
+            ids = group["habit_ids"]
+            yield {"user_id": group["_id"]["user_id"], "date": day, "habit_ids": ids, "total": len(ids)}
+
+
+async def _next(cursor) -> Optional[dict]:
+    try:
+        return await cursor.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def rebuild_rollups(db, user_id: Optional[str] = None, since: Optional[date] = None,
+                          batch_size: int = 1000) -> int:
+    """Regenerate daily_rollups from the habits collection; returns the number of rollups.
+
+    With `user_id`, only that user's rollups are regenerated; with `since`,
+    only days from then on (a drift check over recent dates). The rebuilt
+    rollups are merge-joined against the stored ones (both in (user_id, date)
+    order), so memory stays constant however many completions there are, and
+    rollups are fixed in place: readers never see a missing range. Only days
+    that differ are written, each guarded on the `habit_ids` read (or, for a
+    new day, inserted only if still missing) so a log landing meanwhile wins.
+    """
+    query = {"user_id": {"$type": "string"} if user_id is None else user_id}
+    stored_query = dict(query) if since is None else {**query, "date": {"$gte": since.isoformat()}}
+    stored = db.daily_rollups.find(
+        stored_query, {"_id": 0, "user_id": 1, "date": 1, "habit_ids": 1}
+    ).sort([("user_id", 1), ("date", 1)])
+    ops = []
+    rollups = 0
+
+    async def write(op):
+        nonlocal ops
+        ops.append(op)
+        if len(ops) >= batch_size:
+            await db.daily_rollups.bulk_write(ops, ordered=False)
+            ops = []
+
+    current = await _next(stored)
+    async for doc in _rebuilt_rollups(db, query, since):
+        rollups += 1
+        key = (doc["user_id"], doc["date"])
+        while current is not None and (current["user_id"], current["date"]) < key:
+            await write(DeleteOne({**current}))
+            current = await _next(stored)
+        if current is not None and (current["user_id"], current["date"]) == key:
+            if sorted(current.get("habit_ids") or []) != sorted(doc["habit_ids"]):
+                await write(ReplaceOne({**current}, doc))
+            current = await _next(stored)
+        else:
+            await write(UpdateOne({"user_id": doc["user_id"], "date": doc["date"]}, {"$setOnInsert": doc}, upsert=True))
+    while current is not None:
+        await write(DeleteOne({**current}))
+        current = await _next(stored)
+    if ops:
+        await db.daily_rollups.bulk_write(ops, ordered=False)
+    return rollups
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        rollups = await rebuild_rollups(client[os.environ['DB_NAME']])
+        print(f"Rebuilt {rollups} daily rollups")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
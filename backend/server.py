@@ -1,29 +1,94 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
+import json
+import asyncio
+import base64
 import logging
+import zlib
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, model_validator
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone
+from datetime import date, datetime, time, timezone
+from zoneinfo import ZoneInfo
 from emergentintegrations.llm.chat import LlmChat, UserMessage
+from completions import CompletionBitmap, completion_fields, completion_update_pipeline, log_fields, stats_pipeline
+from migrate_completions import migrate_completions
+from tenancy import DEFAULT_USER, migrate_tenancy, normalize_user_id
+from localdays import DEFAULT_TIMEZONE, local_today, resolve_timezone
+from streaks import StreakState
+from rollups import rebuild_rollups, replace_rollups, rollup_removal, rollup_update
+from rankings import refresh_rankings
+from like_buffer import LikeBuffer
+from events import RESYNC, EventHub, relay_change_stream, serve_events
+from heatmap import FORMATS, CalendarCache, habit_calendar, year_length, year_words
+from nightly import JobLock, nightly_maintenance, run_daily
+from ndjson import encode_ndjson, gunzip_stream, gzip_stream, iter_lines
+from indexes import check_query_plans, ensure_indexes
+from response_cache import ResponseCache, ResponseCacheMiddleware
+import metrics
+from coach import (
+    FALLBACK_REPLY, MAX_CONTEXT_HABITS, SUMMARY_QUESTIONS, ChatSessionPool, CoachUnavailable, FakeLlmChat,
+    GeminiChat, LlmGuard, PromptCache, ReplyCache, SendOnlyChat, build_history_context, build_system_prompt,
+    sse_reply, stream_reply
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[metrics.MongoCommandTimer()])
 db = client[os.environ['DB_NAME']]
 
-# Create the main app without a prefix
-app = FastAPI()
+_supports_transactions = None
+
+async def run_transaction(callback):
+    # Transactions need a replica set or mongos; a standalone dev mongod runs the
+    # callback without a session instead.
+    global _supports_transactions
+    if _supports_transactions is None:
+        hello = await db.client.admin.command("hello")
+        _supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+    if not _supports_transactions:
+        return await callback(None)
+    async with await db.client.start_session() as session:
+        return await session.with_transaction(callback)
+
+# Create the main app without a prefix; responses are encoded with orjson
+app = FastAPI(default_response_class=ORJSONResponse)
+
+def cache_day(request: Request) -> Optional[tuple]:
+    # Unknown zones skip the cache so current_timezone can reject them
+    name = request.headers.get("x-timezone") or DEFAULT_TIMEZONE
+    if resolve_timezone(name) is None:
+        return None
+    return name, local_today(name).isoformat()
+
+# GET responses cached in-process; value lists the collections each one reads
+response_cache = ResponseCache(
+    routes={
+        "/api/habits": ("habits",),
+        "/api/stats": ("habits",),
+        "/api/stats/range": ("habits",),
+        "/api/community": ("community_posts",),
+        "/api/community/top": ("community_rankings",),
+        "/api/challenges": (),
+    },
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "30")),
+    max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "512")),
+    scope=lambda request: normalize_user_id(request.headers.get("x-user-id")),
+    day=cache_day
+)
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=metrics.TimedRoute)
 
 # ==================== Models ====================
 
@@ -34,11 +99,43 @@ class Habit(BaseModel):
     description: str = ""
     frequency: str = "daily"  # daily, weekly
     streak: int = 0
+    longest_streak: int = 0
     total_completions: int = 0
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     last_completed: Optional[str] = None
     completions: List[str] = []  # List of ISO date strings
 
+    @model_validator(mode="before")
+    @classmethod
+    def expand_completion_bits(cls, data):
+        # Stored documents keep completions as per-year bitmaps (see completions.py)
+        if isinstance(data, dict) and "completion_bits" in data:
+            data = {**data, "completions": CompletionBitmap.from_doc(data["completion_bits"]).isoformat()}
+        return data
+
+HABIT_FIELDS = tuple(Habit.model_fields)
+
+def habit_doc(habit: Habit, user_id: str, tz_name: str = DEFAULT_TIMEZONE) -> dict:
+    doc = habit.model_dump(exclude={"completions"})
+    doc.update(completion_fields(habit.completions, local_today(tz_name)))
+    doc["user_id"] = user_id
+    doc["timezone"] = tz_name  # nightly streak decay runs on this zone's day
+    return doc
+
+def habit_payload(doc: dict, since: Optional[date] = None, today: Optional[date] = None) -> dict:
+    # The API shape of a stored habit. Documents were validated on the way in,
+    # so reads are reshaped here and returned as ORJSONResponse rather than
+    # validated again as Habit and once more against the response_model.
+    payload = {name: doc[name] for name in HABIT_FIELDS if name in doc}
+    if "completion_bits" in doc:
+        payload["completions"] = CompletionBitmap.from_doc(doc["completion_bits"]).isoformat(start=since)
+    if today is not None and "streak" in payload:
+        # Stored streaks are as of the last log; report the run as of the reader's day
+        state = StreakState.from_doc(doc.get("streak_state"))
+        if state is not None:
+            payload["streak"] = state.current(today)
+    return payload
+
 class HabitCreate(BaseModel):
     name: str
     description: str = ""
@@ -54,6 +151,21 @@ class HabitLog(BaseModel):
     completed: bool = True
     date: Optional[str] = None  # ISO date string, defaults to today
 
+class HabitLogged(BaseModel):
+    id: str
+    date: str
+    completed: bool
+    completed_today: bool
+    streak: int
+    longest_streak: int
+    total_completions: int
+    last_completed: Optional[str] = None
+
+class BulkLogResult(BaseModel):
+    habit_id: str
+    status: str  # logged, not_found
+    habit: Optional[Habit] = None
+
 class CommunityPost(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -71,162 +183,509 @@ class ChatMessage(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     session_id: str
+    fallback: bool = False
+
+class ChatHistoryMessage(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    session_id: str
+    role: str
+    content: str
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 # ==================== Routes ====================
 
+async def current_user(x_user_id: Optional[str] = Header(None)) -> str:
+    # Every habit, stats and chat query is scoped to this user (see tenancy.py)
+    user_id = normalize_user_id(x_user_id)
+    if user_id is None:
+        raise HTTPException(status_code=400, detail="Invalid X-User-Id header")
+    return user_id
+
+async def current_timezone(x_timezone: Optional[str] = Header(None)) -> str:
+    # The IANA zone whose calendar day "today" means for this request (see localdays.py)
+    if resolve_timezone(x_timezone) is None:
+        raise HTTPException(status_code=400, detail="Unknown X-Timezone")
+    return x_timezone or DEFAULT_TIMEZONE
+
 @api_router.get("/")
 async def root():
     return {"message": "Awesome Life Habits API"}
 
+# ----- Live updates -----
+
+# Mutation routes publish deltas to /api/ws clients (see events.py). With
+# WS_CHANGE_STREAMS=on a MongoDB change stream publishes them instead, which
+# reaches clients of every worker but needs a replica set.
+event_hub = EventHub(max_queue=int(os.environ.get("WS_MAX_QUEUE", "100")))
+change_stream_events = os.environ.get("WS_CHANGE_STREAMS", "off") == "on"
+change_stream_task = None
+
+def publish(event: dict, user_id: Optional[str] = None):
+    # user_id limits delivery to that user's sockets; None goes to everyone
+    if not change_stream_events:
+        event_hub.publish(event, user_id)
+
+def habit_change_event(change: dict) -> Optional[tuple]:
+    if change.get("fullDocument") is None:
+        # Deletes only carry the ObjectId, not our habit id or owner
+        return RESYNC, None
+    habit = habit_payload(change["fullDocument"])
+    kind = "habit.created" if change["operationType"] == "insert" else "habit.updated"
+    return {"type": kind, "habit": habit}, change["fullDocument"].get("user_id")
+
+def post_change_event(change: dict) -> Optional[tuple]:
+    if change.get("fullDocument") is None:
+        return RESYNC, None
+    post = CommunityPost(**change["fullDocument"]).model_dump()
+    if change["operationType"] == "insert":
+        return {"type": "post.created", "post": post}, None
+    return {"type": "post.liked", "id": post["id"], "likes": post["likes"]}, None
+
+@api_router.websocket("/ws")
+async def ws_events(websocket: WebSocket, user_id: Optional[str] = None):
+    # Browsers can't set headers on a WebSocket, so the user comes as ?user_id=
+    user_id = normalize_user_id(user_id)
+    if user_id is None:
+        await websocket.close(code=1008)
+        return
+    await serve_events(websocket, event_hub, user_id)
+
 # ----- Habits -----
 
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["created_at"], doc["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, habit_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), str(habit_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @api_router.get("/habits", response_model=List[Habit])
-async def get_habits():
-    habits = await db.habits.find({}, {"_id": 0}).to_list(1000)
-    return habits
+async def get_habits(
+    limit: int = Query(1000, ge=1, le=1000),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    completion_days: Optional[int] = Query(None, ge=1, le=3660),
+    user_id: str = Depends(current_user),
+    tz_name: str = Depends(current_timezone)
+):
+    # Keyset pagination over (created_at, id); the next page's cursor is
+    # returned in the X-Next-Cursor header so the body stays a plain list.
+    query = {"user_id": user_id}
+    if after:
+        created_at, habit_id = decode_cursor(after)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": habit_id}}
+        ]
+    
+    projection = {"_id": 0}
+    cutoff = None
+    today = local_today(tz_name)
+    if fields or completion_days:
+        names = set(Habit.model_fields)
+        if fields:
+            names = {f.strip() for f in fields.split(",") if f.strip()}
+            unknown = names - set(Habit.model_fields)
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        projection.update({f: 1 for f in names | {"id", "created_at"} if f != "completions"})
+        if "streak" in names:
+            projection["streak_state"] = 1
+        if "completions" in names and completion_days:
+            # Only fetch the bitmap years that overlap the window
+            from datetime import timedelta
+            cutoff = today - timedelta(days=completion_days - 1)
+            projection.update({f"completion_bits.y{year}": 1 for year in range(cutoff.year, today.year + 1)})
+        elif "completions" in names:
+            projection["completion_bits"] = 1
+    
+    habits = await db.habits.find(query, projection).sort([("created_at", 1), ("id", 1)]).to_list(limit)
+    headers = {"X-Next-Cursor": encode_cursor(habits[-1])} if len(habits) == limit else None
+    return ORJSONResponse([habit_payload(habit, cutoff, today) for habit in habits], headers=headers)
 
 @api_router.post("/habits", response_model=Habit)
-async def create_habit(habit_input: HabitCreate):
+async def create_habit(
+    habit_input: HabitCreate,
+    user_id: str = Depends(current_user),
+    tz_name: str = Depends(current_timezone)
+):
     habit = Habit(**habit_input.model_dump())
-    doc = habit.model_dump()
-    await db.habits.insert_one(doc)
-    return habit
+    await db.habits.insert_one(habit_doc(habit, user_id, tz_name))
+    response_cache.invalidate("habits", scope=user_id)
+    payload = habit.model_dump()
+    publish({"type": "habit.created", "habit": payload}, user_id)
+    return ORJSONResponse(payload)
 
 @api_router.put("/habits/{habit_id}", response_model=Habit)
-async def update_habit(habit_id: str, habit_input: HabitUpdate):
+async def update_habit(habit_id: str, habit_input: HabitUpdate, user_id: str = Depends(current_user)):
     update_data = {k: v for k, v in habit_input.model_dump().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
     
     result = await db.habits.find_one_and_update(
-        {"id": habit_id},
+        {"user_id": user_id, "id": habit_id},
         {"$set": update_data},
         return_document=True,
         projection={"_id": 0}
     )
     if not result:
         raise HTTPException(status_code=404, detail="Habit not found")
-    return Habit(**result)
+    response_cache.invalidate("habits", scope=user_id)
+    payload = habit_payload(result)
+    publish({"type": "habit.updated", "habit": payload}, user_id)
+    return ORJSONResponse(payload)
 
 @api_router.delete("/habits/{habit_id}")
-async def delete_habit(habit_id: str):
-    result = await db.habits.delete_one({"id": habit_id})
+async def delete_habit(habit_id: str, user_id: str = Depends(current_user)):
+    async def apply_delete(session):
+        result = await db.habits.delete_one({"user_id": user_id, "id": habit_id}, session=session)
+        if result.deleted_count:
+            await db.daily_rollups.update_many(*rollup_removal(user_id, habit_id), session=session)
+        return result
+    
+    result = await run_transaction(apply_delete)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Habit not found")
+    response_cache.invalidate("habits", scope=user_id)
+    calendar_cache.invalidate(user_id, habit_id)
+    publish({"type": "habit.deleted", "id": habit_id}, user_id)
     return {"message": "Habit deleted"}
 
-@api_router.post("/habits/log", response_model=Habit)
-async def log_habit(log_input: HabitLog):
-    habit = await db.habits.find_one({"id": log_input.habit_id}, {"_id": 0})
-    if not habit:
-        raise HTTPException(status_code=404, detail="Habit not found")
+def log_payload(doc: dict, day: date, completed: bool, today: date) -> dict:
+    # What a log changed, rather than the whole habit: the response and the
+    # habit.logged event stay the same size however long the history is, and
+    # clients add or remove `date` in their copy of the completions
+    return {
+        "id": doc["id"],
+        "date": day.isoformat(),
+        "completed": completed,
+        "completed_today": today in CompletionBitmap.from_doc(doc.get("completion_bits")),
+        "streak": doc.get("streak", 0),
+        "longest_streak": doc.get("longest_streak", 0),
+        "total_completions": doc.get("total_completions", 0),
+        "last_completed": doc.get("last_completed"),
+    }
+
+@api_router.post("/habits/log", response_model=HabitLogged)
+async def log_habit(
+    log_input: HabitLog,
+    user_id: str = Depends(current_user),
+    tz_name: str = Depends(current_timezone)
+):
+    # "Today" (the default date, and the day streaks run up to) is the user's local day
+    today = local_today(tz_name)
+    try:
+        day = date.fromisoformat(log_input.date[:10]) if log_input.date else today
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date")
+    updated = await record_habit_log(log_input.habit_id, day, log_input.completed, user_id, tz_name, today)
+    payload = log_payload(updated, day, log_input.completed, today)
+    publish({"type": "habit.logged", "log": payload}, user_id)
+    return ORJSONResponse(payload)
+
+async def record_habit_log(habit_id: str, day: date, completed: bool, user_id: str, tz_name: str,
+                           today: date) -> dict:
+    """Add or remove one completion atomically; returns the stored habit."""
+    target_date = day.isoformat()
     
-    target_date = log_input.date or datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    completions = habit.get("completions", [])
-    
-    if log_input.completed:
-        if target_date not in completions:
-            completions.append(target_date)
-            completions.sort()
-            
-            # Calculate streak
-            streak = calculate_streak(completions)
-            
-            # Find the most recent completion for last_completed
-            last_completed = completions[-1] if completions else None
-            
-            await db.habits.update_one(
-                {"id": log_input.habit_id},
-                {
-                    "$set": {
-                        "completions": completions,
-                        "last_completed": last_completed,
-                        "streak": streak,
-                        "total_completions": len(completions)
-                    }
-                }
-            )
-    else:
-        if target_date in completions:
-            completions.remove(target_date)
-            completions.sort()
-            streak = calculate_streak(completions)
-            
-            # Find the most recent completion for last_completed
-            last_completed = completions[-1] if completions else None
-            
-            await db.habits.update_one(
-                {"id": log_input.habit_id},
-                {
-                    "$set": {
-                        "completions": completions,
-                        "last_completed": last_completed,
-                        "streak": streak,
-                        "total_completions": len(completions)
-                    }
-                }
+    async def apply_log(session):
+        # The completion is added/removed and streak, last_completed and
+        # total_completions are updated on the server in one atomic update.
+        updated = await db.habits.find_one_and_update(
+            {"user_id": user_id, "id": habit_id},
+            completion_update_pipeline(target_date, completed, today) + [{"$set": {"timezone": tz_name}}],
+            return_document=True,
+            projection={"_id": 0},
+            session=session
+        )
+        if updated:
+            await db.daily_rollups.update_one(
+                *rollup_update(user_id, [habit_id], target_date, completed),
+                upsert=True,
+                session=session
             )
+        return updated
     
-    updated = await db.habits.find_one({"id": log_input.habit_id}, {"_id": 0})
-    return Habit(**updated)
+    updated = await run_transaction(apply_log)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    if updated.get("streak_state", {}).get("stale"):
+        updated = await rescan_completions(updated, today)
+    response_cache.invalidate("habits", scope=user_id)
+    calendar_cache.invalidate(user_id, habit_id, day.year)
+    return updated
 
-def calculate_streak(completions: List[str]) -> int:
-    if not completions:
-        return 0
+async def rescan_completions(habit: dict, today: date) -> dict:
+    # Slow path for back-dated edits: rebuild the derived fields from the bitmap,
+    # guarded on the bitmap we read so a concurrent log isn't overwritten.
+    for _ in range(3):
+        bits = habit.get("completion_bits", {})
+        fields = completion_fields(CompletionBitmap.from_doc(bits), today)
+        rescanned = await db.habits.find_one_and_update(
+            {"user_id": habit["user_id"], "id": habit["id"], "completion_bits": bits},
+            {"$set": fields},
+            return_document=True,
+            projection={"_id": 0}
+        )
+        if rescanned:
+            return rescanned
+        habit = await db.habits.find_one({"user_id": habit["user_id"], "id": habit["id"]}, {"_id": 0})
+        if not habit or not habit.get("streak_state", {}).get("stale"):
+            break
+    return habit
+
+@api_router.post("/habits/bulk-log", response_model=List[BulkLogResult])
+async def bulk_log_habits(
+    habit_ids: List[str],
+    log_date: Optional[str] = Query(None, alias="date"),
+    user_id: str = Depends(current_user),
+    tz_name: str = Depends(current_timezone)
+):
+    today = local_today(tz_name)
+    target_date = log_date or today.isoformat()
+    try:
+        day = date.fromisoformat(target_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date")
+    target_date = day.isoformat()
     
-    from datetime import timedelta
-    today = datetime.now(timezone.utc).date()
-    streak = 0
-    current_date = today
+    # One $in read, then every change goes out in a single unordered bulk_write.
+    # Each update is guarded on the bitmap we read; a concurrent log makes it miss.
+    habits = await db.habits.find({"user_id": user_id, "id": {"$in": habit_ids}}, {"_id": 0}).to_list(len(habit_ids))
+    logged = {}
+    changed = []
+    ops = []
+    for habit in habits:
+        fields = log_fields(habit, day, True, today)
+        if fields:
+            fields["timezone"] = tz_name
+            changed.append(habit["id"])
+            ops.append(UpdateOne(
+                {"user_id": user_id, "id": habit["id"], "completion_bits": habit.get("completion_bits")},
+                {"$set": fields}
+            ))
+            habit = {**habit, **fields}
+        logged[habit["id"]] = habit
     
-    sorted_completions = sorted([datetime.fromisoformat(c).date() for c in completions], reverse=True)
+    async def apply_bulk(session):
+        result = await db.habits.bulk_write(ops, ordered=False, session=session)
+        done = changed
+        if result.matched_count < len(ops):
+            # Only roll up habits that still exist and have the day; the ones a
+            # concurrent log beat are retried below and write their own rollup
+            current = await db.habits.find(
+                {"user_id": user_id, "id": {"$in": changed}}, {"_id": 0, "id": 1, "completion_bits": 1},
+                session=session
+            ).to_list(len(changed))
+            done = [h["id"] for h in current if day in CompletionBitmap.from_doc(h.get("completion_bits"))]
+        if done:
+            await db.daily_rollups.update_one(
+                *rollup_update(user_id, done, target_date, True), upsert=True, session=session
+            )
+        return result
     
-    for comp_date in sorted_completions:
-        if comp_date == current_date or comp_date == current_date - timedelta(days=1):
-            streak += 1
-            current_date = comp_date - timedelta(days=1)
-        else:
-            break
+    if ops:
+        result = await run_transaction(apply_bulk)
+        response_cache.invalidate("habits", scope=user_id)
+        for habit_id in changed:
+            calendar_cache.invalidate(user_id, habit_id, day.year)
+        if result.matched_count < len(ops):
+            # Lost a race with another writer: fall back to the atomic single-habit path
+            current = await db.habits.find(
+                {"user_id": user_id, "id": {"$in": changed}}, {"_id": 0}
+            ).to_list(len(changed))
+            for habit_id in changed:
+                logged.pop(habit_id)
+            for habit in current:
+                if day not in CompletionBitmap.from_doc(habit.get("completion_bits")):
+                    try:
+                        habit = await record_habit_log(habit["id"], day, True, user_id, tz_name, today)
+                    except HTTPException:
+                        continue
+                logged[habit["id"]] = habit
     
-    return streak
+    results = [
+        {"habit_id": habit_id, "status": "logged", "habit": habit_payload(logged[habit_id])}
+        if habit_id in logged else {"habit_id": habit_id, "status": "not_found", "habit": None}
+        for habit_id in habit_ids
+    ]
+    for habit_id in changed:
+        if habit_id in logged:
+            publish({"type": "habit.logged", "log": log_payload(logged[habit_id], day, True, today)}, user_id)
+    return ORJSONResponse(results)
 
-@api_router.post("/habits/bulk-log")
-async def bulk_log_habits(habit_ids: List[str]):
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    results = []
+# ----- Calendars -----
+
+# Year words per (user, habit, year) for the heatmap endpoints; log_habit and
+# bulk-log drop the year they touch (see heatmap.py)
+calendar_cache = CalendarCache(
+    max_habits=int(os.environ.get("CALENDAR_CACHE_SIZE", "4096")),
+    ttl=float(os.environ.get("CALENDAR_CACHE_TTL", "60"))
+)
+
+@api_router.get("/habits/calendar")
+async def get_habit_calendars(
+    year: Optional[int] = Query(None, ge=1970, le=9999),
+    ids: Optional[str] = None,
+    fmt: str = Query("bitmap", alias="format", pattern=f"^({'|'.join(FORMATS)})$"),
+    user_id: str = Depends(current_user),
+    tz_name: str = Depends(current_timezone)
+):
+    # Heatmaps for several habits in one call: `ids` (comma-separated) or all
+    # of the user's habits. Unknown ids are left out.
+    year = year or local_today(tz_name).year
+    habit_ids = [i.strip() for i in ids.split(",") if i.strip()] if ids else None
+    if habit_ids is not None and len(habit_ids) > 1000:
+        raise HTTPException(status_code=400, detail="At most 1000 ids per request")
     
-    for habit_id in habit_ids:
-        try:
-            result = await log_habit(HabitLog(habit_id=habit_id, date=today))
-            results.append(result)
-        except HTTPException:
-            continue
+    words = {}
+    query = {"user_id": user_id}
+    if habit_ids is not None:
+        for habit_id in habit_ids:
+            cached = calendar_cache.get(user_id, habit_id, year)
+            if cached is not None:
+                words[habit_id] = cached
+        query["id"] = {"$in": [i for i in habit_ids if i not in words]}
+    if habit_ids is None or query["id"]["$in"]:
+        habits = await db.habits.find(query, {"_id": 0, "id": 1, f"completion_bits.y{year}": 1}).sort(
+            [("created_at", 1), ("id", 1)]
+        ).to_list(1000)
+        for habit in habits:
+            words[habit["id"]] = year_words(habit.get("completion_bits"), year)
+            calendar_cache.put(user_id, habit["id"], year, words[habit["id"]])
     
-    return results
+    order = habit_ids if habit_ids is not None else list(words)
+    return {
+        "year": year,
+        "days": year_length(year),
+        "format": fmt,
+        "habits": [habit_calendar(habit_id, year, words[habit_id], fmt) for habit_id in order if habit_id in words]
+    }
+
+@api_router.get("/habits/{habit_id}/calendar")
+async def get_habit_calendar(
+    habit_id: str,
+    year: Optional[int] = Query(None, ge=1970, le=9999),
+    fmt: str = Query("bitmap", alias="format", pattern=f"^({'|'.join(FORMATS)})$"),
+    user_id: str = Depends(current_user),
+    tz_name: str = Depends(current_timezone)
+):
+    year = year or local_today(tz_name).year
+    words = calendar_cache.get(user_id, habit_id, year)
+    if words is None:
+        habit = await db.habits.find_one({"user_id": user_id, "id": habit_id}, {"_id": 0, f"completion_bits.y{year}": 1})
+        if habit is None:
+            raise HTTPException(status_code=404, detail="Habit not found")
+        words = year_words(habit.get("completion_bits"), year)
+        calendar_cache.put(user_id, habit_id, year, words)
+    return {"year": year, "days": year_length(year), "format": fmt, **habit_calendar(habit_id, year, words, fmt)}
 
 # ----- Community -----
 
+# Only the fields the feed renders
+FEED_PROJECTION = {"_id": 0, "id": 1, "content": 1, "created_at": 1, "likes": 1}
+
 @api_router.get("/community", response_model=List[CommunityPost])
-async def get_community_posts():
-    posts = await db.community_posts.find({}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return posts
+async def get_community_posts(
+    limit: int = Query(100, ge=1, le=100),
+    before: Optional[str] = None
+):
+    # Newest first, keyset-paginated on (created_at, id) straight off the index;
+    # X-Next-Cursor points at the next (older) page.
+    query = {}
+    if before:
+        created_at, post_id = decode_cursor(before)
+        query = {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": post_id}}
+        ]}
+    posts = await db.community_posts.find(query, FEED_PROJECTION).sort(
+        [("created_at", -1), ("id", -1)]
+    ).to_list(limit)
+    headers = {"X-Next-Cursor": encode_cursor(posts[-1])} if len(posts) == limit else None
+    for post in posts:
+        # Read-your-writes: include likes still waiting to be flushed
+        post["likes"] = post.get("likes", 0) + (like_buffer.pending(post["id"]) if like_buffer is not None else 0)
+    return ORJSONResponse(posts, headers=headers)
+
+@api_router.get("/community/top", response_model=List[CommunityPost])
+async def get_top_posts(limit: int = Query(20, ge=1, le=100)):
+    # Served from the precomputed ranking (see rankings.py), refreshed every
+    # RANKING_REFRESH_SECONDS; likes shown are as of the last refresh.
+    return ORJSONResponse(await db.community_rankings.find({}, FEED_PROJECTION).sort("rank", 1).to_list(limit))
+
+async def refresh_top_posts() -> Optional[int]:
+    # A failed refresh keeps the previous ranking; the periodic loop retries
+    try:
+        ranked = await refresh_rankings(db)
+    except Exception as e:
+        logger.error(f"Refreshing top posts failed: {str(e)}")
+        return None
+    response_cache.invalidate("community_rankings")
+    return ranked
+
+ranking_task = None
+
+async def refresh_top_posts_periodically(interval: float):
+    while True:
+        await refresh_top_posts()
+        await asyncio.sleep(interval)
 
 @api_router.post("/community", response_model=CommunityPost)
-async def create_community_post(post_input: CommunityPostCreate):
+async def create_community_post(post_input: CommunityPostCreate, user_id: str = Depends(current_user)):
     post = CommunityPost(**post_input.model_dump())
-    doc = post.model_dump()
+    doc = {**post.model_dump(), "user_id": user_id}  # the feed is shared; this records the author
     await db.community_posts.insert_one(doc)
-    return post
+    response_cache.invalidate("community_posts")
+    payload = post.model_dump()
+    publish({"type": "post.created", "post": payload})
+    return ORJSONResponse(payload)
+
+# Likes are buffered and flushed every LIKE_FLUSH_SECONDS (see like_buffer.py);
+# LIKE_BUFFER=off writes each like straight through.
+def likes_flushed():
+    # The feed adds pending likes when it is built, so cached pages only go stale on a write
+    response_cache.invalidate("community_posts")
+
+like_buffer = LikeBuffer(float(os.environ.get("LIKE_FLUSH_SECONDS", "1")), on_flush=likes_flushed) \
+    if os.environ.get("LIKE_BUFFER", "on") != "off" else None
+like_task = None
 
 @api_router.post("/community/{post_id}/like")
 async def like_post(post_id: str):
-    result = await db.community_posts.update_one(
-        {"id": post_id},
-        {"$inc": {"likes": 1}}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Post not found")
-    return {"message": "Post liked"}
+    if like_buffer is None:
+        post = await db.community_posts.find_one_and_update(
+            {"id": post_id},
+            {"$inc": {"likes": 1}},
+            projection={"_id": 0, "likes": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if post is None:
+            raise HTTPException(status_code=404, detail="Post not found")
+        likes = post.get("likes", 0)
+        response_cache.invalidate("community_posts")
+    else:
+        # The increment goes to the buffer; the post is only read when the
+        # buffer doesn't know its stored count (first click since the last flush)
+        if like_buffer.count(post_id) is None:
+            post = await db.community_posts.find_one({"id": post_id}, {"_id": 0, "likes": 1})
+            if post is None:
+                raise HTTPException(status_code=404, detail="Post not found")
+            like_buffer.remember(post_id, post.get("likes", 0))
+        like_buffer.add(post_id)
+        likes = like_buffer.count(post_id)
+    publish({"type": "post.liked", "id": post_id, "likes": likes})
+    return {"message": "Post liked", "likes": likes}
+
+@api_router.get("/community/likes/stats")
+async def get_like_stats():
+    return like_buffer.stats() if like_buffer is not None else {"buffered": False}
 
 # ----- Challenges -----
 
@@ -265,91 +724,403 @@ PRESET_CHALLENGES = [
 async def get_challenges():
     return PRESET_CHALLENGES
 
+# ----- Cache -----
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    return {**response_cache.stats(), "calendars": calendar_cache.stats()}
+
+# ----- Nightly maintenance -----
+
+# Streak decay and a rollup drift check over the last NIGHTLY_ROLLUP_DAYS once a
+# day, at NIGHTLY_AT on the NIGHTLY_TZ clock; a lease in job_locks makes one
+# worker run it (see nightly.py)
+nightly_enabled = os.environ.get("NIGHTLY_JOBS", "on") != "off"
+nightly_at = time.fromisoformat(os.environ.get("NIGHTLY_AT", "00:05"))
+nightly_tz = ZoneInfo(os.environ.get("NIGHTLY_TZ", "UTC"))
+nightly_rollup_days = int(os.environ.get("NIGHTLY_ROLLUP_DAYS", "7"))
+nightly_task = None
+
+async def run_nightly_maintenance() -> dict:
+    result = await nightly_maintenance(db, datetime.now(timezone.utc), nightly_rollup_days)
+    # Decayed streaks: retires cached stats and coach prompts (which key on the habits version)
+    response_cache.invalidate("habits")
+    return result
+
+# ----- Metrics -----
+
+metrics.registry.gauge("websocket_subscribers", "Open /api/ws connections in this process.", lambda: len(event_hub))
+metrics.registry.gauge("coach_llm_in_flight", "AI Coach provider calls in progress.", lambda: coach_guard.in_flight)
+
+@api_router.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition; scrape each worker process separately
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 # ----- AI Coach -----
 
+COACH_MODEL = "gemini-2.0-flash"
+
+def coach_provider() -> str:
+    # "fake" serves canned replies locally (offline development and benchmarks);
+    # "fake-blocking" serves them without streaming, like LlmChat
+    return os.environ.get("COACH_LLM_PROVIDER", "gemini")
+
+def coach_streams() -> bool:
+    # LlmChat has no streaming API; Gemini streams when called through its own SDK
+    return coach_provider() == "fake" or bool(os.environ.get("GEMINI_API_KEY"))
+
+_gemini_client = None
+
+def gemini_client():
+    global _gemini_client
+    if _gemini_client is None:
+        from google import genai
+        _gemini_client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+    return _gemini_client
+
+def make_llm_chat(session_id: str, system_message: str):
+    if coach_provider() in ("fake", "fake-blocking"):
+        chat = FakeLlmChat(
+            session_id,
+            system_message,
+            first_token_delay=float(os.environ.get("FAKE_LLM_FIRST_TOKEN_MS", "500")) / 1000,
+            token_delay=float(os.environ.get("FAKE_LLM_TOKEN_MS", "20")) / 1000
+        )
+        return chat if coach_provider() == "fake" else SendOnlyChat(chat)
+    if os.environ.get("GEMINI_API_KEY"):
+        return GeminiChat(gemini_client(), session_id, system_message, model=COACH_MODEL)
+    return LlmChat(
+        api_key=os.environ['EMERGENT_LLM_KEY'],
+        session_id=session_id,
+        system_message=system_message
+    ).with_model("gemini", COACH_MODEL)
+
+# Same staleness bound as cached responses, for writes this process didn't see
+coach_prompts = PromptCache(ttl=response_cache.ttl)
+# A pooled client is recycled after this many turns, carrying the conversation
+# over as a token-budgeted window of stored history
+coach_history_turns = int(os.environ.get("COACH_HISTORY_TURNS", "10"))
+coach_history_tokens = int(os.environ.get("COACH_HISTORY_TOKENS", "1500"))
+coach_sessions = ChatSessionPool(
+    lambda session_id, system_message: make_llm_chat(session_id, system_message),
+    max_sessions=int(os.environ.get("COACH_MAX_SESSIONS", "256")),
+    max_turns=coach_history_turns
+)
+# Keeps a provider brownout from piling up requests on the event loop
+coach_guard = LlmGuard(
+    max_concurrency=int(os.environ.get("COACH_LLM_CONCURRENCY", "8")),
+    timeout=float(os.environ.get("COACH_LLM_TIMEOUT", "30")),
+    queue_timeout=float(os.environ.get("COACH_LLM_QUEUE_TIMEOUT", "2")),
+    failure_threshold=int(os.environ.get("COACH_BREAKER_FAILURES", "5")),
+    reset_after=float(os.environ.get("COACH_BREAKER_RESET", "30")),
+    observer=metrics.observe_llm
+)
+# Replies to a conversation's opening message; later turns depend on history
+coach_replies = ReplyCache(
+    max_entries=int(os.environ.get("COACH_REPLY_CACHE_SIZE", "512")),
+    ttl=float(os.environ.get("COACH_REPLY_CACHE_TTL", "3600")),
+    similarity=float(os.environ["COACH_SEMANTIC_THRESHOLD"]) if os.environ.get("COACH_SEMANTIC_THRESHOLD") else None
+)
+
+def coach_configured() -> bool:
+    return (
+        coach_provider() in ("fake", "fake-blocking")
+        or bool(os.environ.get('GEMINI_API_KEY'))
+        or bool(os.environ.get('EMERGENT_LLM_KEY'))
+    )
+
+async def coach_system_prompt(user_id: str) -> str:
+    # Rebuilt when a habit write (or the nightly decay) has bumped the habits
+    # version, or after the TTL for writes made by other workers
+    version = response_cache.version("habits", user_id)
+    prompt = coach_prompts.get(user_id, version)
+    if prompt is None:
+        habits = await db.habits.find(
+            {"user_id": user_id}, {"_id": 0, "name": 1, "streak": 1, "total_completions": 1}
+        ).sort([("streak", -1), ("total_completions", -1)]).to_list(MAX_CONTEXT_HABITS)
+        total = len(habits)
+        if total == MAX_CONTEXT_HABITS:
+            total = await db.habits.count_documents({"user_id": user_id})
+        prompt = build_system_prompt(habits, total)
+        coach_prompts.put(user_id, version, prompt)
+    return prompt
+
+async def coach_chat(user_id: str, session_id: str, system_message: str, new_session: bool):
+    # Session ids come from clients, so pooled chats are keyed by owner too
+    pool_key = f"{user_id}:{session_id}"
+    chat = coach_sessions.lookup(pool_key, system_message)
+    if chat is None:
+        context = ""
+        if not new_session:
+            # Newest first from the index, then back to chronological order
+            messages = await db.chat_messages.find(
+                {"user_id": user_id, "session_id": session_id}, {"_id": 0, "role": 1, "content": 1}
+            ).sort([("created_at", -1), ("id", -1)]).to_list(2 * coach_history_turns + SUMMARY_QUESTIONS)
+            context = build_history_context(messages[::-1], coach_history_turns, coach_history_tokens)
+        chat = coach_sessions.create(pool_key, system_message, context)
+    return chat
+
+async def save_chat_turn(user_id: str, session_id: str, message: str, reply: str, asked_at: str):
+    turn = [
+        ChatHistoryMessage(session_id=session_id, role="user", content=message, created_at=asked_at),
+        ChatHistoryMessage(session_id=session_id, role="assistant", content=reply)
+    ]
+    await db.chat_messages.insert_many([{**m.model_dump(), "user_id": user_id} for m in turn])
+
 @api_router.post("/chat", response_model=ChatResponse)
-async def chat_with_coach(chat_input: ChatMessage):
-    api_key = os.environ.get('EMERGENT_LLM_KEY')
-    if not api_key:
+async def chat_with_coach(chat_input: ChatMessage, cache: bool = True, user_id: str = Depends(current_user)):
+    # cache=false bypasses the reply cache
+    if not coach_configured():
+        raise HTTPException(status_code=500, detail="AI Coach not configured")
+    
+    session_id = chat_input.session_id or str(uuid.uuid4())
+    asked_at = datetime.now(timezone.utc).isoformat()
+    system_message = await coach_system_prompt(user_id)
+
+    async def ask():
+        chat = await coach_chat(user_id, session_id, system_message, chat_input.session_id is None)
+        return await coach_guard.call(lambda: chat.send_message(UserMessage(text=chat_input.message)))
+
+    try:
+        if cache and chat_input.session_id is None:
+            response = await coach_replies.get_or_create(chat_input.message, system_message, ask)
+        else:
+            response = await ask()
+    except CoachUnavailable as e:
+        logging.warning(f"AI Coach unavailable, serving fallback: {str(e)}")
+        return ChatResponse(response=FALLBACK_REPLY, session_id=session_id, fallback=True)
+    
+    await save_chat_turn(user_id, session_id, chat_input.message, response, asked_at)
+    return ChatResponse(response=response, session_id=session_id)
+
+@api_router.post("/chat/stream")
+async def chat_with_coach_stream(chat_input: ChatMessage, cache: bool = True, user_id: str = Depends(current_user)):
+    # Same conversation as /chat, but tokens are relayed as Server-Sent Events
+    # while the model produces them; a client disconnect cancels generation.
+    if not coach_configured():
         raise HTTPException(status_code=500, detail="AI Coach not configured")
     
     session_id = chat_input.session_id or str(uuid.uuid4())
+    asked_at = datetime.now(timezone.utc).isoformat()
+    system_message = await coach_system_prompt(user_id)
+    cacheable = cache and chat_input.session_id is None
+
+    async def finish(reply: str):
+        await save_chat_turn(user_id, session_id, chat_input.message, reply, asked_at)
+    
+    async def upstream():
+        chat = await coach_chat(user_id, session_id, system_message, chat_input.session_id is None)
+        async for token in coach_guard.stream(stream_reply(chat, UserMessage(text=chat_input.message))):
+            yield token
     
-    # Get user's habits for context
-    habits = await db.habits.find({}, {"_id": 0}).to_list(100)
-    habits_context = ""
-    if habits:
-        habits_context = "\n\nUser's current habits:\n"
-        for h in habits:
-            habits_context += f"- {h['name']} (streak: {h.get('streak', 0)} days, total: {h.get('total_completions', 0)} completions)\n"
+    # Opening messages come from the reply cache, or share an identical reply in flight
+    tokens = coach_replies.stream(chat_input.message, system_message, upstream) if cacheable else upstream()
+    body = sse_reply(tokens, session_id, on_complete=finish, fallback=FALLBACK_REPLY)
     
-    system_message = f"""You are a warm, encouraging habit coach for the 'Awesome Life Habits' app. 
-Your role is to help users build positive habits and mindfulness practices.
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-Keep responses concise (2-4 sentences) and actionable.
-Use a calm, supportive tone. Celebrate wins, no matter how small.
-Suggest specific, practical tips when asked.
-Reference the user's existing habits when relevant to personalize advice.
-{habits_context}
+@api_router.get("/chat/{session_id}/history", response_model=List[ChatHistoryMessage])
+async def get_chat_history(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    before: Optional[str] = None,
+    user_id: str = Depends(current_user)
+):
+    # Pages walk backwards from the newest message; each page is chronological
+    # and X-Next-Cursor points at the page before it.
+    query = {"user_id": user_id, "session_id": session_id}
+    if before:
+        created_at, message_id = decode_cursor(before)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": message_id}}
+        ]
+    messages = await db.chat_messages.find(query, {"_id": 0, "user_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).to_list(limit)
+    headers = {"X-Next-Cursor": encode_cursor(messages[-1])} if len(messages) == limit else None
+    return ORJSONResponse(messages[::-1], headers=headers)
 
-Focus areas: habit formation, mindfulness, focus exercises (flower observation, expanding circle, breath counting), 
-motivation, and the principles from Atomic Habits (start small, habit stacking, environment design)."""
+@api_router.get("/chat/cache/stats")
+async def get_chat_cache_stats():
+    return coach_replies.stats()
 
-    try:
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=session_id,
-            system_message=system_message
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        user_message = UserMessage(text=chat_input.message)
-        response = await chat.send_message(user_message)
-        
-        return ChatResponse(response=response, session_id=session_id)
-    except Exception as e:
-        logging.error(f"AI Coach error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"AI Coach error: {str(e)}")
+@api_router.get("/chat/llm/stats")
+async def get_chat_llm_stats():
+    return coach_guard.stats()
 
 # ----- Stats -----
 
 @api_router.get("/stats")
-async def get_stats():
-    habits = await db.habits.find({}, {"_id": 0}).to_list(1000)
+async def get_stats(
+    days: int = Query(7, ge=1, le=366),
+    user_id: str = Depends(current_user),
+    tz_name: str = Depends(current_timezone)
+):
+    from datetime import timedelta
+    today = local_today(tz_name)
+    window = [today - timedelta(days=days - 1 - i) for i in range(days)]
     
-    total_habits = len(habits)
-    total_completions = sum(h.get("total_completions", 0) for h in habits)
-    total_streak = sum(h.get("streak", 0) for h in habits)
-    max_streak = max((h.get("streak", 0) for h in habits), default=0)
+    # Totals and the per-day histogram come back as one grouped document
+    result = await db.habits.aggregate(stats_pipeline(window, user_id)).to_list(1)
+    totals = result[0] if result else {}
     
-    # Weekly completions
-    from datetime import timedelta
-    today = datetime.now(timezone.utc).date()
-    week_ago = today - timedelta(days=7)
-    
-    weekly_data = []
-    for i in range(7):
-        day = week_ago + timedelta(days=i+1)
-        day_str = day.isoformat()
-        count = sum(1 for h in habits if day_str in h.get("completions", []))
-        weekly_data.append({
-            "day": day.strftime("%a"),
-            "completions": count
-        })
+    weekly_data = [
+        {"day": day.strftime("%a"), "date": day.isoformat(), "completions": totals.get(f"day_{i}", 0)}
+        for i, day in enumerate(window)
+    ]
     
     return {
-        "total_habits": total_habits,
-        "total_completions": total_completions,
-        "total_streak": total_streak,
-        "max_streak": max_streak,
+        "total_habits": totals.get("total_habits", 0),
+        "total_completions": totals.get("total_completions", 0),
+        "total_streak": totals.get("total_streak", 0),
+        "max_streak": totals.get("max_streak") or 0,
         "weekly_data": weekly_data
     }
 
+@api_router.get("/stats/range")
+async def get_stats_range(
+    from_date: date = Query(..., alias="from"),
+    to_date: date = Query(..., alias="to"),
+    user_id: str = Depends(current_user)
+):
+    from datetime import timedelta
+    span = (to_date - from_date).days + 1
+    if span < 1:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if span > 3660:
+        raise HTTPException(status_code=400, detail="Range is limited to 10 years")
+    
+    rollups = await db.daily_rollups.find(
+        {"user_id": user_id, "date": {"$gte": from_date.isoformat(), "$lte": to_date.isoformat()}},
+        {"_id": 0, "date": 1, "total": 1}
+    ).to_list(span)
+    totals = {r["date"]: r["total"] for r in rollups}
+    
+    days = []
+    for i in range(span):
+        day = (from_date + timedelta(days=i)).isoformat()
+        days.append({"date": day, "completions": totals.get(day, 0)})
+    
+    return {
+        "from": from_date.isoformat(),
+        "to": to_date.isoformat(),
+        "total_completions": sum(totals.values()),
+        "days": days
+    }
+
+# ----- Export / Import -----
+
+EXPORT_COLLECTIONS = ("habits", "community_posts")
+
+def parse_collections(collections: str) -> List[str]:
+    names = [c.strip() for c in collections.split(",") if c.strip()]
+    unknown = set(names) - set(EXPORT_COLLECTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(sorted(unknown))}")
+    return names
+
+@api_router.get("/export")
+async def export_data(
+    collections: str = ",".join(EXPORT_COLLECTIONS),
+    gzip: bool = False,
+    user_id: str = Depends(current_user)
+):
+    # Exports the caller's own habits and posts; owners are implied on import
+    names = parse_collections(collections)
+    
+    async def records():
+        for name in names:
+            async for doc in db[name].find({"user_id": user_id}, {"_id": 0, "user_id": 0}, batch_size=500):
+                yield {"collection": name, "doc": doc}
+    
+    body = encode_ndjson(records())
+    filename = "awesome-life-export.ndjson"
+    media_type = "application/x-ndjson"
+    if gzip:
+        body = gzip_stream(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.post("/import")
+async def import_data(
+    request: Request,
+    batch_size: int = Query(500, ge=1, le=5000),
+    user_id: str = Depends(current_user),
+    tz_name: str = Depends(current_timezone)
+):
+    chunks = request.stream()
+    if request.headers.get("content-encoding") == "gzip" or request.headers.get("content-type") == "application/gzip":
+        chunks = gunzip_stream(chunks)
+    
+    pending = {name: [] for name in EXPORT_COLLECTIONS}
+    imported = {name: 0 for name in EXPORT_COLLECTIONS}
+    
+    async def flush(name):
+        if pending[name]:
+            ops = [ReplaceOne({"user_id": user_id, "id": doc["id"]}, doc, upsert=True) for doc in pending[name]]
+            try:
+                await db[name].bulk_write(ops, ordered=False)
+            except BulkWriteError:
+                # Post ids are global; one owned by another user can't be replaced
+                raise HTTPException(status_code=409, detail=f"Conflicting {name} ids in import")
+            if name == "habits":
+                # Rollups follow each batch, so memory stays bounded by batch_size
+                await replace_rollups(db, user_id, pending[name])
+            response_cache.invalidate(name, scope=user_id if name == "habits" else None)
+            imported[name] += len(pending[name])
+            pending[name] = []
+    
+    # Documents are upserted by id in batches, so memory use is bounded by batch_size
+    line_no = 0
+    try:
+        async for line in iter_lines(chunks):
+            line_no += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                name = record["collection"]
+                if name == "habits":
+                    doc = habit_doc(Habit.model_validate(record["doc"]), user_id, tz_name)
+                elif name == "community_posts":
+                    doc = {**CommunityPost.model_validate(record["doc"]).model_dump(), "user_id": user_id}
+                else:
+                    raise ValueError(f"unknown collection {name!r}")
+            except (ValueError, KeyError, TypeError) as e:
+                raise HTTPException(status_code=400, detail=f"Line {line_no}: {e}")
+            pending[name].append(doc)
+            if len(pending[name]) >= batch_size:
+                await flush(name)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Invalid gzip body")
+    for name in EXPORT_COLLECTIONS:
+        await flush(name)
+    
+    if imported["habits"]:
+        calendar_cache.clear()
+    if imported["community_posts"]:
+        await refresh_top_posts()
+    if any(imported.values()):
+        publish(RESYNC)
+    return {"imported": imported}
+
 # ----- Seed Data -----
 
 @api_router.post("/seed")
-async def seed_data():
+async def seed_data(user_id: str = Depends(current_user), tz_name: str = Depends(current_timezone)):
     # Check if data exists
-    existing = await db.habits.count_documents({})
+    existing = await db.habits.count_documents({"user_id": user_id})
     if existing > 0:
         return {"message": "Data already exists"}
     
@@ -363,7 +1134,13 @@ async def seed_data():
     
     for habit_data in sample_habits:
         habit = Habit(**habit_data)
-        await db.habits.insert_one(habit.model_dump())
+        await db.habits.insert_one(habit_doc(habit, user_id, tz_name))
+    response_cache.invalidate("habits", scope=user_id)
+    
+    if await db.community_posts.count_documents({}, limit=1):
+        # The feed is shared, so only the first user to seed fills it
+        publish(RESYNC, user_id)
+        return {"message": "Sample data created"}
     
     sample_posts = [
         {"content": "Hit 7 days of focus practice! The flower observation exercise is amazing."},
@@ -374,19 +1151,32 @@ async def seed_data():
     
     for post_data in sample_posts:
         post = CommunityPost(**post_data)
-        await db.community_posts.insert_one(post.model_dump())
+        await db.community_posts.insert_one({**post.model_dump(), "user_id": user_id})
     
+    response_cache.invalidate("community_posts")
+    await refresh_top_posts()
+    publish(RESYNC)
     return {"message": "Sample data created"}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache)
+
+# Outside the response cache, so cache hits are timed too
+app.add_middleware(
+    metrics.MetricsMiddleware,
+    paths=response_cache.routes,
+    server_timing=os.environ.get("SERVER_TIMING", "off") == "on"
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
 # Configure logging
@@ -396,6 +1186,55 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def prepare_database():
+    # Tenancy first: it drops the global unique indexes ensure_indexes replaces
+    owned = await migrate_tenancy(db)
+    if any(owned.values()):
+        logger.info(f"Assigned unowned documents to '{DEFAULT_USER}': {owned}")
+    await ensure_indexes(db)
+    await check_query_plans(db)
+    migrated = await migrate_completions(db)
+    if migrated:
+        logger.info(f"Migrated {migrated} habits to completion bitmaps")
+    if migrated or owned["habits"] or not await db.daily_rollups.estimated_document_count():
+        rollups = await rebuild_rollups(db)
+        logger.info(f"Rebuilt {rollups} daily rollups")
+
+@app.on_event("startup")
+async def check_coach_streaming():
+    if coach_configured() and not coach_streams():
+        logger.warning(
+            "AI Coach provider can't stream (LlmChat has no streaming API): /api/chat/stream will send each "
+            "reply as one chunk after the full completion. Set GEMINI_API_KEY to stream through the Gemini SDK."
+        )
+
+@app.on_event("startup")
+async def start_background_tasks():
+    global ranking_task, like_task, change_stream_task, nightly_task
+    ranking_task = asyncio.create_task(
+        refresh_top_posts_periodically(float(os.environ.get("RANKING_REFRESH_SECONDS", "300")))
+    )
+    if like_buffer is not None:
+        like_task = asyncio.create_task(like_buffer.run(db))
+    if change_stream_events:
+        change_stream_task = asyncio.create_task(relay_change_stream(
+            db, event_hub, {"habits": habit_change_event, "community_posts": post_change_event}
+        ))
+    if nightly_enabled:
+        lock = JobLock(db, "nightly", lease=float(os.environ.get("NIGHTLY_LOCK_SECONDS", "3600")))
+        nightly_task = asyncio.create_task(run_daily(run_nightly_maintenance, lock, nightly_at, nightly_tz))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    tasks = [task for task in (ranking_task, like_task, change_stream_task, nightly_task) if task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if like_buffer is not None:
+        # Last flush before the connection goes away
+        try:
+            await like_buffer.flush(db)
+        except Exception as e:
+            logger.error(f"Final like flush failed, {like_buffer.stats()['pending_likes']} likes lost: {str(e)}")
     client.close()
@@ -0,0 +1,112 @@
+"""Streak calculation shared by the habit routes.
+
+A habit keeps its current run of completions in a `streak_state` sub-document
+(`start`, `end`, `length`, `best_before`) so logging today or undoing the latest
+completion is constant-time. Completions at most STREAK_GAP_DAYS apart belong to
+the same run, matching calculate_streak. Edits the fast paths can't express
+(back-dated changes at the edge of or before the current run) fall back to a
+full rescan.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Collection, Iterable, List, Optional
+
+STREAK_GAP_DAYS = 2
+
+
+def calculate_streak(completions: List[str], today: Optional[date] = None) -> int:
+    # `today` is the user's local day (see localdays.py); UTC's if not given
+    if not completions:
+        return 0
+
+    today = today or datetime.now(timezone.utc).date()
+    streak = 0
+    current_date = today
+
+    sorted_completions = sorted([datetime.fromisoformat(c).date() for c in completions], reverse=True)
+
+    for comp_date in sorted_completions:
+        if comp_date == current_date or comp_date == current_date - timedelta(days=1):
+            streak += 1
+            current_date = comp_date - timedelta(days=1)
+        else:
+            break
+
+    return streak
+
+
+def _to_day(value: str) -> date:
+    return date.fromisoformat(value[:10])
+
+
+@dataclass
+class StreakState:
+    start: Optional[date] = None
+    end: Optional[date] = None
+    length: int = 0
+    best_before: int = 0  # longest run that ended before `start`
+
+    @property
+    def longest(self) -> int:
+        return max(self.best_before, self.length)
+
+    def current(self, today: date) -> int:
+        if self.end is None or self.end > today or self.end < today - timedelta(days=1):
+            return 0
+        return self.length
+
+    @classmethod
+    def from_days(cls, days: Iterable[date]) -> "StreakState":
+        state = cls()
+        for day in sorted(set(days)):
+            if state.end is not None and (day - state.end).days <= STREAK_GAP_DAYS:
+                state.end = day
+                state.length += 1
+            else:
+                state = cls(start=day, end=day, length=1, best_before=state.longest)
+        return state
+
+    @classmethod
+    def from_completions(cls, completions: Iterable[str]) -> "StreakState":
+        return cls.from_days(_to_day(c) for c in completions)
+
+    @classmethod
+    def from_doc(cls, doc: Optional[dict]) -> Optional["StreakState"]:
+        if not doc or doc.get("stale"):
+            return None
+        return cls(
+            start=_to_day(doc["start"]) if doc.get("start") else None,
+            end=_to_day(doc["end"]) if doc.get("end") else None,
+            length=doc.get("length", 0),
+            best_before=doc.get("best_before", 0),
+        )
+
+    def to_doc(self) -> dict:
+        return {
+            "start": self.start.isoformat() if self.start else None,
+            "end": self.end.isoformat() if self.end else None,
+            "length": self.length,
+            "best_before": self.best_before,
+        }
+
+    def log(self, day: date, completed: bool, days: Collection[date]) -> "StreakState":
+        """Return the state after adding/removing `day`.
+
+        `day` must actually change the completions (not already present when
+        adding, present when removing). `days` holds the completion dates
+        *after* the edit; the fast paths only probe the two days before `day`.
+        """
+        if self.end is not None and self.start is not None:
+            if completed and day > self.end:
+                if (day - self.end).days <= STREAK_GAP_DAYS:
+                    return StreakState(self.start, day, self.length + 1, self.best_before)
+                return StreakState(day, day, 1, self.longest)
+            if completed and self.start < day < self.end:
+                return StreakState(self.start, self.end, self.length + 1, self.best_before)
+            if not completed and day == self.end and self.length > 1:
+                # Runs never skip more than one day, so the new end is one of these two.
+                previous = day - timedelta(days=1)
+                if previous not in days:
+                    previous -= timedelta(days=1)
+                return StreakState(self.start, previous, self.length - 1, self.best_before)
+        return StreakState.from_days(days)
@@ -0,0 +1,73 @@
+"""Per-user scoping of stored data.
+
+Every habit, rollup, chat message and community post carries a `user_id`,
+taken from the X-User-Id request header (`DEFAULT_USER` when absent, which is
+also where pre-existing single-user data is migrated). Habit-side routes only
+ever read and write the caller's documents; the community feed stays shared,
+with `user_id` recording the author.
+
+    python tenancy.py
+"""
+import asyncio
+import os
+import re
+from pathlib import Path
+from typing import Dict, Optional
+
+from pymongo.errors import OperationFailure
+
+DEFAULT_USER = "default"
+TENANT_COLLECTIONS = ("habits", "community_posts", "chat_messages")
+
+_USER_ID = re.compile(r"^[A-Za-z0-9_.@-]{1,64}$")
+
+# Global indexes from before tenancy; unique ones would clash across users
+LEGACY_INDEXES = {
+    "habits": ("id_1", "created_at_1_id_1"),
+    "daily_rollups": ("date_1",),
+    "chat_messages": ("session_id_1_created_at_1_id_1",),
+}
+
+
+def normalize_user_id(value: Optional[str]) -> Optional[str]:
+    """The user id to scope by, or None if `value` is not a valid id."""
+    if value is None or value == "":
+        return DEFAULT_USER
+    return value if _USER_ID.match(value) else None
+
+
+async def migrate_tenancy(db) -> Dict[str, int]:
+    """Assign unowned documents to DEFAULT_USER and drop the legacy global indexes.
+
+    Returns the number of documents migrated per collection. Daily rollups
+    predating tenancy have no owner either; callers rebuild them when any
+    habits were migrated.
+    """
+    migrated = {}
+    for name in TENANT_COLLECTIONS:
+        result = await db[name].update_many({"user_id": {"$exists": False}}, {"$set": {"user_id": DEFAULT_USER}})
+        migrated[name] = result.modified_count
+    for name, indexes in LEGACY_INDEXES.items():
+        for index in indexes:
+            try:
+                await db[name].drop_index(index)
+            except OperationFailure:
+                pass  # already gone (or never created)
+    return migrated
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        migrated = await migrate_tenancy(client[os.environ['DB_NAME']])
+        print(f"Assigned to '{DEFAULT_USER}': {migrated}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Bulk-log latency: one batched /habits/bulk-log call vs logging each habit in turn
+(what bulk-log used to do internally).
+
+Runs the app in-process against MONGO_URL, using a scratch database:
+
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_bulk_log.py
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "awesome_life_bench")
+
+import httpx  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+import server  # noqa: E402
+
+SIZES = (10, 100, 1000)
+ROUNDS = 5
+
+
+async def seed(http, count):
+    habits = await asyncio.gather(*[http.post("/api/habits", json={"name": f"Bench {i}"}) for i in range(count)])
+    return [h.json()["id"] for h in habits]
+
+
+async def time_sequential(http, ids, day):
+    start = time.perf_counter()
+    for habit_id in ids:
+        await http.post("/api/habits/log", json={"habit_id": habit_id, "date": day})
+    return time.perf_counter() - start
+
+
+async def time_bulk(http, ids, day):
+    start = time.perf_counter()
+    resp = await http.post("/api/habits/bulk-log", params={"date": day}, json=ids)
+    resp.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def main():
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    server.db = db
+    transport = httpx.ASGITransport(app=server.app)
+    print(f"{'ids':>6} {'sequential ms':>15} {'bulk ms':>10} {'speedup':>8}")
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for size in SIZES:
+                await client.drop_database(db.name)
+                ids = await seed(http, size)
+                sequential, bulk = [], []
+                for r in range(ROUNDS):
+                    # A fresh date per round so every call really writes
+                    sequential.append(await time_sequential(http, ids, f"2020-01-{r + 1:02d}"))
+                    bulk.append(await time_bulk(http, ids, f"2020-02-{r + 1:02d}"))
+                seq_ms = statistics.median(sequential) * 1000
+                bulk_ms = statistics.median(bulk) * 1000
+                print(f"{size:>6} {seq_ms:>15.1f} {bulk_ms:>10.1f} {seq_ms / bulk_ms:>7.1f}x")
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+AI Coach time-to-first-byte: blocking /chat vs streaming /chat/stream.
+
+Uses the local fake LLM provider, so it runs offline, in both of its modes:
+"fake" streams like the Gemini SDK client (GEMINI_API_KEY set), and
+"fake-blocking" only has send_message, like LlmChat. The latter is what
+/chat/stream does in production without a Gemini key: the first token waits
+for the whole completion. The app is served by uvicorn on a loopback port
+because the in-process ASGI transport buffers whole responses and would hide
+streaming.
+
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_coach_ttfb.py
+"""
+
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "awesome_life_bench")
+os.environ.setdefault("FAKE_LLM_FIRST_TOKEN_MS", "500")
+os.environ.setdefault("FAKE_LLM_TOKEN_MS", "20")
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+import server  # noqa: E402
+
+ROUNDS = 10
+PROVIDERS = ("fake", "fake-blocking")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def time_blocking(http, session_id):
+    start = time.perf_counter()
+    first = None
+    async with http.stream("POST", "/api/chat", json={"message": "hi", "session_id": session_id}) as resp:
+        resp.raise_for_status()
+        async for _ in resp.aiter_bytes():
+            if first is None:
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def time_streaming(http, session_id):
+    start = time.perf_counter()
+    first = None
+    async with http.stream("POST", "/api/chat/stream", json={"message": "hi", "session_id": session_id}) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            # The `session` event goes out immediately; time the first model token
+            if first is None and line == "event: token":
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def main():
+    port = free_port()
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning")
+    uv = uvicorn.Server(config)
+    serving = asyncio.create_task(uv.serve())
+    while not uv.started:
+        await asyncio.sleep(0.05)
+
+    results = {}
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as http:
+            for provider in PROVIDERS:
+                # Read per request, so switching it retargets new sessions
+                os.environ["COACH_LLM_PROVIDER"] = provider
+                for r in range(ROUNDS):
+                    for name, run in (("blocking", time_blocking), ("streaming", time_streaming)):
+                        first, total = await run(http, f"bench-{provider}-{name}-{r}")
+                        firsts, totals = results.setdefault((provider, name), ([], []))
+                        firsts.append(first)
+                        totals.append(total)
+    finally:
+        uv.should_exit = True
+        await serving
+        await server.db.client.drop_database(server.db.name)
+
+    print(f"{'provider':>14} {'endpoint':>10} {'TTFB ms':>10} {'total ms':>10}")
+    for (provider, name), (firsts, totals) in results.items():
+        print(
+            f"{provider:>14} {name:>10} "
+            f"{statistics.median(firsts) * 1000:>10.1f} {statistics.median(totals) * 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
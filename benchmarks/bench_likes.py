@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Like storm on one post: a write per click (LIKE_BUFFER=off) vs the coalescing
+like buffer.
+
+Fires concurrent likes at a single post through the app in-process and reports
+accepted likes/s next to the documents MongoDB actually updated per second
+(serverStatus metrics.document.updated), using a scratch database:
+
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_likes.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "awesome_life_bench")
+
+import httpx  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+import server  # noqa: E402
+from like_buffer import LikeBuffer  # noqa: E402
+
+LIKES = 5000
+CONCURRENCY = 50
+
+
+async def documents_updated(client):
+    status = await client.admin.command("serverStatus")
+    return status["metrics"]["document"]["updated"]
+
+
+async def storm(http, post_id):
+    queue = asyncio.Queue()
+    for _ in range(LIKES):
+        queue.put_nowait(None)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            resp = await http.post(f"/api/community/{post_id}/like")
+            resp.raise_for_status()
+
+    await asyncio.gather(*[worker() for _ in range(CONCURRENCY)])
+
+
+async def run(http, client, db, buffered):
+    await client.drop_database(db.name)
+    post = (await http.post("/api/community", json={"content": "Viral"})).json()
+    server.like_buffer = LikeBuffer(flush_interval=0.25, on_flush=server.likes_flushed) if buffered else None
+    flusher = asyncio.create_task(server.like_buffer.run(db)) if buffered else None
+
+    before = await documents_updated(client)
+    start = time.perf_counter()
+    await storm(http, post["id"])
+    elapsed = time.perf_counter() - start
+    if buffered:
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+        await server.like_buffer.flush(db)
+    updated = await documents_updated(client) - before
+
+    stored = (await db.community_posts.find_one({"id": post["id"]}))["likes"]
+    assert stored == LIKES, f"expected {LIKES} likes, stored {stored}"
+    return LIKES / elapsed, updated / elapsed, updated
+
+
+async def main():
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    server.db = db
+    transport = httpx.ASGITransport(app=server.app)
+    print(f"{'path':>10} {'likes/s':>10} {'doc writes/s':>13} {'doc writes':>11}")
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            for name, buffered in (("direct", False), ("buffered", True)):
+                likes_per_s, writes_per_s, writes = await run(http, client, db, buffered)
+                print(f"{name:>10} {likes_per_s:>10.0f} {writes_per_s:>13.0f} {writes:>11}")
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
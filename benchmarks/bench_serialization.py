@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Serialization cost of a GET /habits page: the response_model path (validate the
+stored documents as List[Habit], dump them in JSON mode, json.dumps) vs the
+habit_payload + orjson path the route uses now.
+
+No database needed; documents are built in memory with YEARS of completions:
+
+    python benchmarks/bench_serialization.py
+"""
+
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "awesome_life_bench")
+
+import orjson  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import server  # noqa: E402
+
+HABITS = 1000
+YEARS = (0, 1, 3)
+ROUNDS = 7
+
+# FastAPI builds one of these per route for response_model=List[Habit]
+habit_list = TypeAdapter(List[server.Habit])
+
+
+def stored_habits(years):
+    rng = random.Random(years)
+    today = datetime.now(timezone.utc).date()
+    days = [(today - timedelta(days=i)).isoformat() for i in range(365 * years)]
+    return [
+        server.habit_doc(
+            server.Habit(name=f"Habit {i}", completions=sorted(d for d in days if rng.random() < 0.6)), "bench"
+        )
+        for i in range(HABITS)
+    ]
+
+
+def response_model_path(docs):
+    # What FastAPI did with the list of dicts the route used to return
+    validated = habit_list.validate_python(docs)
+    content = habit_list.dump_python(validated, mode="json", exclude_unset=True)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def orjson_path(docs):
+    return orjson.dumps([server.habit_payload(doc) for doc in docs])
+
+
+def best_ms(fn, docs):
+    times = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(docs)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, statistics.median(times) * 1000
+
+
+def main():
+    print(f"{HABITS} habits per page, best/median of {ROUNDS} rounds")
+    print(f"{'years':>5} {'path':>15} {'best ms':>9} {'median ms':>10} {'KiB':>8}")
+    for years in YEARS:
+        docs = stored_habits(years)
+        assert json.loads(response_model_path(docs)) == json.loads(orjson_path(docs))
+        for name, fn in (("response_model", response_model_path), ("orjson", orjson_path)):
+            best, median = best_ms(fn, docs)
+            size = len(fn(docs)) / 1024
+            print(f"{years:>5} {name:>15} {best:>9.1f} {median:>10.1f} {size:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Load test for the main API endpoints: p50/p95/p99 latency and throughput.
+
+Runs the app in-process through httpx against a local mongod (MONGO_URL,
+scratch database) or, with --backend mock, against mongomock-motor. Habits are
+seeded with a configurable history, then each endpoint is hit with concurrent
+requests and the results are written as JSON:
+
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/load_test.py --habits 200 --years 3
+    python benchmarks/load_test.py --backend mock --output baseline.json
+    python benchmarks/load_test.py --compare baseline.json
+
+--compare prints the change against an earlier result and exits non-zero when
+any endpoint's p95 latency got worse by more than --threshold percent.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "awesome_life_bench")
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from tenancy import DEFAULT_USER  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--backend", choices=("mongo", "mock"), default="mongo")
+    parser.add_argument("--habits", type=int, default=50, help="habits to seed")
+    parser.add_argument("--years", type=int, default=2, help="years of completion history per habit")
+    parser.add_argument("--density", type=float, default=0.6, help="share of days completed")
+    parser.add_argument("--posts", type=int, default=500, help="community posts to seed")
+    parser.add_argument("--requests", type=int, default=500, help="timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--bulk-size", type=int, default=10, help="habits per bulk-log request")
+    parser.add_argument("--no-cache", action="store_true", help="disable the GET response cache")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for data and requests")
+    parser.add_argument("--output", type=Path, help="results file (default: benchmarks/results/load-<time>.json)")
+    parser.add_argument("--compare", type=Path, help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed p95 regression in percent")
+    return parser.parse_args(argv)
+
+
+def percentile(ordered, q):
+    # Linear interpolation between closest ranks; `ordered` must be sorted
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    ms = [t * 1000 for t in ordered]
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        "max_ms": round(ms[-1], 3) if ms else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def connect(backend):
+    if backend == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+        # mongomock has no sessions; take the standalone-mongod path
+        server._supports_transactions = False
+        return AsyncMongoMockClient()
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(os.environ["MONGO_URL"])
+
+
+async def seed(db, args, rng):
+    today = datetime.now(timezone.utc).date()
+    days = [today - timedelta(days=i) for i in range(365 * args.years)]
+    habit_docs = []
+    for i in range(args.habits):
+        completions = sorted(d.isoformat() for d in days if rng.random() < args.density)
+        habit = server.Habit(name=f"Bench habit {i}", completions=completions)
+        habit_docs.append(server.habit_doc(habit, DEFAULT_USER))
+    if habit_docs:
+        await db.habits.insert_many(habit_docs)
+    posts = [
+        {**server.CommunityPost(content=f"Bench post {i}", likes=rng.randrange(50)).model_dump(), "user_id": DEFAULT_USER}
+        for i in range(args.posts)
+    ]
+    if posts:
+        await db.community_posts.insert_many(posts)
+    await rebuild_rollups(db)
+    return [doc["id"] for doc in habit_docs], days
+
+
+def scenarios(args, rng, habit_ids, days):
+    # Each scenario builds one request; log dates fall inside the seeded history
+    def log():
+        return "POST", "/api/habits/log", {"json": {
+            "habit_id": rng.choice(habit_ids),
+            "date": rng.choice(days).isoformat(),
+            "completed": rng.random() < 0.8,
+        }}
+
+    def bulk_log():
+        return "POST", "/api/habits/bulk-log", {
+            "params": {"date": rng.choice(days).isoformat()},
+            "json": rng.sample(habit_ids, min(args.bulk_size, len(habit_ids))),
+        }
+
+    return {
+        "GET /api/habits": lambda: ("GET", "/api/habits", {}),
+        "POST /api/habits/log": log,
+        "POST /api/habits/bulk-log": bulk_log,
+        "GET /api/stats": lambda: ("GET", "/api/stats", {"params": {"days": 30}}),
+        "GET /api/community": lambda: ("GET", "/api/community", {}),
+    }
+
+
+async def hammer(http, make_request, count, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(count))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = make_request()
+            start = time.perf_counter()
+            try:
+                resp = await http.request(method, url, **kwargs)
+                ok = resp.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors, time.perf_counter() - start
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print p50/p95 changes per endpoint; returns the endpoints that regressed."""
+    regressed = []
+    print(f"\n{'endpoint':<26} {'p50 before':>11} {'after':>9} {'p95 before':>11} {'after':>9} {'change':>8}")
+    for name, result in current["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if not before:
+            continue
+        change = (result["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0.0
+        if change > threshold:
+            regressed.append(name)
+        print(f"{name:<26} {before['p50_ms']:>11.2f} {result['p50_ms']:>9.2f} "
+              f"{before['p95_ms']:>11.2f} {result['p95_ms']:>9.2f} {change:>+7.1f}%")
+    return regressed
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    client = await connect(args.backend)
+    db = client[os.environ["DB_NAME"]]
+    server.db = db
+    server.response_cache.clear()
+    if args.no_cache:
+        server.response_cache.ttl = 0
+    transport = httpx.ASGITransport(app=server.app)
+    results = {}
+    try:
+        await client.drop_database(db.name)
+        start = time.perf_counter()
+        habit_ids, days = await seed(db, args, rng)
+        print(f"Seeded {args.habits} habits x {args.years} years and {args.posts} posts "
+              f"in {time.perf_counter() - start:.1f}s ({args.backend})")
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            print(f"{'endpoint':<26} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'errors':>7}")
+            for name, make_request in scenarios(args, rng, habit_ids, days).items():
+                if not habit_ids and "habits/" in name:
+                    continue
+                await hammer(http, make_request, args.warmup, args.concurrency)
+                summary = summarize(*await hammer(http, make_request, args.requests, args.concurrency))
+                results[name] = summary
+                print(f"{name:<26} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} "
+                      f"{summary['p99_ms']:>8.2f} {summary['throughput_rps']:>8.0f} {summary['errors']:>7}")
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "config": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "endpoints": results,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        regressed = compare(results, json.loads(args.compare.read_text()), args.threshold)
+        if regressed:
+            print(f"p95 regressed by more than {args.threshold:.0f}%: {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
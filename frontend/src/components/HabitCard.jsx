@@ -5,12 +5,13 @@ import { Progress } from './ui/progress';
 import { DropdownMenu, DropdownMenuContent, DropdownMenuItem, DropdownMenuTrigger } from './ui/dropdown-menu';
 import { Button } from './ui/button';
 import { useApp } from '../context/AppContext';
+import { localDate } from '../lib/utils';
 
 const HabitCard = ({ habit, onEdit }) => {
   const { logHabit, deleteHabit } = useApp();
   const [isChecking, setIsChecking] = useState(false);
 
-  const today = new Date().toISOString().split('T')[0];
+  const today = localDate();
   const isCompletedToday = habit.completions?.includes(today);
 
   const handleCheck = async () => {
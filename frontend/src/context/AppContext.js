@@ -1,10 +1,37 @@
-import React, { createContext, useContext, useState, useEffect, useCallback } from 'react';
+import React, { createContext, useContext, useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 
 const AppContext = createContext();
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
+// The backend scopes habits, stats and chats by this id
+const USER_ID = localStorage.getItem('userId') || 'default';
+axios.defaults.headers.common['X-User-Id'] = USER_ID;
+// ...and counts "today" (logs, streaks, stats) in this timezone
+const TIME_ZONE = Intl.DateTimeFormat().resolvedOptions().timeZone || 'UTC';
+axios.defaults.headers.common['X-Timezone'] = TIME_ZONE;
+
+// A create's HTTP response and its WebSocket event arrive in either order,
+// so both go through these (keyed on id) rather than appending
+const upsertHabit = (habits, habit) => (
+  habits.some(h => h.id === habit.id) ? habits.map(h => h.id === habit.id ? habit : h) : [...habits, habit]
+);
+const addPost = (posts, post) => (posts.some(p => p.id === post.id) ? posts : [post, ...posts]);
+// Logs come back as deltas (one date plus the new counters), patched into the habit
+const applyLog = (habits, log) => habits.map(h => {
+  if (h.id !== log.id) return h;
+  const others = (h.completions || []).filter(d => d !== log.date);
+  return {
+    ...h,
+    completions: log.completed ? [...others, log.date].sort() : others,
+    streak: log.streak,
+    longest_streak: log.longest_streak,
+    total_completions: log.total_completions,
+    last_completed: log.last_completed,
+  };
+});
+
 export const AppProvider = ({ children }) => {
   const [habits, setHabits] = useState([]);
   const [stats, setStats] = useState(null);
@@ -29,7 +56,8 @@ export const AppProvider = ({ children }) => {
   // Fetch habits
   const fetchHabits = useCallback(async () => {
     try {
-      const res = await axios.get(`${API}/habits`);
+      // The UI only shows the last month of completions (HabitsPage heatmap)
+      const res = await axios.get(`${API}/habits`, { params: { completion_days: 31 } });
       setHabits(res.data);
     } catch (err) {
       console.error('Error fetching habits:', err);
@@ -91,12 +119,84 @@ export const AppProvider = ({ children }) => {
     init();
   }, [seedData, fetchHabits, fetchStats, fetchCommunityPosts, fetchChallenges]);
 
+  // Live updates: apply change events from /api/ws instead of re-fetching.
+  // Stats are still computed server-side, so they are refreshed (debounced).
+  const socketOpen = useRef(false);
+  useEffect(() => {
+    let socket;
+    let retryTimer;
+    let statsTimer;
+    let attempts = 0;
+    let closed = false;
+
+    const refreshStats = () => {
+      clearTimeout(statsTimer);
+      statsTimer = setTimeout(fetchStats, 300);
+    };
+
+    const applyEvent = (event) => {
+      switch (event.type) {
+        case 'habit.created':
+        case 'habit.updated':
+          setHabits(prev => upsertHabit(prev, event.habit));
+          refreshStats();
+          break;
+        case 'habit.logged':
+          setHabits(prev => applyLog(prev, event.log));
+          refreshStats();
+          break;
+        case 'habit.deleted':
+          setHabits(prev => prev.filter(h => h.id !== event.id));
+          refreshStats();
+          break;
+        case 'post.created':
+          setCommunityPosts(prev => addPost(prev, event.post));
+          break;
+        case 'post.liked':
+          setCommunityPosts(prev => prev.map(p => p.id === event.id ? { ...p, likes: event.likes } : p));
+          break;
+        case 'resync':
+          fetchHabits();
+          fetchStats();
+          fetchCommunityPosts();
+          break;
+        default:
+          break;
+      }
+    };
+
+    const connect = () => {
+      socket = new WebSocket(`${API.replace(/^http/, 'ws')}/ws?user_id=${encodeURIComponent(USER_ID)}`);
+      socket.onopen = () => {
+        // Events were missed while disconnected
+        if (attempts > 0) applyEvent({ type: 'resync' });
+        attempts = 0;
+        socketOpen.current = true;
+      };
+      socket.onmessage = (message) => applyEvent(JSON.parse(message.data));
+      socket.onclose = () => {
+        socketOpen.current = false;
+        if (closed) return;
+        attempts += 1;
+        retryTimer = setTimeout(connect, Math.min(30000, 1000 * 2 ** attempts));
+      };
+    };
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      clearTimeout(statsTimer);
+      socket.close();
+    };
+  }, [fetchHabits, fetchStats, fetchCommunityPosts]);
+
   // Create habit
   const createHabit = async (habitData) => {
     try {
       const res = await axios.post(`${API}/habits`, habitData);
-      setHabits(prev => [...prev, res.data]);
-      await fetchStats();
+      setHabits(prev => upsertHabit(prev, res.data));
+      if (!socketOpen.current) await fetchStats();
       return res.data;
     } catch (err) {
       console.error('Error creating habit:', err);
@@ -121,7 +221,7 @@ export const AppProvider = ({ children }) => {
     try {
       await axios.delete(`${API}/habits/${habitId}`);
       setHabits(prev => prev.filter(h => h.id !== habitId));
-      await fetchStats();
+      if (!socketOpen.current) await fetchStats();
     } catch (err) {
       console.error('Error deleting habit:', err);
       throw err;
@@ -132,8 +232,8 @@ export const AppProvider = ({ children }) => {
   const logHabit = async (habitId, completed = true) => {
     try {
       const res = await axios.post(`${API}/habits/log`, { habit_id: habitId, completed });
-      setHabits(prev => prev.map(h => h.id === habitId ? res.data : h));
-      await fetchStats();
+      setHabits(prev => applyLog(prev, res.data));
+      if (!socketOpen.current) await fetchStats();
       return res.data;
     } catch (err) {
       console.error('Error logging habit:', err);
@@ -145,7 +245,7 @@ export const AppProvider = ({ children }) => {
   const createPost = async (content) => {
     try {
       const res = await axios.post(`${API}/community`, { content });
-      setCommunityPosts(prev => [res.data, ...prev]);
+      setCommunityPosts(prev => addPost(prev, res.data));
       return res.data;
     } catch (err) {
       console.error('Error creating post:', err);
@@ -156,9 +256,9 @@ export const AppProvider = ({ children }) => {
   // Like post
   const likePost = async (postId) => {
     try {
-      await axios.post(`${API}/community/${postId}/like`);
+      const res = await axios.post(`${API}/community/${postId}/like`);
       setCommunityPosts(prev => prev.map(p => 
-        p.id === postId ? { ...p, likes: p.likes + 1 } : p
+        p.id === postId ? { ...p, likes: res.data.likes } : p
       ));
     } catch (err) {
       console.error('Error liking post:', err);
@@ -176,6 +276,45 @@ export const AppProvider = ({ children }) => {
     }
   };
 
+  // Streams the reply as Server-Sent Events; onToken gets each chunk as it arrives.
+  // Abort via `signal` to stop generation server-side.
+  const streamChatWithCoach = async (message, sessionId = null, onToken = () => {}, signal) => {
+    const res = await fetch(`${API}/chat/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'X-User-Id': USER_ID, 'X-Timezone': TIME_ZONE },
+      body: JSON.stringify({ message, session_id: sessionId }),
+      signal
+    });
+    if (!res.ok || !res.body) {
+      throw new Error(`AI Coach stream failed: ${res.status}`);
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let session = sessionId;
+    let text = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const blocks = buffer.split('\n\n');
+      buffer = blocks.pop();
+      for (const block of blocks) {
+        const [eventLine, dataLine] = block.split('\n');
+        const event = eventLine.replace('event: ', '');
+        const data = JSON.parse(dataLine.replace('data: ', ''));
+        if (event === 'session') session = data.session_id;
+        if (event === 'token') {
+          text += data.text;
+          onToken(data.text);
+        }
+        if (event === 'error') throw new Error(data.detail);
+      }
+    }
+    return { response: text, session_id: session };
+  };
+
   const value = {
     habits,
     stats,
@@ -192,7 +331,8 @@ export const AppProvider = ({ children }) => {
     logHabit,
     createPost,
     likePost,
-    chatWithCoach
+    chatWithCoach,
+    streamChatWithCoach
   };
 
   return (
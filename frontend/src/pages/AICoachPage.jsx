@@ -17,7 +17,7 @@ const suggestedQuestions = [
 ];
 
 const AICoachPage = () => {
-  const { chatWithCoach, habits } = useApp();
+  const { streamChatWithCoach, habits } = useApp();
   const [messages, setMessages] = useState([
     {
       role: 'assistant',
@@ -62,9 +62,22 @@ const AICoachPage = () => {
     setIsLoading(true);
 
     try {
-      const response = await chatWithCoach(text.trim(), sessionId);
+      // Show the reply as it streams in; the first token replaces the loader
+      let started = false;
+      const appendToken = (token) => {
+        if (!started) {
+          started = true;
+          setIsLoading(false);
+          setMessages(prev => [...prev, { role: 'assistant', content: token }]);
+          return;
+        }
+        setMessages(prev => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: last.content + token }];
+        });
+      };
+      const response = await streamChatWithCoach(text.trim(), sessionId, appendToken);
       setSessionId(response.session_id);
-      setMessages(prev => [...prev, { role: 'assistant', content: response.response }]);
     } catch (err) {
       toast.error('Failed to get response');
       setMessages(prev => [...prev, { 
@@ -6,6 +6,7 @@ import { Card } from '../components/ui/card';
 import { Tabs, TabsList, TabsTrigger } from '../components/ui/tabs';
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from '../components/ui/tooltip';
 import HabitCard from '../components/HabitCard';
+import { localDate } from '../lib/utils';
 import AddHabitModal from '../components/AddHabitModal';
 import { useApp } from '../context/AppContext';
 import { toast } from 'sonner';
@@ -73,7 +74,7 @@ const HabitsPage = () => {
   };
 
   const handleBulkLog = async () => {
-    const today = new Date().toISOString().split('T')[0];
+    const today = localDate();
     const incompleteHabits = habits.filter(h => !h.completions?.includes(today));
     
     if (incompleteHabits.length === 0) {
@@ -134,7 +135,7 @@ const HabitsPage = () => {
     for (let i = 29; i >= 0; i--) {
       const date = new Date(today);
       date.setDate(date.getDate() - i);
-      const dateStr = date.toISOString().split('T')[0];
+      const dateStr = localDate(date);
       const completed = habit.completions?.includes(dateStr);
       const isToday = i === 0;
       const dayName = date.toLocaleDateString('en-US', { weekday: 'short' });
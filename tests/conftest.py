@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "awesome_life_test")
+
+
+@pytest.fixture
+def server():
+    pytest.importorskip("emergentintegrations")
+    import server
+    return server
+
+
+@pytest.fixture
+def run_api(server, monkeypatch):
+    """Run `scenario(http, db)` against the app wired to a scratch MongoDB database."""
+    import httpx
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    def _run(scenario):
+        async def main():
+            client = AsyncIOMotorClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=500)
+            try:
+                await client.admin.command("ping")
+            except Exception:
+                client.close()
+                pytest.skip("MongoDB not reachable")
+            db = client[os.environ["DB_NAME"]]
+            await client.drop_database(db.name)
+            monkeypatch.setattr(server, "db", db)
+            server.response_cache.clear()
+            transport = httpx.ASGITransport(app=server.app)
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                    return await scenario(http, db)
+            finally:
+                await client.drop_database(db.name)
+                client.close()
+
+        return asyncio.run(main())
+
+    return _run
+
+
+@pytest.fixture
+def coach_stub(server, monkeypatch):
+    """Give the coach fresh prompt/reply caches and a session pool of `chat` clients.
+
+    `chat(session_id, system_message)` builds each client (the configured
+    provider if None); returns the list of clients created, in order.
+    """
+    make_llm_chat = server.make_llm_chat
+
+    def _stub(chat=None, max_turns=None, guard=None):
+        chats = []
+
+        def factory(session_id, system_message):
+            chats.append((chat or make_llm_chat)(session_id, system_message))
+            return chats[-1]
+
+        if chat is not None:
+            monkeypatch.setenv("EMERGENT_LLM_KEY", "test")
+            monkeypatch.setattr(server, "make_llm_chat", factory)
+        monkeypatch.setattr(server, "coach_sessions", server.ChatSessionPool(factory, max_turns=max_turns))
+        monkeypatch.setattr(server, "coach_prompts", server.PromptCache())
+        monkeypatch.setattr(server, "coach_replies", server.ReplyCache())
+        if guard is not None:
+            monkeypatch.setattr(server, "coach_guard", guard)
+        return chats
+
+    return _stub
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import date
+
+from completions import CompletionBitmap, completion_fields, log_fields
+
+
+def test_log_fields_matches_full_recompute():
+    today = date(2024, 3, 10)
+    habit = completion_fields(["2024-03-01", "2024-03-08", "2024-03-09"], today)
+    fields = log_fields(habit, date(2024, 3, 10), True, today)
+    assert fields == completion_fields(["2024-03-01", "2024-03-08", "2024-03-09", "2024-03-10"], today)
+    assert log_fields({**habit, **fields}, date(2024, 3, 10), True, today) is None
+    assert log_fields(habit, date(2024, 3, 5), False, today) is None
+
+
+def test_log_fields_rescans_legacy_state():
+    today = date(2024, 3, 10)
+    habit = {"completion_bits": CompletionBitmap.from_days(["2024-03-09"]).to_doc()}
+    assert log_fields(habit, today, True, today)["streak"] == 2
+
+
+def test_bulk_log_reports_per_id_status(run_api):
+    async def scenario(http, db):
+        ids = [(await http.post("/api/habits", json={"name": f"H{i}"})).json()["id"] for i in range(5)]
+        await http.post("/api/habits/log", json={"habit_id": ids[0], "date": "2024-01-10"})
+        resp = await http.post("/api/habits/bulk-log", params={"date": "2024-01-10"}, json=ids + ["missing"])
+        rollup = await db.daily_rollups.find_one({"date": "2024-01-10"})
+        bad = await http.post("/api/habits/bulk-log", params={"date": "nope"}, json=ids)
+        return ids, resp.json(), rollup, bad
+
+    ids, results, rollup, bad = run_api(scenario)
+    assert [r["habit_id"] for r in results] == ids + ["missing"]
+    assert [r["status"] for r in results] == ["logged"] * 5 + ["not_found"]
+    assert all(r["habit"]["completions"] == ["2024-01-10"] for r in results[:5])
+    assert all(r["habit"]["total_completions"] == 1 for r in results[:5])
+    assert results[-1]["habit"] is None
+    assert sorted(rollup["habit_ids"]) == sorted(ids)
+    assert rollup["total"] == 5
+    assert bad.status_code == 400
+
+
+def test_bulk_log_races_with_single_logs(run_api):
+    async def scenario(http, db):
+        ids = [(await http.post("/api/habits", json={"name": f"R{i}"})).json()["id"] for i in range(30)]
+        await asyncio.gather(
+            http.post("/api/habits/bulk-log", params={"date": "2024-02-01"}, json=ids),
+            *[http.post("/api/habits/log", json={"habit_id": i, "date": "2024-01-31"}) for i in ids],
+        )
+        return await db.habits.find({}, {"_id": 0}).to_list(None)
+
+    for habit in run_api(scenario):
+        assert CompletionBitmap.from_doc(habit["completion_bits"]).isoformat() == ["2024-01-31", "2024-02-01"]
+        assert habit["total_completions"] == 2
@@ -0,0 +1,502 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from coach import (
+    ChatSessionPool,
+    CoachUnavailable,
+    FakeLlmChat,
+    GeminiChat,
+    LlmGuard,
+    PromptCache,
+    ReplyCache,
+    build_habits_context,
+    build_history_context,
+    build_system_prompt,
+    estimate_tokens,
+    normalize_message,
+    sse_reply,
+    stream_reply,
+)
+
+
+def parse_sse(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+async def collect(chunks):
+    return b"".join([chunk async for chunk in chunks]).decode()
+
+
+def test_context_is_capped_and_summarized():
+    habits = [{"name": f"H{i}", "streak": i, "total_completions": 2 * i} for i in range(3)]
+    context = build_habits_context(habits, total_habits=40)
+    assert context.startswith("\n\nUser's current habits:\n- H0 (streak: 0 days, total: 0 completions)\n")
+    assert context.endswith("- ...and 37 more habits\n")
+    assert build_habits_context([], 0) == ""
+    assert "{habits_context}" not in build_system_prompt(habits, 3)
+
+
+def test_prompt_cache_is_invalidated_by_version():
+    cache = PromptCache(max_entries=2)
+    cache.put("u1", 1, "prompt v1")
+    assert cache.get("u1", 1) == "prompt v1"
+    assert cache.get("u1", 2) is None
+    cache.put("u2", 1, "a")
+    cache.put("u3", 1, "b")
+    assert cache.get("u1", 1) is None
+
+
+def test_prompt_cache_entries_expire():
+    cache = PromptCache(ttl=0.0)
+    cache.put("u1", 1, "prompt v1")
+    assert cache.get("u1", 1) is None
+
+
+def test_session_pool_reuses_and_evicts():
+    created = []
+
+    def factory(session_id, system_message):
+        created.append((session_id, system_message))
+        return object()
+
+    pool = ChatSessionPool(factory, max_sessions=2)
+    first = pool.get("s1", "p")
+    assert pool.get("s1", "p") is first
+    assert pool.get("s1", "p2") is not first
+    pool.get("s2", "p")
+    pool.get("s3", "p")
+    assert len(pool) == 2
+    pool.get("s1", "p2")
+    assert created[-1] == ("s1", "p2")
+    assert len(created) == 5
+
+
+class StubChat:
+    def __init__(self, session_id, system_message):
+        self.session_id = session_id
+        self.system_message = system_message
+        self.messages = []
+
+    async def send_message(self, message):
+        self.messages.append(message.text)
+        return f"reply {len(self.messages)}"
+
+
+def test_chat_reuses_sessions_until_habits_change(run_api, coach_stub):
+    chats = coach_stub(StubChat)
+
+    async def scenario(http, db):
+        for i in range(20):
+            await http.post("/api/habits", json={"name": f"Habit {i}"})
+        first = (await http.post("/api/chat", json={"message": "hi", "session_id": "s"})).json()
+        second = (await http.post("/api/chat", json={"message": "again", "session_id": "s"})).json()
+        await http.post("/api/habits", json={"name": "Brand new"})
+        third = (await http.post("/api/chat", json={"message": "and now", "session_id": "s"})).json()
+        return first, second, third
+
+    first, second, third = run_api(scenario)
+    assert (first["response"], second["response"], third["response"]) == ("reply 1", "reply 2", "reply 1")
+    assert len(chats) == 2
+    assert chats[0].system_message.count("\n- Habit") == 15
+    assert "...and 5 more habits" in chats[0].system_message
+    assert "...and 6 more habits" in chats[1].system_message
+
+
+def test_sse_reply_relays_tokens_in_order():
+    chat = FakeLlmChat("s", "prompt", first_token_delay=0, token_delay=0)
+    events = parse_sse(asyncio.run(collect(sse_reply(stream_reply(chat, "hi"), "s"))))
+    assert events[0] == ("session", {"session_id": "s"})
+    assert events[-1] == ("done", {})
+    assert "".join(data["text"] for name, data in events[1:-1]) == FakeLlmChat.REPLY
+    assert {name for name, _ in events[1:-1]} == {"token"}
+
+
+def test_sse_reply_falls_back_to_blocking_clients_and_reports_errors():
+    class Blocking:
+        async def send_message(self, message):
+            return "whole reply"
+
+    class Broken:
+        async def send_message(self, message):
+            raise RuntimeError("quota exceeded")
+
+    assert parse_sse(asyncio.run(collect(sse_reply(stream_reply(Blocking(), "hi"), "s"))))[1:] == [
+        ("token", {"text": "whole reply"}),
+        ("done", {}),
+    ]
+    assert parse_sse(asyncio.run(collect(sse_reply(stream_reply(Broken(), "hi"), "s"))))[-1] == (
+        "error",
+        {"detail": "AI Coach error"},
+    )
+    assert parse_sse(asyncio.run(collect(sse_reply(stream_reply(Broken(), "hi"), "s", fallback="canned"))))[1:] == [
+        ("token", {"text": "canned"}),
+        ("done", {"fallback": True}),
+    ]
+
+
+def test_gemini_chat_streams_sdk_chunks():
+    # Shaped like google.genai's client.aio.chats; only the calls GeminiChat makes
+    class Chunk:
+        def __init__(self, text):
+            self.text = text
+
+    class Chunks:
+        def __init__(self, texts):
+            self.texts = texts
+            self.closed = False
+
+        def __aiter__(self):
+            return self._iterate()
+
+        async def _iterate(self):
+            for text in self.texts:
+                yield Chunk(text)
+
+        async def aclose(self):
+            self.closed = True
+
+    class SdkChat:
+        def __init__(self, config):
+            self.config = config
+            self.sent = []
+            self.streams = []
+
+        async def send_message_stream(self, message):
+            self.sent.append(message)
+            self.streams.append(Chunks(["Start ", None, "small."]))
+            return self.streams[-1]
+
+        async def send_message(self, message):
+            return Chunk("Start small.")
+
+    class Client:
+        class aio:
+            class chats:
+                @staticmethod
+                def create(model, config):
+                    return SdkChat(config)
+
+    class Message:
+        text = "hi"
+
+    chat = GeminiChat(Client(), "s", "prompt")
+    events = parse_sse(asyncio.run(collect(sse_reply(stream_reply(chat, Message()), "s"))))
+    assert [data for name, data in events if name == "token"] == [{"text": "Start "}, {"text": "small."}]
+    assert chat._chat.config == {"system_instruction": "prompt"}
+    assert chat._chat.sent == ["hi"] and chat._chat.streams[0].closed
+    assert asyncio.run(chat.send_message("hi")) == "Start small."
+
+
+def test_cancelling_the_stream_stops_generation():
+    produced = []
+
+    class Slow(FakeLlmChat):
+        async def stream_message(self, message):
+            async for token in super().stream_message(message):
+                produced.append(token)
+                yield token
+
+    async def main():
+        chat = Slow("s", "prompt", first_token_delay=0, token_delay=0.05)
+        received = []
+
+        async def consume():
+            async for chunk in sse_reply(stream_reply(chat, "hi"), "s"):
+                received.append(chunk)
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.12)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        count = len(produced)
+        await asyncio.sleep(0.15)
+        return received, count
+
+    received, count = asyncio.run(main())
+    assert 1 <= count < len(FakeLlmChat.REPLY.split(" "))
+    assert len(produced) == count
+    assert not any(b"event: done" in chunk for chunk in received)
+
+
+def test_chat_stream_endpoint(run_api, coach_stub, monkeypatch):
+    monkeypatch.setenv("COACH_LLM_PROVIDER", "fake")
+    monkeypatch.setenv("FAKE_LLM_FIRST_TOKEN_MS", "0")
+    monkeypatch.setenv("FAKE_LLM_TOKEN_MS", "0")
+    coach_stub()
+
+    async def scenario(http, db):
+        streamed = await http.post("/api/chat/stream", json={"message": "hi", "session_id": "s"})
+        blocking = await http.post("/api/chat", json={"message": "hi", "session_id": "s"})
+        return streamed, blocking.json()
+
+    streamed, blocking = run_api(scenario)
+    assert streamed.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(streamed.text)
+    assert events[0] == ("session", {"session_id": "s"})
+    assert "".join(data["text"] for name, data in events if name == "token") == blocking["response"]
+
+
+def test_reply_cache_exact_and_semantic_lookup():
+    cache = ReplyCache(similarity=0.6)
+    cache.store("How do I keep my streak?", "prompt", "Stack it onto coffee.")
+    assert normalize_message("  How do I keep my STREAK?! ") == "how do i keep my streak"
+    assert cache.lookup("how do i keep my streak", "prompt") == "Stack it onto coffee."
+    assert cache.lookup("How do I keep my streak going?", "prompt") == "Stack it onto coffee."
+    assert cache.lookup("How do I keep my streak?", "other habits") is None
+    assert cache.lookup("Suggest habits for better focus", "prompt") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["semantic_hits"], stats["misses"]) == (2, 1, 2)
+    assert stats["hit_rate"] == 0.5
+
+    exact_only = ReplyCache(ttl=0)
+    exact_only.store("a question", "prompt", "answer")
+    assert exact_only.lookup("a question", "prompt") is None
+
+
+def test_reply_cache_coalesces_inflight_requests():
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "shared answer"
+
+    async def fail():
+        raise RuntimeError("upstream down")
+
+    async def main():
+        cache = ReplyCache()
+        replies = await asyncio.gather(*[cache.get_or_create("Hi there", "prompt", produce) for _ in range(5)])
+        again = await cache.get_or_create("hi there!", "prompt", produce)
+        results = await asyncio.gather(
+            cache.get_or_create("boom", "prompt", fail), cache.get_or_create("boom", "prompt", fail),
+            return_exceptions=True,
+        )
+        return cache, replies, again, results
+
+    cache, replies, again, results = asyncio.run(main())
+    assert replies == ["shared answer"] * 5 and again == "shared answer"
+    assert len(calls) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.stats()["coalesced"] == 5
+    assert cache.lookup("boom", "prompt") is None
+
+
+def test_reply_cache_shares_inflight_streams():
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        for token in ("Start", " small", "."):
+            await asyncio.sleep(0.01)
+            yield token
+
+    async def main():
+        cache = ReplyCache()
+
+        async def read(limit=None):
+            tokens = []
+            stream = cache.stream("Hi there", "prompt", produce)
+            async for token in stream:
+                tokens.append(token)
+                if len(tokens) == limit:
+                    await stream.aclose()  # this client disconnects
+                    break
+            return tokens
+
+        streamed = await asyncio.gather(read(), read(limit=1), read(), read())
+        whole = await cache.get_or_create("hi there", "prompt", produce)
+        # Everyone leaving cancels the upstream call, and nothing is cached
+        abandoned = cache.stream("bye", "prompt", produce)
+        await abandoned.__anext__()
+        await abandoned.aclose()
+        await asyncio.sleep(0.05)
+        return cache, streamed, whole
+
+    cache, streamed, whole = asyncio.run(main())
+    assert streamed == [["Start", " small", "."], ["Start"], ["Start", " small", "."], ["Start", " small", "."]]
+    assert whole == "Start small."
+    assert len(calls) == 2  # "Hi there" once, "bye" once
+    assert cache.stats()["coalesced"] == 3 and cache.stats()["inflight"] == 0
+    assert cache.lookup("bye", "prompt") is None
+
+
+def test_concurrent_identical_streams_make_one_upstream_call(run_api, server, coach_stub, monkeypatch):
+    monkeypatch.setenv("COACH_LLM_PROVIDER", "fake")
+    monkeypatch.setenv("FAKE_LLM_FIRST_TOKEN_MS", "50")
+    monkeypatch.setenv("FAKE_LLM_TOKEN_MS", "0")
+    chats = coach_stub()
+
+    async def scenario(http, db):
+        return await asyncio.gather(*[
+            http.post("/api/chat/stream", json={"message": "How do I start?"}) for _ in range(8)
+        ])
+
+    responses = run_api(scenario)
+    replies = {
+        "".join(data["text"] for name, data in parse_sse(r.text) if name == "token") for r in responses
+    }
+    assert replies == {FakeLlmChat.REPLY}
+    assert len(chats) == 1
+    assert server.coach_replies.stats()["coalesced"] == 7
+
+
+def test_chat_caches_opening_messages(run_api, coach_stub):
+    chats = coach_stub(StubChat)
+
+    async def scenario(http, db):
+        first = (await http.post("/api/chat", json={"message": "How to stay motivated?"})).json()
+        second = (await http.post("/api/chat", json={"message": "how to stay motivated"})).json()
+        bypass = (await http.post("/api/chat", params={"cache": "false"}, json={"message": "How to stay motivated?"})).json()
+        streamed = await http.post("/api/chat/stream", json={"message": "How to stay motivated?"})
+        stats = (await http.get("/api/chat/cache/stats")).json()
+        return first, second, bypass, streamed, stats
+
+    first, second, bypass, streamed, stats = run_api(scenario)
+    assert first["response"] == second["response"] == "reply 1"
+    assert first["session_id"] != second["session_id"]
+    assert len(chats) == 2
+    assert bypass["response"] == "reply 1" and chats[1].messages == ["How to stay motivated?"]
+    assert ("token", {"text": "reply 1"}) in parse_sse(streamed.text)
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_history_context_is_windowed_and_budgeted():
+    messages = []
+    for i in range(30):
+        messages.append({"role": "user", "content": f"question {i}"})
+        messages.append({"role": "assistant", "content": f"answer {i}"})
+    context = build_history_context(messages, max_turns=3, token_budget=1000)
+    recent = context.split("Recent conversation:\n")[1].splitlines()
+    assert recent == ["User: question 27", "Coach: answer 27", "User: question 28", "Coach: answer 28",
+                      "User: question 29", "Coach: answer 29"]
+    assert "asked about: question 0; question 1;" in context and "question 26." in context
+
+    tight = build_history_context(messages, max_turns=3, token_budget=20)
+    assert estimate_tokens(tight) <= 25
+    assert "Coach: answer 29" in tight and "question 27" not in tight
+    assert build_history_context([]) == ""
+
+
+def test_session_pool_recycles_after_max_turns():
+    pool = ChatSessionPool(lambda session_id, system_message: [system_message], max_turns=2)
+    first = pool.get("s", "prompt")
+    assert pool.lookup("s", "prompt") is first
+    assert pool.lookup("s", "prompt") is None
+    assert pool.create("s", "prompt", "\nhistory") == ["prompt\nhistory"]
+    assert pool.lookup("s", "prompt") == ["prompt\nhistory"]
+
+
+def test_chat_history_is_stored_paged_and_replayed(run_api, coach_stub):
+    chats = coach_stub(StubChat, max_turns=2)
+
+    async def scenario(http, db):
+        for i in range(3):
+            await http.post("/api/chat", json={"message": f"q{i}", "session_id": "s"})
+        await http.post("/api/chat/stream", json={"message": "q3", "session_id": "s"})
+        first = await http.get("/api/chat/s/history", params={"limit": 5})
+        rest = await http.get("/api/chat/s/history", params={"limit": 5, "before": first.headers["x-next-cursor"]})
+        return first, rest
+
+    first, rest = run_api(scenario)
+    history = rest.json() + first.json()
+    assert [m["content"] for m in history] == ["q0", "reply 1", "q1", "reply 2", "q2", "reply 1", "q3", "reply 2"]
+    assert [m["role"] for m in history[:2]] == ["user", "assistant"]
+    assert "x-next-cursor" not in rest.headers
+    # Third turn recycled the client and replayed the first two from storage
+    assert len(chats) == 2
+    assert "User: q0\nCoach: reply 1\nUser: q1\nCoach: reply 2" in chats[1].system_message
+
+
+def test_guard_limits_concurrency_and_sheds_load():
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def main():
+        guard = LlmGuard(max_concurrency=2, queue_timeout=0.01)
+        results = await asyncio.gather(*[guard.call(slow) for _ in range(4)], return_exceptions=True)
+        return guard, results
+
+    guard, results = asyncio.run(main())
+    assert results.count("ok") == 2
+    assert all(isinstance(r, CoachUnavailable) for r in results if r != "ok")
+    stats = guard.stats()
+    assert (stats["rejected"], stats["max_queued"], stats["in_flight"], stats["state"]) == (2, 4, 0, "closed")
+
+
+def test_guard_breaker_opens_short_circuits_and_recovers():
+    async def hang():
+        await asyncio.sleep(1)
+
+    async def boom():
+        raise RuntimeError("500 from provider")
+
+    async def fine():
+        return "ok"
+
+    async def main():
+        guard = LlmGuard(timeout=0.01, failure_threshold=2, reset_after=0.05)
+        for fn in (hang, boom):
+            with pytest.raises(CoachUnavailable):
+                await guard.call(fn)
+        assert guard.state == "open"
+        started = time.monotonic()
+        with pytest.raises(CoachUnavailable, match="circuit open"):
+            await guard.call(fine)
+        assert time.monotonic() - started < 0.01
+        await asyncio.sleep(0.06)
+        with pytest.raises(CoachUnavailable):
+            await guard.call(boom)  # failed trial reopens immediately
+        assert guard.state == "open"
+        await asyncio.sleep(0.06)
+        assert await guard.call(fine) == "ok"
+        return guard.stats()
+
+    stats = asyncio.run(main())
+    assert stats["state"] == "closed"
+    assert (stats["calls"], stats["failures"], stats["timeouts"], stats["short_circuited"]) == (4, 3, 1, 1)
+
+
+def test_guard_times_out_stalled_streams():
+    async def main():
+        guard = LlmGuard(timeout=0.05)
+        stalled = FakeLlmChat("s", "prompt", first_token_delay=0, token_delay=1)
+        events = parse_sse(await collect(sse_reply(guard.stream(stalled.stream_message("hi")), "s")))
+        steady = FakeLlmChat("s", "prompt", first_token_delay=0.01, token_delay=0.001)
+        text = "".join([t async for t in guard.stream(steady.stream_message("hi"))])
+        return guard, events, text
+
+    guard, events, text = asyncio.run(main())
+    assert events[1][0] == "token" and events[-1] == ("error", {"detail": "AI Coach error"})
+    assert text == FakeLlmChat.REPLY
+    assert guard.stats()["timeouts"] == 1 and guard.stats()["in_flight"] == 0
+
+
+def test_chat_serves_fallback_when_provider_fails(run_api, server, coach_stub):
+    class Failing(StubChat):
+        async def send_message(self, message):
+            raise RuntimeError("secret upstream detail")
+
+    coach_stub(Failing, guard=server.LlmGuard(failure_threshold=1, reset_after=60))
+
+    async def scenario(http, db):
+        first = await http.post("/api/chat", json={"message": "hi", "session_id": "s"})
+        second = await http.post("/api/chat", json={"message": "hi", "session_id": "s"})
+        stats = (await http.get("/api/chat/llm/stats")).json()
+        stored = await db.chat_messages.count_documents({})
+        return first, second, stats, stored
+
+    first, second, stats, stored = run_api(scenario)
+    assert first.status_code == second.status_code == 200
+    assert first.json() == {"response": server.FALLBACK_REPLY, "session_id": "s", "fallback": True}
+    assert "secret" not in first.text
+    assert (stats["state"], stats["failures"], stats["short_circuited"]) == ("open", 1, 1)
+    assert stored == 0
@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo import UpdateOne
+
+from like_buffer import LikeBuffer
+from rankings import hot_score, refresh_rankings
+
+NOW = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+
+def ago(**delta):
+    return (NOW - timedelta(**delta)).isoformat()
+
+
+def test_hot_score_decays_with_age():
+    assert hot_score(10, ago(hours=1), NOW) > hot_score(10, ago(days=1), NOW)
+    assert hot_score(10, ago(hours=1), NOW) > hot_score(2, ago(hours=1), NOW)
+    # A fresh post with a few likes overtakes an old favourite
+    assert hot_score(3, ago(hours=2), NOW) > hot_score(50, ago(days=5), NOW)
+    assert hot_score(0, "2024-06-01T11:00:00", NOW) == hot_score(0, ago(hours=1), NOW)
+
+
+def test_feed_pages_by_cursor(run_api):
+    async def scenario(http, db):
+        await db.community_posts.insert_many([
+            {"id": f"p{i:02d}", "content": f"post {i}", "created_at": ago(minutes=i // 2), "likes": 0, "extra": "x"}
+            for i in range(25)
+        ])
+        pages, cursor = [], None
+        while True:
+            params = {"limit": 10, **({"before": cursor} if cursor else {})}
+            resp = await http.get("/api/community", params=params)
+            pages.append(resp.json())
+            cursor = resp.headers.get("x-next-cursor")
+            if not cursor:
+                return pages
+
+    pages = run_api(scenario)
+    assert [len(page) for page in pages] == [10, 10, 5]
+    posts = [post for page in pages for post in page]
+    assert len({post["id"] for post in posts}) == 25
+    keys = [(post["created_at"], post["id"]) for post in posts]
+    assert keys == sorted(keys, reverse=True)
+    assert set(posts[0]) == {"id", "content", "created_at", "likes"}
+
+
+def test_top_posts_come_from_the_refreshed_ranking(run_api):
+    async def scenario(http, db):
+        await db.community_posts.insert_many([
+            {"id": "old-favourite", "content": "a", "created_at": ago(days=5), "likes": 50},
+            {"id": "fresh", "content": "b", "created_at": ago(hours=2), "likes": 3},
+            {"id": "quiet", "content": "c", "created_at": ago(hours=1), "likes": 0},
+            {"id": "ancient", "content": "d", "created_at": ago(days=90), "likes": 500},
+        ])
+        ranked = await refresh_rankings(db, now=NOW)
+        top = (await http.get("/api/community/top")).json()
+        await db.community_posts.update_one({"id": "quiet"}, {"$set": {"likes": 100}})
+        stale = (await http.get("/api/community/top", params={"limit": 1})).json()
+        return ranked, top, stale
+
+    ranked, top, stale = run_api(scenario)
+    assert ranked == 3
+    assert [post["id"] for post in top] == ["fresh", "quiet", "old-favourite"]
+    assert stale[0]["id"] == "fresh"
+
+
+def test_concurrent_refreshes_keep_the_best_posts():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["rankings"]
+        await db.community_posts.insert_many([
+            {"id": f"p{i}", "content": "", "created_at": ago(hours=1), "likes": i} for i in range(10)
+        ])
+        ranked = await asyncio.gather(*(refresh_rankings(db, size=3, now=NOW) for _ in range(3)))
+        top = await db.community_rankings.find({}).sort("rank", 1).to_list(None)
+        return ranked, [post["id"] for post in top], await db.list_collection_names()
+
+    ranked, top, collections = asyncio.run(scenario())
+    assert ranked == [3, 3, 3]
+    assert top == ["p9", "p8", "p7"]
+    assert sorted(collections) == ["community_posts", "community_rankings"]
+
+
+class RecordingPosts:
+    """Async stand-in for the community_posts collection that records bulk writes."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    async def bulk_write(self, ops, ordered=True):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("primary stepped down")
+        self.batches.append(list(ops))
+
+
+class RecordingDb:
+    def __init__(self, fail=False):
+        self.community_posts = RecordingPosts(fail)
+
+
+def test_like_buffer_coalesces_and_retries():
+    async def main():
+        buffer = LikeBuffer()
+        for _ in range(500):
+            buffer.add("viral")
+        buffer.add("quiet")
+        assert buffer.pending("viral") == 500
+
+        down = RecordingDb(fail=True)
+        with pytest.raises(RuntimeError):
+            await buffer.flush(down)
+        assert buffer.pending("viral") == 500
+
+        db = RecordingDb()
+        buffer.add("viral")
+        assert await buffer.flush(db) == 2
+        assert await buffer.flush(db) == 0
+        return buffer, db
+
+    buffer, db = asyncio.run(main())
+    assert db.community_posts.batches == [[
+        UpdateOne({"id": "viral"}, {"$inc": {"likes": 501}}),
+        UpdateOne({"id": "quiet"}, {"$inc": {"likes": 1}}),
+    ]]
+    assert buffer.pending("viral") == 0
+    assert buffer.stats()["writes"] == 2
+
+
+def test_like_buffer_knows_counts_until_they_are_flushed():
+    async def main():
+        flushed = []
+        buffer = LikeBuffer(on_flush=lambda: flushed.append(True))
+        assert buffer.count("p") is None
+        buffer.remember("p", 10)
+        buffer.add("p", 2)
+        assert buffer.count("p") == 12
+
+        await buffer.flush(RecordingDb())
+        # Flushed counts are forgotten so the next click reads the new total
+        assert buffer.count("p") is None
+        assert flushed == [True]
+        await buffer.flush(RecordingDb())
+        assert flushed == [True]
+
+        small = LikeBuffer(max_known=2)
+        for post_id in ("a", "b", "c"):
+            small.remember(post_id, 1)
+        assert small.count("a") is None and small.count("c") == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_flush_keeps_its_counts():
+    async def main():
+        buffer = LikeBuffer()
+        buffer.add("p", 3)
+        flush = asyncio.create_task(buffer.flush(RecordingDb()))
+        await asyncio.sleep(0)
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+        return buffer
+
+    assert asyncio.run(main()).pending("p") == 3
+
+
+def test_likes_are_read_your_writes_until_flushed(run_api, server):
+    async def scenario(http, db):
+        post = (await http.post("/api/community", json={"content": "Day 30!"})).json()
+        replies = [(await http.post(f"/api/community/{post['id']}/like")).json() for _ in range(5)]
+        feed = (await http.get("/api/community")).json()
+        stored = (await db.community_posts.find_one({"id": post["id"]}))["likes"]
+        await server.like_buffer.flush(db)
+        flushed = (await db.community_posts.find_one({"id": post["id"]}))["likes"]
+        after = (await http.get("/api/community")).json()
+        missing = await http.post("/api/community/nope/like")
+        return replies, feed, stored, flushed, after, missing
+
+    replies, feed, stored, flushed, after, missing = run_api(scenario)
+    assert [r["likes"] for r in replies] == [1, 2, 3, 4, 5]
+    assert feed[0]["likes"] == 5 and stored == 0
+    assert flushed == 5 and after[0]["likes"] == 5
+    assert missing.status_code == 404
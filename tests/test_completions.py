@@ -0,0 +1,125 @@
+from datetime import date, timedelta
+
+import pytest
+from hypothesis import given, strategies as st
+
+from completions import CompletionBitmap, completion_fields
+
+days_strategy = st.sets(st.dates(min_value=date(2019, 1, 1), max_value=date(2026, 12, 31)), max_size=200)
+
+
+@given(days_strategy)
+def test_bitmap_round_trips_dates(days):
+    bitmap = CompletionBitmap.from_days(days)
+    assert list(bitmap) == sorted(days)
+    assert len(bitmap) == len(days)
+    assert CompletionBitmap.from_doc(bitmap.to_doc()).isoformat() == sorted(d.isoformat() for d in days)
+
+
+@given(days_strategy, st.dates(min_value=date(2019, 1, 1), max_value=date(2026, 12, 31)))
+def test_membership(days, probe):
+    bitmap = CompletionBitmap.from_days(days)
+    assert (probe in bitmap) == (probe in days)
+    assert (probe.isoformat() in bitmap) == (probe in days)
+
+
+@given(days_strategy, st.dates(min_value=date(2019, 1, 1), max_value=date(2026, 12, 31)), st.integers(0, 800))
+def test_range_slicing(days, start, span):
+    end = start + timedelta(days=span)
+    bitmap = CompletionBitmap.from_days(days)
+    expected = sorted(d for d in days if start <= d <= end)
+    assert list(bitmap.days(start, end)) == expected
+    assert bitmap.count(start, end) == len(expected)
+    assert bitmap.isoformat(start, end) == [d.isoformat() for d in expected]
+    assert bitmap.isoformat(start=start) == [d.isoformat() for d in sorted(days) if d >= start]
+
+
+def test_discard_and_leap_day():
+    bitmap = CompletionBitmap.from_days(["2024-02-29", "2024-12-31", "2025-01-01"])
+    assert bitmap.to_doc().keys() == {"y2024", "y2025"}
+    bitmap.discard("2025-01-01")
+    bitmap.discard("2023-05-05")
+    assert bitmap.isoformat() == ["2024-02-29", "2024-12-31"]
+    assert "y2025" not in bitmap.to_doc()
+    assert all(w < 2 ** 32 for words in bitmap.to_doc().values() for w in words)
+
+
+def test_completion_fields():
+    today = date(2024, 3, 10)
+    fields = completion_fields(["2024-03-01", "2024-03-08", "2024-03-09", "2024-03-10"], today)
+    assert fields["total_completions"] == 4
+    assert fields["last_completed"] == "2024-03-10"
+    assert fields["streak"] == 3
+    assert fields["longest_streak"] == 3
+    assert fields["streak_state"]["start"] == "2024-03-08"
+
+
+def test_habit_api_still_returns_completion_strings(run_api):
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Bits"})).json()
+        for day in ("2024-01-02", "2023-12-31", "2024-01-01"):
+            await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": day})
+        stored = await db.habits.find_one({"id": habit["id"]})
+        listed = (await http.get("/api/habits")).json()
+        return stored, listed
+
+    stored, listed = run_api(scenario)
+    assert "completions" not in stored
+    assert set(stored["completion_bits"]) == {"y2023", "y2024"}
+    assert listed[0]["completions"] == ["2023-12-31", "2024-01-01", "2024-01-02"]
+    assert listed[0]["total_completions"] == 3
+
+
+def test_migration_converts_legacy_documents(run_api, server):
+    from migrate_completions import migrate_completions
+
+    async def scenario(http, db):
+        await db.habits.insert_one({
+            "id": "legacy", "name": "Old", "completions": ["2022-05-01", "2022-05-02"], "streak": 9,
+        })
+        assert await migrate_completions(db) == 1
+        assert await migrate_completions(db) == 0
+        return await db.habits.find_one({"id": "legacy"}, {"_id": 0})
+
+    migrated = run_api(scenario)
+    assert "completions" not in migrated
+    assert migrated["total_completions"] == 2
+    assert migrated["longest_streak"] == 2
+    assert migrated["streak"] == 0
+    assert CompletionBitmap.from_doc(migrated["completion_bits"]).isoformat() == ["2022-05-01", "2022-05-02"]
+
+
+def test_update_pipeline_matches_python_reference():
+    # mongomock can evaluate the pipeline; the tests above cover a real mongod.
+    import asyncio
+    import random
+
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from completions import completion_update_pipeline
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["pipeline"]
+        await db.habits.insert_one({"id": "h", **completion_fields([], date(2024, 1, 1))})
+        rng = random.Random(3)
+        days = set()
+        for i in range(300):
+            today = date(2024, 1, 1) + timedelta(days=i // 2)
+            day = today - timedelta(days=rng.choice([0, 0, 0, 1, 2, 3, 9]))
+            completed = rng.random() < 0.8
+            doc = await db.habits.find_one_and_update(
+                {"id": "h"},
+                completion_update_pipeline(day.isoformat(), completed, today),
+                return_document=True,
+                projection={"_id": 0},
+            )
+            (days.add if completed else days.discard)(day)
+            assert list(CompletionBitmap.from_doc(doc["completion_bits"])) == sorted(days)
+            assert doc["total_completions"] == len(days)
+            expected = completion_fields(days, today)
+            if doc["streak_state"].get("stale"):
+                await db.habits.update_one({"id": "h"}, {"$set": expected})
+                continue
+            for field in ("streak_state", "last_completed", "streak", "longest_streak"):
+                assert doc[field] == expected[field]
+
+    asyncio.run(scenario())
@@ -0,0 +1,76 @@
+import asyncio
+
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+
+from events import RESYNC, EventHub, serve_events
+
+
+def test_hub_fans_out_and_resyncs_slow_clients():
+    async def main():
+        hub = EventHub(max_queue=2)
+        with hub.subscribe() as fast, hub.subscribe() as slow:
+            hub.publish({"type": "post.liked", "id": "p", "likes": 1})
+            assert fast.get_nowait() == {"type": "post.liked", "id": "p", "likes": 1}
+            for likes in (2, 3):
+                hub.publish({"type": "post.liked", "id": "p", "likes": likes})
+                fast.get_nowait()
+            assert slow.qsize() == 1 and slow.get_nowait() == RESYNC
+            assert len(hub) == 2
+        return hub
+
+    hub = asyncio.run(main())
+    assert len(hub) == 0
+    assert (hub.published, hub.overflows) == (3, 1)
+
+
+def test_websocket_streams_published_events():
+    app = FastAPI()
+    hub = EventHub()
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket):
+        await serve_events(websocket, hub)
+
+    @app.post("/poke")
+    async def poke():
+        hub.publish({"type": "habit.deleted", "id": "h1"})
+        return {"subscribers": len(hub)}
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws") as ws:
+            assert client.post("/poke").json() == {"subscribers": 1}
+            assert ws.receive_json() == {"type": "habit.deleted", "id": "h1"}
+        # The subscription goes away with the socket
+        for _ in range(50):
+            if client.post("/poke").json() == {"subscribers": 0}:
+                break
+        else:
+            raise AssertionError("subscriber leaked after disconnect")
+
+
+def test_mutations_publish_deltas(run_api, server):
+    async def scenario(http, db):
+        with server.event_hub.subscribe("default") as queue, server.event_hub.subscribe("other") as other:
+            habit = (await http.post("/api/habits", json={"name": "Read"})).json()
+            await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": "2024-05-01"})
+            await http.post("/api/habits/bulk-log", params={"date": "2024-05-02"}, json=[habit["id"], "missing"])
+            post = (await http.post("/api/community", json={"content": "Hello"})).json()
+            await http.post(f"/api/community/{post['id']}/like")
+            await http.delete(f"/api/habits/{habit['id']}")
+            events = []
+            while not queue.empty():
+                events.append(queue.get_nowait())
+            # Another user's socket only sees the shared community events
+            others = [other.get_nowait()["type"] for _ in range(other.qsize())]
+        return habit, post, events, others
+
+    habit, post, events, others = run_api(scenario)
+    assert others == ["post.created", "post.liked"]
+    assert [e["type"] for e in events] == [
+        "habit.created", "habit.logged", "habit.logged", "post.created", "post.liked", "habit.deleted",
+    ]
+    assert events[2]["log"]["date"] == "2024-05-02" and events[2]["log"]["total_completions"] == 2
+    assert "completions" not in events[1]["log"]
+    assert events[4] == {"type": "post.liked", "id": post["id"], "likes": 1}
+    assert events[5] == {"type": "habit.deleted", "id": habit["id"]}
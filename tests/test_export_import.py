@@ -0,0 +1,83 @@
+import asyncio
+import gzip
+import json
+
+from ndjson import encode_ndjson, gunzip_stream, gzip_stream, iter_lines
+
+
+async def _collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def test_ndjson_round_trip_through_gzip():
+    records = [{"collection": "habits", "doc": {"id": str(i), "name": "x" * (i % 50)}} for i in range(5000)]
+
+    async def scenario():
+        compressed = b"".join(await _collect(gzip_stream(encode_ndjson(_aiter(records), chunk_size=1024))))
+        # Re-chunk at awkward boundaries to exercise line reassembly
+        pieces = [compressed[i:i + 777] for i in range(0, len(compressed), 777)]
+        lines = await _collect(iter_lines(gunzip_stream(_aiter(pieces))))
+        return compressed, lines
+
+    compressed, lines = asyncio.run(scenario())
+    assert gzip.decompress(compressed).count(b"\n") == len(records)
+    assert [json.loads(line) for line in lines] == records
+
+
+def test_iter_lines_keeps_trailing_partial_line():
+    lines = asyncio.run(_collect(iter_lines(_aiter([b'{"a":', b'1}\n{"b"', b':2}']))))
+    assert lines == [b'{"a":1}', b'{"b":2}']
+
+
+def test_export_then_import_restores_everything(run_api):
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Backup"})).json()
+        for day in ("2023-12-30", "2024-01-01"):
+            await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": day})
+        await http.post("/api/community", json={"content": "Saved"})
+        exported = await http.get("/api/export", params={"gzip": "true"})
+
+        await db.habits.drop()
+        await db.community_posts.drop()
+        await db.daily_rollups.drop()
+        imported = await http.post(
+            "/api/import", params={"batch_size": 1}, content=exported.content,
+            headers={"content-type": "application/gzip"},
+        )
+        habits = (await http.get("/api/habits")).json()
+        posts = (await http.get("/api/community")).json()
+        ranged = (await http.get("/api/stats/range", params={"from": "2024-01-01", "to": "2024-01-01"})).json()
+        return exported, imported.json(), habits, posts, ranged
+
+    exported, imported, habits, posts, ranged = run_api(scenario)
+    assert exported.headers["content-type"] == "application/gzip"
+    assert imported == {"imported": {"habits": 1, "community_posts": 1}}
+    assert habits[0]["completions"] == ["2023-12-30", "2024-01-01"]
+    assert habits[0]["total_completions"] == 2
+    assert posts[0]["content"] == "Saved"
+    assert ranged["total_completions"] == 1
+
+
+def test_import_accepts_api_shaped_habits_and_rejects_bad_lines(run_api):
+    body = "\n".join([
+        json.dumps({"collection": "habits", "doc": {"id": "h1", "name": "Plain", "completions": ["2024-03-01"]}}),
+        "",
+    ])
+
+    async def scenario(http, db):
+        ok = await http.post("/api/import", content=body)
+        stored = await db.habits.find_one({"id": "h1"})
+        bad = await http.post("/api/import", content='{"collection": "users", "doc": {}}\n')
+        return ok.json(), stored, bad
+
+    ok, stored, bad = run_api(scenario)
+    assert ok["imported"]["habits"] == 1
+    assert stored["total_completions"] == 1
+    assert "completions" not in stored
+    assert bad.status_code == 400
+    assert "Line 1" in bad.json()["detail"]
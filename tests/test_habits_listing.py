@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+
+def test_cursor_pagination_walks_every_habit_once(run_api):
+    async def scenario(http, db):
+        created = [(await http.post("/api/habits", json={"name": f"P{i}"})).json()["id"] for i in range(7)]
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 3, **({"after": cursor} if cursor else {})}
+            resp = await http.get("/api/habits", params=params)
+            seen += [h["id"] for h in resp.json()]
+            cursor = resp.headers.get("x-next-cursor")
+            if not cursor:
+                break
+        bad = await http.get("/api/habits", params={"after": "not-a-cursor"})
+        return created, seen, bad
+
+    created, seen, bad = run_api(scenario)
+    assert seen == created
+    assert bad.status_code == 400
+
+
+def test_fields_projection_skips_completions(run_api):
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Slim"})).json()
+        await http.post("/api/habits/log", json={"habit_id": habit["id"]})
+        slim = (await http.get("/api/habits", params={"fields": "name,streak"})).json()
+        unknown = await http.get("/api/habits", params={"fields": "name,password"})
+        return slim, unknown
+
+    slim, unknown = run_api(scenario)
+    assert set(slim[0]) == {"id", "created_at", "name", "streak"}
+    assert slim[0]["streak"] == 1
+    assert unknown.status_code == 400
+
+
+def test_completion_days_bounds_history(run_api):
+    today = datetime.now(timezone.utc).date()
+    days = [(today - timedelta(days=o)).isoformat() for o in (800, 40, 3, 0)]
+
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Old"})).json()
+        for day in days:
+            await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": day})
+        recent = (await http.get("/api/habits", params={"completion_days": 31})).json()
+        full = (await http.get("/api/habits")).json()
+        return recent, full
+
+    recent, full = run_api(scenario)
+    assert recent[0]["completions"] == days[2:]
+    assert recent[0]["total_completions"] == 4
+    assert recent[0]["name"] == "Old"
+    assert full[0]["completions"] == days
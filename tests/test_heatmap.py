@@ -0,0 +1,97 @@
+import base64
+from datetime import date, timedelta
+
+from completions import CompletionBitmap
+from heatmap import CalendarCache, encode_bitmap, encode_ranges, habit_calendar, year_words
+
+
+def decode(bitmap, year):
+    data = base64.b64decode(bitmap)
+    return [
+        date(year, 1, 1) + timedelta(days=i)
+        for i in range(len(data) * 8) if data[i // 8] >> (i % 8) & 1
+    ]
+
+
+def test_bitmap_round_trips_a_leap_year():
+    days = [date(2024, 1, 1), date(2024, 2, 29), date(2024, 7, 4), date(2024, 12, 31)]
+    doc = CompletionBitmap.from_days(days + [date(2023, 5, 5)]).to_doc()
+    words = year_words(doc, 2024)
+    bitmap = encode_bitmap(words, 2024)
+    assert len(bitmap) == 64  # 46 bytes
+    assert decode(bitmap, 2024) == days
+    assert decode(encode_bitmap(year_words(doc, 2023), 2023), 2023) == [date(2023, 5, 5)]
+    assert year_words(doc, 2022) == [0] * 12
+
+
+def test_bitmap_drops_bits_past_year_end():
+    words = [0] * 12
+    words[11] = 0xFFFFFFFF  # days 353..384 of 2023, which only has 365
+    assert decode(encode_bitmap(words, 2023), 2023)[-1] == date(2023, 12, 31)
+    assert habit_calendar("h", 2023, words)["count"] == 13
+
+
+def test_ranges_group_consecutive_days():
+    days = [date(2024, 3, d) for d in (1, 2, 3, 5, 31)] + [date(2024, 4, 1), date(2024, 12, 31)]
+    words = year_words(CompletionBitmap.from_days(days).to_doc(), 2024)
+    assert encode_ranges(words, 2024) == [
+        ["2024-03-01", "2024-03-03"], ["2024-03-05", "2024-03-05"],
+        ["2024-03-31", "2024-04-01"], ["2024-12-31", "2024-12-31"],
+    ]
+    assert habit_calendar("h", 2024, words, "ranges") == {
+        "habit_id": "h", "count": 7, "ranges": encode_ranges(words, 2024),
+    }
+    assert encode_ranges([0] * 12, 2024) == []
+
+
+def test_calendar_cache_invalidates_per_year():
+    cache = CalendarCache(max_habits=2)
+    cache.put("u", "a", 2023, [1] * 12)
+    cache.put("u", "a", 2024, [2] * 12)
+    cache.invalidate("u", "a", 2024)
+    assert cache.get("u", "a", 2023) == [1] * 12
+    assert cache.get("u", "a", 2024) is None
+    assert cache.get("other", "a", 2023) is None
+
+    cache.put("u", "b", 2024, [0] * 12)
+    cache.put("u", "c", 2024, [0] * 12)  # evicts habit "a"
+    assert cache.get("u", "a", 2023) is None
+    cache.invalidate("u", "b")
+    assert cache.get("u", "b", 2024) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_calendar_cache_expires():
+    cache = CalendarCache(ttl=-1)
+    cache.put("u", "a", 2024, [0] * 12)
+    assert cache.get("u", "a", 2024) is None
+
+
+def test_calendar_endpoints(run_api):
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Read"})).json()
+        other = (await http.post("/api/habits", json={"name": "Run"})).json()
+        for day in ("2024-01-01", "2024-01-02", "2023-06-01"):
+            await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": day})
+        first = (await http.get(f"/api/habits/{habit['id']}/calendar", params={"year": 2024})).json()
+        # Logging drops the cached year, so the next read sees it
+        await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": "2024-01-03"})
+        ranges = (await http.get(
+            f"/api/habits/{habit['id']}/calendar", params={"year": 2024, "format": "ranges"}
+        )).json()
+        batch = (await http.get("/api/habits/calendar", params={"year": 2024})).json()
+        some = (await http.get(
+            "/api/habits/calendar", params={"year": 2023, "ids": f"{habit['id']},missing"}
+        )).json()
+        missing = await http.get("/api/habits/nope/calendar")
+        bad_format = await http.get(f"/api/habits/{habit['id']}/calendar", params={"format": "csv"})
+        return habit, other, first, ranges, batch, some, missing, bad_format
+
+    habit, other, first, ranges, batch, some, missing, bad_format = run_api(scenario)
+    assert first["days"] == 366 and first["count"] == 2
+    assert decode(first["bitmap"], 2024) == [date(2024, 1, 1), date(2024, 1, 2)]
+    assert ranges["ranges"] == [["2024-01-01", "2024-01-03"]]
+    assert [(h["habit_id"], h["count"]) for h in batch["habits"]] == [(habit["id"], 3), (other["id"], 0)]
+    assert [(h["habit_id"], h["count"]) for h in some["habits"]] == [(habit["id"], 1)]
+    assert missing.status_code == 404
+    assert bad_format.status_code == 422
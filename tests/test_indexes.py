@@ -0,0 +1,37 @@
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from indexes import ROUTE_QUERIES, check_query_plans, ensure_indexes, plan_stages
+
+
+def test_plan_stages_walks_nested_plans():
+    plan = {"stage": "FETCH", "inputStage": {"stage": "OR", "inputStages": [
+        {"stage": "IXSCAN"}, {"stage": "COLLSCAN"},
+    ]}}
+    assert plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+
+
+def test_every_route_query_uses_an_index(run_api):
+    async def scenario(http, db):
+        await ensure_indexes(db)
+        # Some data so the planner has real choices to make
+        for i in range(50):
+            await http.post("/api/habits", json={"name": f"I{i}"})
+            await http.post("/api/community", json={"content": f"post {i}"})
+        return await check_query_plans(db)
+
+    plans = run_api(scenario)
+    assert set(plans) == set(ROUTE_QUERIES)
+    for label, stages in plans.items():
+        assert any("IXSCAN" in stage for stage in stages), (label, stages)
+        assert "COLLSCAN" not in stages, (label, stages)
+
+
+def test_unique_id_indexes_reject_duplicates(run_api):
+    async def scenario(http, db):
+        await ensure_indexes(db)
+        await db.community_posts.insert_one({"id": "same"})
+        with pytest.raises(DuplicateKeyError):
+            await db.community_posts.insert_one({"id": "same"})
+
+    run_api(scenario)
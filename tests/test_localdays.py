@@ -0,0 +1,70 @@
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from localdays import DayClock, local_midnight, local_today, resolve_timezone
+from streaks import calculate_streak
+
+LOS_ANGELES = ZoneInfo("America/Los_Angeles")
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_resolve_timezone():
+    assert resolve_timezone(None) is resolve_timezone("UTC") is timezone.utc
+    assert resolve_timezone("America/Los_Angeles") == LOS_ANGELES
+    assert resolve_timezone("Mars/Olympus_Mons") is None
+    assert resolve_timezone("../../etc/passwd") is None
+
+
+def test_evening_logs_belong_to_the_local_day():
+    # 21:00 PDT on May 9th is already May 10th in UTC
+    assert local_today("America/Los_Angeles", utc(2024, 5, 10, 4)) == date(2024, 5, 9)
+    assert local_today("UTC", utc(2024, 5, 10, 4)) == date(2024, 5, 10)
+    assert local_today("Asia/Kolkata", utc(2024, 5, 9, 18, 30)) == date(2024, 5, 10)
+    assert local_today("Nowhere/Unknown", utc(2024, 5, 10, 4)) == date(2024, 5, 10)
+
+
+def test_day_clock_follows_dst_transitions():
+    clock = DayClock()
+    # 2024-03-10 springs forward: a 23-hour day from 08:00 to 07:00 UTC
+    assert local_midnight(date(2024, 3, 10), LOS_ANGELES) == utc(2024, 3, 10, 8)
+    assert local_midnight(date(2024, 3, 11), LOS_ANGELES) == utc(2024, 3, 11, 7)
+    assert clock.today(LOS_ANGELES, utc(2024, 3, 10, 8)) == date(2024, 3, 10)
+    assert clock.today(LOS_ANGELES, utc(2024, 3, 11, 6, 59)) == date(2024, 3, 10)  # cached
+    assert clock.today(LOS_ANGELES, utc(2024, 3, 11, 7)) == date(2024, 3, 11)
+    # 2024-11-03 falls back: a 25-hour day from 07:00 to 08:00 UTC
+    assert clock.today(LOS_ANGELES, utc(2024, 11, 3, 7)) == date(2024, 11, 3)
+    assert clock.today(LOS_ANGELES, utc(2024, 11, 4, 7, 30)) == date(2024, 11, 3)
+    assert clock.today(LOS_ANGELES, utc(2024, 11, 4, 8)) == date(2024, 11, 4)
+
+
+def test_day_clock_handles_transitions_at_midnight():
+    clock = DayClock()
+    havana = ZoneInfo("America/Havana")
+    # Havana skips from 00:00 to 01:00 on 2024-03-10, so that day starts at 01:00 CDT
+    assert clock.today(havana, utc(2024, 3, 10, 4, 59)) == date(2024, 3, 9)
+    assert clock.today(havana, utc(2024, 3, 10, 5)) == date(2024, 3, 10)
+    # Samoa skipped 2011-12-30 entirely
+    apia = ZoneInfo("Pacific/Apia")
+    assert clock.today(apia, utc(2011, 12, 30, 9, 59)) == date(2011, 12, 29)
+    assert clock.today(apia, utc(2011, 12, 30, 10)) == date(2011, 12, 31)
+
+
+def test_day_clock_agrees_with_zoneinfo_hour_by_hour():
+    clock = DayClock()
+    start = utc(2024, 3, 8)
+    for hour in range(24 * 60):  # through both 2024 DST transitions in several zones
+        now = start + timedelta(hours=hour * 5.5)
+        for name in ("America/Los_Angeles", "America/New_York", "Europe/London", "Australia/Lord_Howe"):
+            tz = ZoneInfo(name)
+            assert clock.today(tz, now) == now.astimezone(tz).date(), (name, now)
+
+
+def test_streak_counts_up_to_the_local_day():
+    completions = ["2024-03-09", "2024-03-10"]
+    # 05:00 UTC on 2024-03-11 is still March 10th in Los Angeles
+    today = local_today("America/Los_Angeles", utc(2024, 3, 11, 5))
+    assert calculate_streak(completions, today) == 2
+    assert calculate_streak(completions, date(2024, 3, 12)) == 0
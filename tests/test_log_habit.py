@@ -0,0 +1,73 @@
+import asyncio
+from datetime import date, timedelta
+
+from completions import CompletionBitmap
+
+
+def test_parallel_logs_are_not_lost(run_api):
+    start = date(2020, 1, 1)
+    days = [(start + timedelta(days=i)).isoformat() for i in range(300)]
+
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Stress"})).json()
+        responses = await asyncio.gather(*[
+            http.post("/api/habits/log", json={"habit_id": habit["id"], "date": d}) for d in days
+        ])
+        assert all(r.status_code == 200 for r in responses)
+        return await db.habits.find_one({"id": habit["id"]}, {"_id": 0})
+
+    stored = run_api(scenario)
+    assert CompletionBitmap.from_doc(stored["completion_bits"]).isoformat() == days
+    assert stored["total_completions"] == len(days)
+    assert stored["last_completed"] == days[-1]
+
+
+def test_parallel_log_and_unlog_converge(run_api):
+    days = [(date(2021, 6, 1) + timedelta(days=i)).isoformat() for i in range(200)]
+
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Toggle"})).json()
+        await asyncio.gather(*[
+            http.post("/api/habits/log", json={"habit_id": habit["id"], "date": d}) for d in days
+        ])
+        await asyncio.gather(*[
+            http.post("/api/habits/log", json={"habit_id": habit["id"], "date": d, "completed": False})
+            for d in days[::2]
+        ])
+        return await db.habits.find_one({"id": habit["id"]}, {"_id": 0})
+
+    stored = run_api(scenario)
+    assert CompletionBitmap.from_doc(stored["completion_bits"]).isoformat() == days[1::2]
+    assert stored["total_completions"] == len(days) // 2
+
+
+def test_log_today_recomputes_streak(run_api):
+    from datetime import datetime, timezone
+    today = datetime.now(timezone.utc).date()
+
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Streak"})).json()
+        for offset in (3, 1, 0):
+            resp = await http.post("/api/habits/log", json={
+                "habit_id": habit["id"], "date": (today - timedelta(days=offset)).isoformat()
+            })
+        return resp.json()
+
+    logged = run_api(scenario)
+    assert logged["streak"] == 3
+    assert logged["last_completed"] == today.isoformat()
+
+
+def test_log_missing_habit_returns_404(run_api):
+    async def scenario(http, db):
+        return await http.post("/api/habits/log", json={"habit_id": "nope"})
+
+    assert run_api(scenario).status_code == 404
+
+
+def test_log_invalid_date_returns_400(run_api):
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Read"})).json()
+        return await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": "2024-13-45"})
+
+    assert run_api(scenario).status_code == 400
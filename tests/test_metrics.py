@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+import metrics
+from coach import LlmGuard
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    latency = registry.histogram("demo_seconds", "Demo.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value, route='/a"b')
+    registry.counter("demo_total", "Demo.").inc(2)
+    registry.gauge("demo_open", "Demo.", lambda: 7)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE demo_seconds histogram" in lines
+    assert 'demo_seconds_bucket{route="/a\\"b",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{route="/a\\"b",le="1.0"} 3' in lines
+    assert 'demo_seconds_bucket{route="/a\\"b",le="+Inf"} 4' in lines
+    assert 'demo_seconds_sum{route="/a\\"b"} 4.25' in lines
+    assert 'demo_seconds_count{route="/a\\"b"} 4' in lines
+    assert "demo_total 2" in lines and "demo_open 7" in lines
+
+
+def test_command_timer_charges_the_current_request():
+    timer = metrics.MongoCommandTimer()
+    timings = metrics.RequestTimings()
+    token = metrics._timings.set(timings)
+    try:
+        timer.succeeded(SimpleNamespace(command_name="find", duration_micros=2000))
+        timer.failed(SimpleNamespace(command_name="update", duration_micros=1000))
+    finally:
+        metrics._timings.reset(token)
+    timer.succeeded(SimpleNamespace(command_name="find", duration_micros=5000))  # outside any request
+
+    assert timings.db_commands == 2
+    assert abs(timings.db - 0.003) < 1e-9
+    assert 'mongodb_command_failures_total{command="update"}' in metrics.registry.render()
+
+
+def test_guard_reports_call_durations():
+    seen = []
+
+    async def main():
+        guard = LlmGuard(observer=lambda mode, seconds: seen.append(mode))
+
+        async def tokens():
+            yield "hi"
+
+        await guard.call(lambda: asyncio.sleep(0, result="ok"))
+        assert [t async for t in guard.stream(tokens())] == ["hi"]
+
+    asyncio.run(main())
+    assert seen == ["send", "stream"]
+
+
+def test_middleware_times_routes_and_emits_server_timing():
+    class Item(BaseModel):
+        id: int
+
+    app = FastAPI()
+    router = APIRouter(route_class=metrics.TimedRoute)
+
+    @router.get("/items/{group}", response_model=List[Item])
+    async def items(group: str):
+        metrics.MongoCommandTimer().succeeded(SimpleNamespace(command_name="find", duration_micros=1500))
+        return [{"id": i} for i in range(3)]
+
+    app.include_router(router)
+    app.add_middleware(metrics.MetricsMiddleware, server_timing=True)
+
+    with TestClient(app) as client:
+        timed = client.get("/items/a", headers={"X-Server-Timing": "1"})
+        plain = client.get("/items/b")
+        client.get("/nowhere")
+
+    assert timed.json() == [{"id": 0}, {"id": 1}, {"id": 2}]
+    names = [part.split(";")[0].strip() for part in timed.headers["Server-Timing"].split(",")]
+    assert names == ["db", "app", "render", "total"]
+    assert 'desc="1 round trips"' in timed.headers["Server-Timing"]
+    assert "Server-Timing" not in plain.headers
+
+    text = metrics.registry.render()
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{group}",status="200"} 2' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}' in text
+    assert 'http_response_render_seconds_count{route="/items/{group}"}' in text
+    assert 'http_request_mongodb_commands_bucket{route="/items/{group}",le="1"} 2' in text
+
+
+def test_metrics_endpoint(run_api):
+    async def scenario(http, db):
+        await http.get("/api/habits")
+        return await http.get("/api/metrics")
+
+    resp = run_api(scenario)
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert 'route="/api/habits"' in resp.text
+    assert "websocket_subscribers 0" in resp.text
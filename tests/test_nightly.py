@@ -0,0 +1,148 @@
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from completions import completion_fields
+from nightly import JobLock, next_run, nightly_maintenance, run_daily, run_once, streak_decay_update
+from streaks import StreakState
+
+
+def test_next_run_follows_the_local_clock_across_dst():
+    new_york = ZoneInfo("America/New_York")
+    at = time(3, 0)
+    # 06:00 UTC on 2024-03-09 is 01:00 EST; the run is 03:00 EST the same day
+    assert next_run(at, new_york, datetime(2024, 3, 9, 6, tzinfo=timezone.utc)) == \
+        datetime(2024, 3, 9, 3, tzinfo=new_york)
+    # After it, the next run is 03:00 EDT on the day clocks spring forward: 07:00 UTC
+    following = next_run(at, new_york, datetime(2024, 3, 9, 9, tzinfo=timezone.utc))
+    assert following.astimezone(timezone.utc) == datetime(2024, 3, 10, 7, tzinfo=timezone.utc)
+    assert next_run(at, timezone.utc, datetime(2024, 3, 9, 3, tzinfo=timezone.utc)) == \
+        datetime(2024, 3, 10, 3, tzinfo=timezone.utc)
+
+
+def test_nightly_maintenance_fixes_expired_streaks():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    logged_on = date(2024, 5, 8)
+
+    def habit(habit_id, days, **overrides):
+        return {"user_id": "u", "id": habit_id, **completion_fields(days, logged_on), **overrides}
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["nightly"]
+        await db.habits.insert_many([
+            habit("expired", ["2024-05-07", "2024-05-08"]),
+            habit("current", ["2024-05-08", "2024-05-09"], streak=1),
+            habit("future", ["2024-05-10"], streak=0),
+            habit("stale", ["2024-05-01", "2024-05-02"],
+                  streak_state={"start": "2024-05-02", "end": "2024-05-02", "length": 1, "best_before": 0, "stale": True}),
+            habit("empty", []),
+        ])
+        result = await nightly_maintenance(db, datetime(2024, 5, 10, 12, tzinfo=timezone.utc))
+        streaks = {h["id"]: h["streak"] async for h in db.habits.find({})}
+        stale = await db.habits.find_one({"id": "stale"})
+        return result, streaks, stale
+
+    result, streaks, stale = asyncio.run(scenario())
+    assert streaks == {"expired": 0, "current": 2, "future": 1, "stale": 0, "empty": 0}
+    assert result["streaks_updated"] == 3 and result["stale_rescanned"] == 1
+    assert StreakState.from_doc(stale["streak_state"]).length == 2
+    assert result["rollups"] == 4  # distinct (user, day) pairs in the last week
+
+
+def test_streaks_decay_on_each_habits_local_day():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    # 03:00 UTC on May 10th is still the evening of May 9th in Los Angeles
+    now = datetime(2024, 5, 10, 3, tzinfo=timezone.utc)
+
+    def habit(habit_id, **overrides):
+        return {"user_id": "u", "id": habit_id, **completion_fields(["2024-05-08"], date(2024, 5, 8)), **overrides}
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["nightly"]
+        await db.habits.insert_many([
+            habit("pacific", timezone="America/Los_Angeles"),
+            habit("utc", timezone="UTC"),
+            habit("legacy"),  # logged before timezones were recorded
+            habit("tokyo", timezone="Asia/Tokyo"),
+        ])
+        result = await nightly_maintenance(db, now)
+        return result, {h["id"]: h["streak"] async for h in db.habits.find({})}
+
+    result, streaks = asyncio.run(scenario())
+    assert streaks == {"pacific": 1, "utc": 0, "legacy": 0, "tokyo": 0}
+    assert result["streaks_updated"] == 3
+
+
+def test_streak_decay_branches_per_local_day():
+    query, pipeline = streak_decay_update({
+        date(2024, 5, 10): ["UTC", "Europe/London"],
+        date(2024, 5, 9): ["America/Los_Angeles"],
+    })
+    branches = pipeline[0]["$set"]["streak"]["$switch"]["branches"]
+    assert [branch["case"]["$in"][1] for branch in branches] == [
+        ["America/Los_Angeles"], ["Europe/London", "UTC", None],
+    ]
+    assert len(query["$or"]) == 4
+
+
+def test_job_runs_once_per_day_across_workers():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["nightly"]
+        first, second = JobLock(db, "nightly", owner="a"), JobLock(db, "nightly", owner="b")
+        assert await first.acquire("2024-05-10")
+        assert not await second.acquire("2024-05-10")  # still running
+        await first.release("2024-05-10", completed=True)
+        assert not await second.acquire("2024-05-10")  # already done today
+        assert await second.acquire("2024-05-11")
+        await second.release("2024-05-11", completed=False)
+        assert await first.acquire("2024-05-11")  # a failed run can be retried
+
+        runs = []
+
+        async def job():
+            runs.append(1)
+            return {}
+
+        lock = JobLock(db, "other", owner="a")
+        results = [await run_once(job, lock, timezone.utc) for _ in range(2)]
+        return runs, results
+
+    runs, results = asyncio.run(scenario())
+    assert runs == [1] and results == [{}, None]
+
+
+def test_job_is_retried_the_same_day_after_its_holder_fails():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["nightly"]
+        today = datetime.now(timezone.utc).date().isoformat()
+        # Worker "a" takes the lease and dies mid-run
+        assert await JobLock(db, "nightly", lease=0.05, owner="a").acquire(today)
+
+        lock = JobLock(db, "nightly", lease=0.05, owner="b")
+        attempts = []
+        finished = asyncio.Event()
+
+        async def job():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("database unavailable")
+            finished.set()
+            return {}
+
+        # Next due tomorrow, so only the retries can run it today
+        at = (datetime.now(timezone.utc) - timedelta(minutes=1)).time()
+        worker = asyncio.create_task(run_daily(job, lock, at, timezone.utc, retry=0.01))
+        try:
+            await asyncio.wait_for(finished.wait(), 5)
+        finally:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+        return len(attempts), await lock.done(today)
+
+    assert asyncio.run(scenario()) == (2, True)
@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from response_cache import ResponseCache, ResponseCacheMiddleware
+
+
+def make_app(ttl=30.0, max_entries=16):
+    app = FastAPI()
+    cache = ResponseCache(routes={"/items": ("items",)}, ttl=ttl, max_entries=max_entries)
+    app.add_middleware(ResponseCacheMiddleware, cache=cache)
+    state = {"items": ["a"], "reads": 0}
+
+    @app.get("/items")
+    async def items(page: int = 0):
+        state["reads"] += 1
+        return state["items"]
+
+    @app.post("/items")
+    async def add(item: str):
+        state["items"].append(item)
+        cache.invalidate("items")
+        return state["items"]
+
+    return app, cache, state
+
+
+def run(app, scenario):
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await scenario(http)
+    return asyncio.run(main())
+
+
+def test_hits_until_a_write_invalidates():
+    app, cache, state = make_app()
+
+    async def scenario(http):
+        first = await http.get("/items")
+        second = await http.get("/items")
+        await http.post("/items", params={"item": "b"})
+        third = await http.get("/items")
+        return first, second, third
+
+    first, second, third = run(app, scenario)
+    assert first.json() == second.json() == ["a"]
+    assert third.json() == ["a", "b"]
+    assert state["reads"] == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert first.headers["etag"] == second.headers["etag"] != third.headers["etag"]
+
+
+def test_if_none_match_returns_304():
+    app, cache, state = make_app()
+
+    async def scenario(http):
+        etag = (await http.get("/items")).headers["etag"]
+        cached = await http.get("/items", headers={"If-None-Match": etag})
+        await http.post("/items", params={"item": "c"})
+        changed = await http.get("/items", headers={"If-None-Match": etag})
+        return cached, changed
+
+    cached, changed = run(app, scenario)
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert changed.status_code == 200
+    assert cache.stats()["not_modified"] == 1
+
+
+def test_ttl_and_lru_bound_the_cache():
+    app, cache, state = make_app(ttl=0.0, max_entries=2)
+
+    async def scenario(http):
+        for page in range(4):
+            await http.get("/items", params={"page": page})
+        await http.get("/items", params={"page": 3})
+
+    run(app, scenario)
+    assert state["reads"] == 5
+    assert cache.stats()["entries"] <= 2
+
+
+def test_requests_without_a_day_bypass_the_cache():
+    app = FastAPI()
+    cache = ResponseCache(routes={"/today": ()}, day=lambda request: request.headers.get("x-day"))
+    app.add_middleware(ResponseCacheMiddleware, cache=cache)
+    reads = []
+
+    @app.get("/today")
+    async def today():
+        reads.append(1)
+        return len(reads)
+
+    async def scenario(http):
+        await http.get("/today", headers={"X-Day": "2024-05-10"})
+        cached = await http.get("/today", headers={"X-Day": "2024-05-10"})
+        uncached = await http.get("/today")
+        return cached, uncached
+
+    cached, uncached = run(app, scenario)
+    assert cached.json() == 1 and uncached.json() == 2
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,143 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from completions import completion_fields
+from rollups import rebuild_rollups, replace_rollups, rollup_removal, rollup_update
+
+
+def test_rollup_updates_are_idempotent():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["rollups"]
+        for habit_id, completed in [("a", True), ("a", True), ("b", True), ("a", False), ("c", False)]:
+            await db.daily_rollups.update_one(*rollup_update("u1", [habit_id], "2024-05-01", completed), upsert=True)
+        await db.daily_rollups.update_one(*rollup_update("u1", ["a"], "2024-05-02", True), upsert=True)
+        await db.daily_rollups.update_one(*rollup_update("u2", ["a"], "2024-05-01", True), upsert=True)
+        await db.daily_rollups.update_many(*rollup_removal("u1", "a"))
+        return await db.daily_rollups.find({}, {"_id": 0}).sort([("user_id", 1), ("date", 1)]).to_list(None)
+
+    assert asyncio.run(scenario()) == [
+        {"user_id": "u1", "date": "2024-05-01", "habit_ids": ["b"], "total": 1},
+        {"user_id": "u1", "date": "2024-05-02", "habit_ids": [], "total": 0},
+        {"user_id": "u2", "date": "2024-05-01", "habit_ids": ["a"], "total": 1},
+    ]
+
+
+def test_rebuild_matches_habit_bitmaps():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    today = date(2024, 5, 3)
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["rollups"]
+        await db.habits.insert_many([
+            {"user_id": "u1", "id": "a", **completion_fields(["2024-05-01", "2024-05-02"], today)},
+            {"user_id": "u1", "id": "b", **completion_fields(["2024-05-02"], today)},
+            {"user_id": "u2", "id": "a", **completion_fields(["2024-05-02"], today)},
+        ])
+        await db.daily_rollups.insert_one({"user_id": "u1", "date": "1999-01-01", "habit_ids": ["gone"], "total": 1})
+        rebuilt = await rebuild_rollups(db)
+        rollups = await db.daily_rollups.find({}, {"_id": 0}).sort([("user_id", 1), ("date", 1)]).to_list(None)
+        return rebuilt, rollups
+
+    rebuilt, rollups = asyncio.run(scenario())
+    assert rebuilt == 3
+    assert [(r["user_id"], r["date"], sorted(r["habit_ids"]), r["total"]) for r in rollups] == [
+        ("u1", "2024-05-01", ["a"], 1),
+        ("u1", "2024-05-02", ["a", "b"], 2),
+        ("u2", "2024-05-02", ["a"], 1),
+    ]
+
+
+def test_user_rebuild_fixes_drift_in_place():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    today = date(2024, 5, 3)
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["rollups"]
+        await db.habits.insert_many([
+            {"user_id": "u1", "id": "a", **completion_fields(["2023-12-31", "2024-05-01", "2024-05-02"], today)},
+            {"user_id": "u1", "id": "b", **completion_fields(["2024-05-02"], today)},
+            {"user_id": "u2", "id": "a", **completion_fields(["2024-05-02"], today)},
+        ])
+        await db.daily_rollups.insert_many([
+            {"user_id": "u1", "date": "2024-04-30", "habit_ids": ["a"], "total": 1},  # no longer done
+            {"user_id": "u1", "date": "2024-05-01", "habit_ids": ["a"], "total": 1},  # correct
+            {"user_id": "u1", "date": "2024-05-02", "habit_ids": ["b"], "total": 1},  # missing "a"
+            {"user_id": "u2", "date": "2024-04-30", "habit_ids": ["x"], "total": 1},  # other user: untouched
+        ])
+        untouched = await db.daily_rollups.find_one({"user_id": "u1", "date": "2024-05-01"})
+        rebuilt = await rebuild_rollups(db, "u1", batch_size=1)
+        rollups = await db.daily_rollups.find({}).sort([("user_id", 1), ("date", 1)]).to_list(None)
+        return untouched, rebuilt, rollups
+
+    untouched, rebuilt, rollups = asyncio.run(scenario())
+    assert rebuilt == 3
+    assert [(r["user_id"], r["date"], sorted(r["habit_ids"]), r["total"]) for r in rollups] == [
+        ("u1", "2023-12-31", ["a"], 1),
+        ("u1", "2024-05-01", ["a"], 1),
+        ("u1", "2024-05-02", ["a", "b"], 2),
+        ("u2", "2024-04-30", ["x"], 1),
+    ]
+    assert rollups[1]["_id"] == untouched["_id"]
+
+
+def test_rebuild_since_only_checks_recent_days():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    today = date(2024, 5, 3)
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["rollups"]
+        days = ["2023-12-31", "2024-05-01", "2024-05-02", "2025-01-03"]
+        await db.habits.insert_one({"user_id": "u1", "id": "a", **completion_fields(days, today)})
+        await db.daily_rollups.insert_many([
+            {"user_id": "u1", "date": "2024-04-30", "habit_ids": ["a"], "total": 1},  # wrong, but before `since`
+            {"user_id": "u1", "date": "2024-05-03", "habit_ids": ["a"], "total": 1},  # no longer done
+        ])
+        rebuilt = await rebuild_rollups(db, since=date(2024, 5, 2))
+        return rebuilt, [r["date"] async for r in db.daily_rollups.find({}).sort("date", 1)]
+
+    rebuilt, dates = asyncio.run(scenario())
+    assert rebuilt == 2
+    assert dates == ["2024-04-30", "2024-05-02", "2025-01-03"]
+
+
+def test_replaced_habits_move_their_rollups():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    today = date(2024, 5, 3)
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["rollups"]
+        for habit_id, day in [("a", "2024-05-01"), ("b", "2024-05-01"), ("a", "2024-05-02")]:
+            await db.daily_rollups.update_one(*rollup_update("u1", [habit_id], day, True), upsert=True)
+        await replace_rollups(db, "u1", [
+            {"id": "a", **completion_fields(["2024-05-02", "2024-05-03"], today)},
+            {"id": "c", **completion_fields(["2024-05-03"], today)},
+        ], batch_size=1)
+        return await db.daily_rollups.find({}, {"_id": 0}).sort("date", 1).to_list(None)
+
+    assert [(r["date"], sorted(r["habit_ids"]), r["total"]) for r in asyncio.run(scenario())] == [
+        ("2024-05-01", ["b"], 1),
+        ("2024-05-02", ["a"], 1),
+        ("2024-05-03", ["a", "c"], 2),
+    ]
+
+
+def test_stats_range_served_from_rollups(run_api):
+    async def scenario(http, db):
+        first = (await http.post("/api/habits", json={"name": "One"})).json()
+        second = (await http.post("/api/habits", json={"name": "Two"})).json()
+        for habit, day in [(first, "2024-02-28"), (first, "2024-03-01"), (second, "2024-03-01")]:
+            await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": day})
+        await http.post("/api/habits/log", json={"habit_id": first["id"], "date": "2024-02-28", "completed": False})
+        await http.delete(f"/api/habits/{second['id']}")
+        ranged = (await http.get("/api/stats/range", params={"from": "2024-02-27", "to": "2024-03-01"})).json()
+        bad = await http.get("/api/stats/range", params={"from": "2024-03-02", "to": "2024-03-01"})
+        return ranged, bad
+
+    ranged, bad = run_api(scenario)
+    assert [d["completions"] for d in ranged["days"]] == [0, 0, 0, 1]
+    assert ranged["total_completions"] == 1
+    assert bad.status_code == 400
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from completions import completion_fields, stats_pipeline
+
+
+def test_stats_pipeline_counts_each_window_day():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    today = date(2025, 1, 2)
+    window = [today - timedelta(days=6 - i) for i in range(7)]
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["stats"]
+        await db.habits.insert_many([
+            {"id": "a", **completion_fields(["2024-12-27", "2024-12-31", "2025-01-01", "2025-01-02"], today)},
+            {"id": "b", **completion_fields(["2024-06-01", "2025-01-02"], today)},
+            {"id": "c", **completion_fields([], today)},
+        ])
+        return await db.habits.aggregate(stats_pipeline(window)).to_list(1)
+
+    [totals] = asyncio.run(scenario())
+    assert totals["total_habits"] == 3
+    assert totals["total_completions"] == 6
+    assert totals["max_streak"] == 3
+    assert [totals[f"day_{i}"] for i in range(7)] == [1, 0, 0, 0, 1, 1, 2]
+
+
+def test_stats_pipeline_counts_streaks_as_of_the_window_end():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    logged_on = date(2025, 1, 2)
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["stats"]
+        await db.habits.insert_many([
+            {"id": "a", **completion_fields(["2025-01-01", "2025-01-02"], logged_on)},
+            {"id": "b", **completion_fields(["2025-01-01"], logged_on)},
+        ])
+        windows = {end: [end - timedelta(days=1), end] for end in (logged_on, date(2025, 1, 3), date(2025, 1, 4))}
+        return {end: (await db.habits.aggregate(stats_pipeline(window)).to_list(1))[0] for end, window in windows.items()}
+
+    totals = asyncio.run(scenario())
+    # The stored streaks were computed on Jan 2nd; a later local day sees them lapse
+    assert [(t["total_streak"], t["max_streak"]) for t in totals.values()] == [(3, 2), (2, 2), (0, 0)]
+
+
+def test_stats_endpoint_window(run_api):
+    today = datetime.now(timezone.utc).date()
+
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Window"})).json()
+        for offset in (0, 1, 20):
+            await http.post("/api/habits/log", json={
+                "habit_id": habit["id"], "date": (today - timedelta(days=offset)).isoformat()
+            })
+        week = (await http.get("/api/stats")).json()
+        month = (await http.get("/api/stats", params={"days": 30})).json()
+        empty_window = await http.get("/api/stats", params={"days": 0})
+        return week, month, empty_window
+
+    week, month, empty_window = run_api(scenario)
+    assert len(week["weekly_data"]) == 7
+    assert sum(d["completions"] for d in week["weekly_data"]) == 2
+    assert week["weekly_data"][-1]["date"] == today.isoformat()
+    assert sum(d["completions"] for d in month["weekly_data"]) == 3
+    assert week["total_completions"] == 3
+    assert empty_window.status_code == 422
+
+
+def test_stats_and_logs_use_the_request_timezone(run_api):
+    from localdays import local_today
+    pacific = {"X-Timezone": "America/Los_Angeles"}
+    today = local_today("America/Los_Angeles")
+
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Local"}, headers=pacific)).json()
+        logged = (await http.post("/api/habits/log", json={"habit_id": habit["id"]}, headers=pacific)).json()
+        week = (await http.get("/api/stats", headers=pacific)).json()
+        stored = await db.habits.find_one({"id": habit["id"]})
+        await http.get("/api/stats")  # a warm UTC entry must not answer for an unknown zone
+        unknown = await http.get("/api/stats", headers={"X-Timezone": "Mars/Olympus_Mons"})
+        return logged, week, stored, unknown
+
+    logged, week, stored, unknown = run_api(scenario)
+    assert logged["date"] == today.isoformat() and logged["completed_today"]
+    assert week["weekly_data"][-1] == {"day": today.strftime("%a"), "date": today.isoformat(), "completions": 1}
+    assert week["total_streak"] == 1
+    assert stored["timezone"] == "America/Los_Angeles"
+    assert unknown.status_code == 400
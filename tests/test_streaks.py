@@ -0,0 +1,79 @@
+import random
+from datetime import date, datetime, timedelta, timezone
+
+from hypothesis import given, settings, strategies as st
+
+from completions import CompletionBitmap
+from streaks import StreakState, calculate_streak
+
+
+def brute_force_longest(completions):
+    days = sorted({date.fromisoformat(c) for c in completions})
+    best = run = 0
+    for i, day in enumerate(days):
+        run = run + 1 if i and (day - days[i - 1]).days <= 2 else 1
+        best = max(best, run)
+    return best
+
+
+ops = st.lists(st.tuples(st.integers(min_value=-60, max_value=2), st.booleans()), max_size=80)
+
+
+@settings(max_examples=300)
+@given(ops)
+def test_incremental_state_matches_calculate_streak(edits):
+    today = datetime.now(timezone.utc).date()
+    days = CompletionBitmap()
+    state = StreakState()
+    for offset, completed in edits:
+        day = today + timedelta(days=offset)
+        if completed == (day in days):
+            continue
+        if completed:
+            days.add(day)
+        else:
+            days.discard(day)
+        state = state.log(day, completed, days)
+
+        completions = days.isoformat()
+        assert state.current(today) == calculate_streak(completions)
+        assert state.longest == brute_force_longest(completions)
+        assert state == StreakState.from_days(days)
+
+
+@given(st.sets(st.integers(min_value=-400, max_value=0), max_size=120))
+def test_rescan_matches_calculate_streak(offsets):
+    today = datetime.now(timezone.utc).date()
+    completions = [(today + timedelta(days=o)).isoformat() for o in offsets]
+    assert StreakState.from_completions(completions).current(today) == calculate_streak(completions)
+
+
+def test_state_round_trips_through_doc():
+    state = StreakState(date(2024, 1, 1), date(2024, 1, 9), 6, 11)
+    assert StreakState.from_doc(state.to_doc()) == state
+    assert StreakState.from_doc(None) is None
+
+
+def test_api_streak_matches_calculate_streak(run_api):
+    today = datetime.now(timezone.utc).date()
+    rng = random.Random(7)
+    edits = [(rng.randint(-30, 0), rng.random() < 0.7) for _ in range(150)]
+
+    async def scenario(http, db):
+        habit = (await http.post("/api/habits", json={"name": "Property"})).json()
+        completions = set()
+        for offset, completed in edits:
+            day = (today + timedelta(days=offset)).isoformat()
+            logged = (await http.post("/api/habits/log", json={
+                "habit_id": habit["id"], "date": day, "completed": completed
+            })).json()
+            if completed:
+                completions.add(day)
+            else:
+                completions.discard(day)
+            assert logged["total_completions"] == len(completions)
+            assert logged["completed_today"] == (today.isoformat() in completions)
+            assert logged["streak"] == calculate_streak(sorted(completions))
+            assert logged["longest_streak"] == brute_force_longest(completions)
+
+    run_api(scenario)
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from events import EventHub
+from tenancy import DEFAULT_USER, migrate_tenancy, normalize_user_id
+
+
+def test_normalize_user_id():
+    assert normalize_user_id(None) == DEFAULT_USER
+    assert normalize_user_id("") == DEFAULT_USER
+    assert normalize_user_id("ana.lopez@example.com") == "ana.lopez@example.com"
+    assert normalize_user_id("a" * 65) is None
+    assert normalize_user_id("bob; drop") is None
+    assert normalize_user_id("$where") is None
+
+
+def test_hub_scopes_events_to_their_user():
+    async def main():
+        hub = EventHub()
+        with hub.subscribe("ana") as ana, hub.subscribe("bob") as bob:
+            hub.publish({"type": "habit.deleted", "id": "h1"}, "ana")
+            hub.publish({"type": "post.liked", "id": "p", "likes": 1})
+            return [e["type"] for e in (ana.get_nowait(), ana.get_nowait())], bob.qsize()
+
+    assert asyncio.run(main()) == (["habit.deleted", "post.liked"], 1)
+
+
+def test_migrate_tenancy_assigns_default_owner():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()["tenancy"]
+        await db.habits.insert_many([{"id": "a"}, {"id": "b", "user_id": "ana"}])
+        await db.habits.create_index("id", unique=True)
+        await db.chat_messages.insert_one({"id": "m", "session_id": "s"})
+        migrated = await migrate_tenancy(db)
+        again = await migrate_tenancy(db)
+        owners = {h["id"]: h["user_id"] async for h in db.habits.find({})}
+        return migrated, again, owners, list((await db.habits.index_information()).keys())
+
+    migrated, again, owners, indexes = asyncio.run(scenario())
+    assert migrated == {"habits": 1, "community_posts": 0, "chat_messages": 1}
+    assert not any(again.values())
+    assert owners == {"a": DEFAULT_USER, "b": "ana"}
+    assert indexes == ["_id_"]
+
+
+def test_routes_only_see_the_callers_data(run_api):
+    async def scenario(http, db):
+        ana = {"X-User-Id": "ana"}
+        bob = {"X-User-Id": "bob"}
+        habit = (await http.post("/api/habits", json={"name": "Read"}, headers=ana)).json()
+        await http.post("/api/habits", json={"name": "Run"}, headers=bob)
+        await http.post("/api/habits/log", json={"habit_id": habit["id"], "date": "2024-05-01"}, headers=ana)
+        foreign_log = await http.post("/api/habits/log", json={"habit_id": habit["id"]}, headers=bob)
+        foreign_delete = await http.delete(f"/api/habits/{habit['id']}", headers=bob)
+        listed = {
+            user: [h["name"] for h in (await http.get("/api/habits", headers=headers)).json()]
+            for user, headers in (("ana", ana), ("bob", bob))
+        }
+        stats = (await http.get("/api/stats", headers=bob)).json()
+        ranged = (await http.get("/api/stats/range", params={"from": "2024-05-01", "to": "2024-05-01"}, headers=bob)).json()
+        await http.post("/api/community", json={"content": "Hi"}, headers=ana)
+        feed = (await http.get("/api/community", headers=bob)).json()
+        invalid = await http.get("/api/habits", headers={"X-User-Id": "not valid"})
+        return foreign_log, foreign_delete, listed, stats, ranged, feed, invalid
+
+    foreign_log, foreign_delete, listed, stats, ranged, feed, invalid = run_api(scenario)
+    assert foreign_log.status_code == 404 and foreign_delete.status_code == 404
+    assert listed == {"ana": ["Read"], "bob": ["Run"]}
+    assert stats["total_habits"] == 1 and stats["total_completions"] == 0
+    assert ranged["total_completions"] == 0
+    assert [p["content"] for p in feed] == ["Hi"]
+    assert invalid.status_code == 400